@@ -0,0 +1,166 @@
+"""Circulation analytics for the librarian dashboard.
+
+circulation_monthly holds one row of counters per (month, genre), kept
+current by triggers on borrowings and reservations in the same transaction
+as each loan, return, reservation and hold change. The dashboard and its
+CSV export only ever read a primary key range of that table, a few hundred
+rows however long the history grows. Each event is counted in the month
+it happened:
+
+- loans in the month they were lent;
+- returns, loan days and late returns in the month the book came back;
+- reservations in the month they were placed;
+- fulfilled holds and wait days (reservation to collection) in the month
+  the member collected the book, expired holds in the month they lapsed.
+
+The genre is the book's genre when the event happened, '' for none.
+Archiving loans and reservations leaves the counters alone, so they keep
+covering history the live tables no longer hold. rebuild() recomputes them
+from the live and archived tables, e.g. after writing history with the
+triggers dropped; loans of deleted books are lost from the rebuild.
+
+    python analytics.py --rebuild
+    python analytics.py --months 12 > circulation.csv
+"""
+import csv
+import io
+from datetime import date
+
+DEFAULT_MONTHS = 12
+
+COUNTERS = ('loans', 'returns', 'loan_days', 'late_returns', 'reservations', 'fulfilled', 'expired',
+            'wait_days')
+
+# Columns of summary() and the CSV export, after the grouping columns.
+REPORT_COLUMNS = ('loans', 'returns', 'avg_loan_days', 'late_returns', 'reservations', 'fulfilled',
+                  'expired', 'avg_wait_days')
+
+GROUPINGS = {
+    'month': 'month',
+    'genre': 'genre',
+    'month_genre': 'month, genre',
+}
+
+SUMMARY_SQL = """
+    SELECT {group},
+           SUM(loans) AS loans,
+           SUM(returns) AS returns,
+           ROUND(SUM(loan_days) / NULLIF(SUM(returns), 0), 1) AS avg_loan_days,
+           SUM(late_returns) AS late_returns,
+           SUM(reservations) AS reservations,
+           SUM(fulfilled) AS fulfilled,
+           SUM(expired) AS expired,
+           ROUND(SUM(wait_days) / NULLIF(SUM(fulfilled), 0), 1) AS avg_wait_days
+    FROM circulation_monthly
+    WHERE month BETWEEN ? AND ?
+    GROUP BY {group}
+    ORDER BY {group}
+"""
+
+# One row per event, with the counters it adds to; rebuild() sums them.
+EVENTS_SQL = """
+    SELECT substr(bo.borrow_date, 1, 7) AS month, bo.book_id,
+           1 AS loans, 0 AS returns, 0 AS loan_days, 0 AS late_returns,
+           0 AS reservations, 0 AS fulfilled, 0 AS expired, 0 AS wait_days
+    FROM {loans} bo WHERE bo.borrow_date IS NOT NULL
+    UNION ALL
+    SELECT substr(bo.return_date, 1, 7), bo.book_id,
+           0, 1, COALESCE(julianday(bo.return_date) - julianday(bo.borrow_date), 0),
+           bo.due_date IS NOT NULL AND bo.return_date > bo.due_date,
+           0, 0, 0, 0
+    FROM {loans} bo WHERE bo.return_date IS NOT NULL
+    UNION ALL
+    SELECT substr(r.reservation_date, 1, 7), r.book_id, 0, 0, 0, 0, 1, 0, 0, 0
+    FROM {reservations} r WHERE r.reservation_date IS NOT NULL
+    UNION ALL
+    SELECT substr(r.fulfilled_date, 1, 7), r.book_id, 0, 0, 0, 0,
+           0, 1, 0, COALESCE(julianday(r.fulfilled_date) - julianday(r.reservation_date), 0)
+    FROM {reservations} r WHERE r.status = 'Fulfilled' AND r.fulfilled_date IS NOT NULL
+    UNION ALL
+    SELECT substr(COALESCE(r.hold_expires, r.reservation_date), 1, 7), r.book_id, 0, 0, 0, 0, 0, 0, 1, 0
+    FROM {reservations} r
+    WHERE r.status = 'Expired' AND COALESCE(r.hold_expires, r.reservation_date) IS NOT NULL
+"""
+
+def month_of(day):
+    """The 'YYYY-MM' key of a date."""
+    return day.strftime('%Y-%m')
+
+def default_range(today=None, months=DEFAULT_MONTHS):
+    """(first, last) month keys of the months months up to and including today's."""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}", month_of(today)
+
+def valid_month(value):
+    """True if value is a 'YYYY-MM' month key."""
+    try:
+        date.fromisoformat(value + '-01')
+    except (TypeError, ValueError):
+        return False
+    return len(value) == 7
+
+def summary(db, start, end, by='month'):
+    """Counters and averages for the months start..end, grouped by month, genre or month_genre."""
+    return db.execute(SUMMARY_SQL.format(group=GROUPINGS[by]), (start, end)).fetchall()
+
+def months_between(start, end):
+    """Every month key from start to end inclusive."""
+    year, month = map(int, start.split('-'))
+    months = []
+    while f"{year:04d}-{month:02d}" <= end:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def loans_by_genre(db, start, end):
+    """(months, [(genre, [loans per month])]) for the months start..end, busiest genre first."""
+    months = months_between(start, end)
+    counts = {}
+    for row in summary(db, start, end, 'month_genre'):
+        counts.setdefault(row['genre'], dict.fromkeys(months, 0))[row['month']] = row['loans']
+    table = [(genre, [per_month[m] for m in months]) for genre, per_month in counts.items()]
+    table.sort(key=lambda item: (-sum(item[1]), item[0]))
+    return months, table
+
+def iter_csv(db, start, end):
+    """Yield the month x genre report for start..end as CSV text."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('month', 'genre') + REPORT_COLUMNS)
+    writer.writerows(tuple(row) for row in summary(db, start, end, 'month_genre'))
+    yield buffer.getvalue()
+
+def rebuild(db):
+    """Recompute circulation_monthly from the live and archived history. Run in a transaction."""
+    events = ' UNION ALL '.join(EVENTS_SQL.format(loans=loans, reservations=reservations)
+                                for loans, reservations in (('borrowings', 'reservations'),
+                                                            ('borrowings_archive', 'reservations_archive')))
+    db.execute("DELETE FROM circulation_monthly")
+    db.execute(f"""
+        INSERT INTO circulation_monthly (month, genre, {', '.join(COUNTERS)})
+        SELECT e.month, COALESCE(b.genre, ''), {', '.join(f'SUM(e.{c})' for c in COUNTERS)}
+        FROM ({events}) e
+        JOIN books b ON b.id = e.book_id
+        GROUP BY e.month, COALESCE(b.genre, '')
+    """)
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    import database
+
+    parser = argparse.ArgumentParser(description="Circulation rollups.")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute the rollups from all history.")
+    parser.add_argument('--months', type=int, default=DEFAULT_MONTHS, help="Months of CSV to print.")
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.rebuild:
+        database.run_transaction(rebuild)
+        print("circulation rollups rebuilt")
+    else:
+        for chunk in iter_csv(database.get_db(), *default_range(months=args.months)):
+            sys.stdout.write(chunk)
+    database.close_db()
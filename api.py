@@ -0,0 +1,302 @@
+"""Versioned JSON API, mounted at /api/v1 next to the HTML routes.
+
+It authenticates with the same session cookie as the web pages (POST
+/api/v1/login to obtain one) and reuses the query and transaction
+functions in database.py. Checkouts and returns accept a list of ids and
+run in one transaction, so a kiosk can process a stack of books in a
+single request. Catalog reads carry an ETag keyed on the catalog version
+and answer If-None-Match / If-Modified-Since with 304.
+
+Errors are returned as {"error": message} with a 4xx status.
+"""
+import math
+from functools import wraps
+
+from flask import Blueprint, Response, jsonify, request, session
+from werkzeug.http import is_resource_modified
+
+import database
+import page_cache
+import passwords
+import ratelimit
+import recommendations
+from database import DatabaseError, TransactionConflict, get_db
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+BATCH_MAX = 50
+BOOKS_PER_PAGE = 20
+MEMBERS_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+@api.errorhandler(ApiError)
+def _api_error(e):
+    return jsonify(error=str(e)), e.status
+
+@api.errorhandler(TransactionConflict)
+def _conflict(e):
+    return jsonify(error=str(e)), 409
+
+@api.errorhandler(DatabaseError)
+def _database_error(e):
+    return jsonify(error=f"Database error: {e}"), 500
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            raise ApiError("Authentication required.", 401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def api_role_required(role):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if session.get('role') != role:
+                raise ApiError("Access denied.", 403)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def _json_body():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ApiError("Expected a JSON object body.")
+    return data
+
+def _id_list(data, key):
+    """Read data[key] as a non-empty list of at most BATCH_MAX integer ids."""
+    ids = data.get(key)
+    if not isinstance(ids, list) or not ids:
+        raise ApiError(f"'{key}' must be a non-empty list of ids.")
+    if len(ids) > BATCH_MAX:
+        raise ApiError(f"At most {BATCH_MAX} ids per request.")
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ApiError(f"'{key}' must contain integer ids.")
+    return ids
+
+def _book_fields(data, required=()):
+    """The title, author and genre in data: non-empty strings, except genre may be null."""
+    fields = {k: data[k] for k in database.BOOK_FIELDS if k in data}
+    for name in required:
+        if name not in fields:
+            raise ApiError(f"'{name}' is required.")
+    for name, value in fields.items():
+        if name == 'genre' and value is None:
+            continue
+        if not isinstance(value, str) or (name != 'genre' and not value.strip()):
+            raise ApiError(f"'{name}' must be a non-empty string." if name != 'genre'
+                           else "'genre' must be a string or null.")
+    return fields
+
+def _per_page(default):
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+def _acting_member():
+    """The member an operation is for: the caller, or ?user_id= / "user_id" for librarians."""
+    if session.get('role') == 'Librarian':
+        user_id = request.args.get('user_id', type=int)
+        if user_id is None and request.is_json:
+            user_id = (request.get_json(silent=True) or {}).get('user_id')
+            if user_id is not None and (not isinstance(user_id, int) or isinstance(user_id, bool)):
+                raise ApiError("'user_id' must be an integer.")
+        if user_id is None:
+            raise ApiError("Librarians must pass the member's user_id.")
+        member = database.get_user_by_id(user_id)
+        if member is None or member['role'] != 'Member':
+            raise ApiError("Member not found.", 404)
+        return user_id
+    return session['user_id']
+
+def _conditional(payload, etag, last_modified=None):
+    """JSON response with validators, or 304 if the client's copy is current."""
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _batch_response(results, key):
+    """200 with per-item outcomes; 409 if every item failed."""
+    items = [{key: item, 'ok': error is None, 'result': result, 'error': error}
+             for item, result, error in results]
+    status = 409 if all(error is not None for _, _, error in results) else 200
+    return jsonify(results=items, succeeded=sum(item['ok'] for item in items)), status
+
+@api.route('/login', methods=['POST'])
+def login():
+    data = _json_body()
+    username = data.get('username')
+    retry_after = ratelimit.check_login(username, request.remote_addr)
+    if retry_after:
+        response = jsonify(error="Too many login attempts, try again later.")
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response, 429
+    try:
+        user = database.check_user_credentials(username, data.get('password') or '')
+    except passwords.HashPoolBusy as e:
+        return jsonify(error=str(e)), 503, {'Retry-After': '1'}
+    if user is None:
+        raise ApiError("Invalid credentials.", 401)
+    ratelimit.login_succeeded(username)
+    session['user_id'] = user['id']
+    session['role'] = user['role']
+    return jsonify(id=user['id'], username=user['username'], role=user['role'])
+
+@api.route('/logout', methods=['POST'])
+def logout():
+    session.clear()
+    return '', 204
+
+@api.route('/books')
+@api_login_required
+def list_books():
+    search = request.args.get('search', '')
+    sort = request.args.get('sort', 'id')
+    per_page = _per_page(BOOKS_PER_PAGE)
+    after = request.args.get('after')
+    before = request.args.get('before') if after is None else None
+
+    version, changed_at = page_cache.books_version(get_db())
+    key = (version, search, sort, per_page, after, before)
+    etag = page_cache.make_etag('api', key)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=changed_at):
+        return _conditional(None, etag, changed_at)
+    page = page_cache.books_fragment(*key)
+    books = [{k: v for k, v in book.items() if k != 'sort_key'} for book in page['books']]
+    return _conditional({'books': books, 'total': page['total_books'],
+                         'next': page['next_cursor'], 'prev': page['prev_cursor']}, etag, changed_at)
+
+@api.route('/books/<int:book_id>')
+@api_login_required
+def get_book(book_id):
+    db = get_db()
+    version, changed_at = page_cache.catalog_version(db)
+    etag = page_cache.make_etag('api-book', version, book_id)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=changed_at):
+        return _conditional(None, etag, changed_at)
+    book = database.get_book(book_id)
+    if book is None:
+        raise ApiError("Book not found.", 404)
+    return _conditional(dict(book), etag, changed_at)
+
+@api.route('/books/popular')
+@api_login_required
+def popular_books():
+    return jsonify(books=recommendations.popular(get_db(), _per_page(recommendations.TOP_K)))
+
+@api.route('/books/<int:book_id>/similar')
+@api_login_required
+def similar_books(book_id):
+    """Books most often borrowed by members who also borrowed this one."""
+    limit = _per_page(recommendations.TOP_K)
+    return jsonify(books=recommendations.similar(get_db(), [book_id], limit)[book_id])
+
+@api.route('/recommendations')
+@api_login_required
+def member_recommendations():
+    limit = _per_page(recommendations.TOP_K)
+    return jsonify(books=recommendations.for_member(get_db(), _acting_member(), limit))
+
+@api.route('/books', methods=['POST'])
+@api_login_required
+@api_role_required('Librarian')
+def create_book():
+    fields = _book_fields(_json_body(), required=('title', 'author'))
+    book_id = database.add_book(fields['title'], fields['author'], fields.get('genre'))
+    page_cache.book_counts.invalidate()
+    return jsonify(dict(database.get_book(book_id))), 201
+
+@api.route('/books/<int:book_id>', methods=['PATCH'])
+@api_login_required
+@api_role_required('Librarian')
+def update_book(book_id):
+    fields = _book_fields(_json_body())
+    if not fields:
+        raise ApiError("Nothing to update.")
+    if not database.update_book(book_id, **fields):
+        raise ApiError("Book not found.", 404)
+    page_cache.book_counts.invalidate()
+    return jsonify(dict(database.get_book(book_id)))
+
+@api.route('/books/<int:book_id>', methods=['DELETE'])
+@api_login_required
+@api_role_required('Librarian')
+def delete_book(book_id):
+    if not database.delete_book(book_id):
+        raise ApiError("Book not found.", 404)
+    page_cache.book_counts.invalidate()
+    return '', 204
+
+@api.route('/borrowings')
+@api_login_required
+def list_borrowings():
+    return jsonify(borrowings=database.get_borrowed_books(_acting_member()))
+
+@api.route('/borrowings', methods=['POST'])
+@api_login_required
+def checkout():
+    """Borrow one or more books: {"book_ids": [...]} (librarians add "user_id")."""
+    user_id = _acting_member()
+    book_ids = _id_list(_json_body(), 'book_ids')
+    return _batch_response(database.lend_books(book_ids, user_id), 'book_id')
+
+@api.route('/returns', methods=['POST'])
+@api_login_required
+def checkin():
+    """Return books by {"book_ids": [...]} or {"borrowing_ids": [...]}.
+
+    Members can only return their own loans; librarians can return any.
+    """
+    data = _json_body()
+    owner = None if session.get('role') == 'Librarian' else session['user_id']
+    if 'borrowing_ids' in data:
+        ids = _id_list(data, 'borrowing_ids')
+        return _batch_response(database.return_borrowings(ids, owner), 'borrowing_id')
+    ids = _id_list(data, 'book_ids')
+    return _batch_response(database.return_books(ids, owner), 'book_id')
+
+@api.route('/reservations')
+@api_login_required
+def list_reservations():
+    rows = database.get_reservations_by_user(_acting_member())
+    return jsonify(reservations=[dict(row) for row in rows])
+
+@api.route('/reservations', methods=['POST'])
+@api_login_required
+def reserve():
+    """Join the queue for one or more books: {"book_ids": [...]}."""
+    user_id = _acting_member()
+    book_ids = _id_list(_json_body(), 'book_ids')
+    return _batch_response(database.queue_reservations(book_ids, user_id), 'book_id')
+
+@api.route('/members')
+@api_login_required
+@api_role_required('Librarian')
+def list_members():
+    page = database.get_members_page(request.args.get('search', '').strip(), _per_page(MEMBERS_PER_PAGE),
+                                     request.args.get('after'), request.args.get('before'))
+    return jsonify(members=page['members'], next=page['next_cursor'], prev=page['prev_cursor'])
+
+@api.route('/members/<int:member_id>')
+@api_login_required
+def get_member(member_id):
+    if session.get('role') != 'Librarian' and session['user_id'] != member_id:
+        raise ApiError("Access denied.", 403)
+    member = database.get_user_by_id(member_id)
+    if member is None:
+        raise ApiError("Member not found.", 404)
+    return jsonify(id=member['id'], username=member['username'], name=member['name'],
+                   email=member['email'], role=member['role'],
+                   borrowings=database.get_borrowed_books(member_id))
@@ -1,23 +1,146 @@
 from inspect import getmembers
-from flask import Flask, flash, render_template, request, redirect, url_for, session, g
-from database import init_db, get_db
+from flask import (Flask, flash, render_template, request, redirect, url_for, session, g, jsonify,
+                   Response, stream_with_context)
+from database import (init_db, init_app, get_db, pool_stats, transaction_stats, DatabaseError, TransactionConflict,
+                      lend_book, return_borrowing, queue_reservation, get_user_by_id)
+import backends
+import database
+import recommendations
+import analytics
+import jobs
+import notifications
+import catalog_io
+import metrics
+import page_cache
+import passwords
+import ratelimit
+import sessions
+from passwords import HashPoolBusy
+from api import api
+import atexit
+import csv
+import io
+import secrets
+from pagination import CountCache
 from functools import wraps
-import sqlite3
 import math
 from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.http import is_resource_modified
 
 
 app = Flask(__name__)
-app.secret_key = "supersecretkey"  
 app.permanent_session_lifetime = timedelta(minutes=30)  
-init_db()
+app.config.setdefault('DATABASE', database.DATABASE)
+app.config.setdefault('DB_POOL_SIZE', database.POOL_SIZE)
+app.config.setdefault('DB_POOL_TIMEOUT', database.POOL_TIMEOUT)
+app.config.setdefault('STORAGE_PROFILE', None)
+app.config.setdefault('MIGRATE_ON_START', True)
+app.config.setdefault('BACKGROUND_JOBS', True)
+app.config.setdefault('BOOKS_PER_PAGE', 5)
+app.config.setdefault('BOOKS_MAX_PER_PAGE', 100)
+app.config.setdefault('BOOK_COUNT_TTL', 30)
+app.config.setdefault('MEMBERS_PER_PAGE', 20)
+app.config.setdefault('MEMBERS_MAX_PER_PAGE', 100)
+app.config.setdefault('OVERDUE_PER_PAGE', 50)
+app.config.setdefault('PAGE_CACHE_MAX_BYTES', page_cache.PAGE_CACHE_MAX_BYTES)
+app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', page_cache.FRAGMENT_CACHE_MAX_BYTES)
+app.config.setdefault('PAGE_CACHE_TTL', page_cache.CACHE_TTL)
+app.config.setdefault('PASSWORD_HASH_METHOD', passwords.HASH_METHOD)
+app.config.setdefault('HASH_WORKERS', passwords.HASH_WORKERS)
+app.config.setdefault('HASH_QUEUE_DEPTH', passwords.HASH_QUEUE_DEPTH)
+app.config.setdefault('LOGIN_ACCOUNT_BURST', ratelimit.LOGIN_ACCOUNT_BURST)
+app.config.setdefault('LOGIN_ACCOUNT_RATE', ratelimit.LOGIN_ACCOUNT_RATE)
+app.config.setdefault('LOGIN_IP_BURST', ratelimit.LOGIN_IP_BURST)
+app.config.setdefault('LOGIN_IP_RATE', ratelimit.LOGIN_IP_RATE)
+app.config.setdefault('SESSION_STORE', 'sqlite')
+app.config.setdefault('SESSION_MAX_ENTRIES', sessions.MAX_ENTRIES)
+app.config.setdefault('SESSION_POOL_SIZE', sessions.POOL_SIZE)
+app.config.setdefault('JOB_WORKERS', jobs.WORKERS)
+app.config.setdefault('JOB_POLL_INTERVAL', jobs.POLL_INTERVAL)
+app.config.setdefault('JOB_MAX_ATTEMPTS', jobs.MAX_ATTEMPTS)
+app.config.setdefault('NOTIFY_SMTP_HOST', notifications.SMTP_HOST)
+app.config.setdefault('NOTIFY_SMTP_PORT', notifications.SMTP_PORT)
+app.config.setdefault('NOTIFY_MAIL_FROM', notifications.MAIL_FROM)
+app.config.setdefault('NOTIFY_WEBHOOK_URL', notifications.WEBHOOK_URL)
+book_counts = page_cache.book_counts
+overdue_totals = CountCache(ttl=app.config['BOOK_COUNT_TTL'])
+
+def load_config(config=None):
+    """Apply LIBRARY_* environment variables, then config, to app.config and the modules it drives.
+
+    Values are parsed as JSON where possible, so LIBRARY_HASH_WORKERS=4 is an
+    int and LIBRARY_BACKGROUND_JOBS=false a bool.
+    """
+    app.config.from_prefixed_env('LIBRARY')
+    if config:
+        app.config.update(config)
+    if not app.secret_key:
+        # Sessions are kept server-side (sessions.py), so nothing users hold depends on the key.
+        app.secret_key = secrets.token_hex(32)
+    database.DATABASE = app.config['DATABASE']
+    database.POOL_SIZE = app.config['DB_POOL_SIZE']
+    database.POOL_TIMEOUT = app.config['DB_POOL_TIMEOUT']
+    jobs.WORKERS = app.config['JOB_WORKERS']
+    jobs.POLL_INTERVAL = app.config['JOB_POLL_INTERVAL']
+    jobs.MAX_ATTEMPTS = app.config['JOB_MAX_ATTEMPTS']
+    if app.config['STORAGE_PROFILE']:
+        backends.configure_storage(app.config['STORAGE_PROFILE'])
+    return app.config
+
+def create_app(config=None):
+    """Configure the app and start its services; call once per process.
+
+    Routes are registered on the module-level app at import, which has no
+    other side effects. MIGRATE_ON_START=False skips migrations for servers
+    that run them once before starting workers, and BACKGROUND_JOBS=False
+    leaves the checkpointer, hold sweeper, overdue scanner and job workers
+    to another process.
+    """
+    if 'library' in app.extensions:
+        return app
+    load_config(config)
+    if app.config['MIGRATE_ON_START']:
+        init_db()
+    init_app(app, background=app.config['BACKGROUND_JOBS'])
+    sessions.init_app(app, database.get_backend())
+    metrics.init_app(app)
+    metrics.register_gauges(lambda: {
+        'library_db_pool_in_use': pool_stats()['in_use'],
+        'library_db_pool_size': pool_stats()['size'],
+        'library_db_busy_retries': transaction_stats()['busy_retries'],
+        'library_page_cache_hit_rate': page_cache.page_cache.stats()['hit_rate'],
+        'library_user_cache_hit_rate': database.user_cache.stats()['hit_rate'],
+        'library_password_hash_pending': passwords.pool_stats()['pending'],
+    })
+    metrics.register_gauges(lambda: {
+        f"library_jobs_{name}": value for name, value in database.job_stats().items()
+    })
+    app.register_blueprint(api)
+    page_cache.configure(app.config['PAGE_CACHE_MAX_BYTES'], app.config['FRAGMENT_CACHE_MAX_BYTES'],
+                         app.config['PAGE_CACHE_TTL'], app.config['BOOK_COUNT_TTL'])
+    overdue_totals.ttl = app.config['BOOK_COUNT_TTL']
+    passwords.configure(app.config['PASSWORD_HASH_METHOD'], app.config['HASH_WORKERS'],
+                        app.config['HASH_QUEUE_DEPTH'])
+    ratelimit.configure_login(app.config['LOGIN_ACCOUNT_BURST'], app.config['LOGIN_ACCOUNT_RATE'],
+                              app.config['LOGIN_IP_BURST'], app.config['LOGIN_IP_RATE'])
+    notifications.configure(app.config['NOTIFY_SMTP_HOST'], app.config['NOTIFY_SMTP_PORT'],
+                            app.config['NOTIFY_MAIL_FROM'], app.config['NOTIFY_WEBHOOK_URL'])
+    app.extensions['library'] = True
+    atexit.register(shutdown_app)
+    return app
+
+def shutdown_app():
+    """Stop the background jobs and hashing pool and close the pooled and session connections."""
+    if isinstance(app.session_interface, sessions.ServerSessionInterface):
+        app.session_interface.store.close()
+    database.shutdown()
+    passwords.shutdown()
 
 def hash_password(password):
-    return generate_password_hash(password)
+    return passwords.hash_password(password)
 
 def check_user_password(stored_hash, password):
-    return check_password_hash(stored_hash, password)
+    return passwords.check_password(stored_hash, password)
 
 def login_required(f):
     @wraps(f)
@@ -45,19 +168,19 @@ def register():
         email = request.form['email']
         password = request.form['password']
         role = request.form['role']
-        db = get_db()
 
-        user_check = db.execute("SELECT * FROM users WHERE username = ?", (userid,)).fetchone()
-        if user_check:
+        if database.get_user_by_username(userid):
             return "User ID already exists"
 
         try:
-            db.execute("INSERT INTO users (username, password_hash, role, name, email) VALUES (?, ?, ?, ?, ?)",
-                       (userid, hash_password(password), role, name, email))
-            db.commit()
-            return redirect(url_for('login'))
-        except sqlite3.Error as e:
+            created = database.create_user(userid, password, role, name, email)
+        except HashPoolBusy as e:
+            return str(e), 503, {'Retry-After': '1'}
+        except DatabaseError as e:
             return f"An error occurred: {e}"
+        if isinstance(created, str):
+            return created
+        return redirect(url_for('login'))
 
     return render_template('register.html')
 
@@ -66,13 +189,19 @@ def login():
     if request.method == 'POST':
         userid = request.form['username']  
         password = request.form['password'] 
-        db = get_db()
-
 
-        user = db.execute("SELECT * FROM users WHERE username = ?", (userid,)).fetchone()
+        # Throttle before hashing, so a storm of guesses costs no KDF work.
+        retry_after = ratelimit.check_login(userid, request.remote_addr)
+        if retry_after:
+            return "Too many login attempts, try again later.", 429, {'Retry-After': str(math.ceil(retry_after))}
 
+        try:
+            user = database.check_user_credentials(userid, password)
+        except HashPoolBusy as e:
+            return str(e), 503, {'Retry-After': '1'}
 
-        if user and check_password_hash(user['password_hash'], password):  
+        if user:
+            ratelimit.login_succeeded(userid)
             session['user_id'] = user['id']
             session['role'] = user['role']
             return redirect(url_for('index')) 
@@ -85,61 +214,80 @@ def login():
 @login_required
 @role_required('Librarian')
 def members():
-    db = get_db()
+    per_page = request.args.get('per_page', app.config['MEMBERS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['MEMBERS_MAX_PER_PAGE']))
+    search = request.args.get('search', '').strip()
+    page = database.get_members_page(search, per_page, request.args.get('after'), request.args.get('before'))
+    return render_template('members.html', search=search, **page)
+
+@app.route('/member_history/<int:member_id>')
+@login_required
+@role_required('Librarian')
+def member_history(member_id):
+    member = get_user_by_id(member_id)
+    if not member:
+        flash("Member not found.", "error")
+        return redirect(url_for('members'))
 
-    members_data = db.execute("""
-        SELECT u.id, u.name, u.email, b.title, b.author, bo.borrow_date, bo.return_date
-        FROM users u
-        LEFT JOIN borrowings bo ON u.id = bo.user_id
-        LEFT JOIN books b ON bo.book_id = b.id
-        WHERE u.role = 'Member'
-    """).fetchall()
-
-    members_dict = {}
-    for row in members_data:
-        member_id = row['id']
-        if member_id not in members_dict:
-            members_dict[member_id] = {
-                'id': member_id,
-                'name': row['name'],
-                'email': row['email'],
-                'borrowed_books': [],
-                'returned_books': []
-            }
-        
-        book = {
-            'title': row['title'],
-            'author': row['author'],
-            'borrow_date': row['borrow_date'],
-        }
-
-        if row['return_date']:
-            book['return_date'] = row['return_date']
-            members_dict[member_id]['returned_books'].append(book)  
-        else:
-            members_dict[member_id]['borrowed_books'].append(book) 
-
-    members_list = list(members_dict.values())
-
-    return render_template('members.html', members=members_list)
+    per_page = request.args.get('per_page', app.config['MEMBERS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['MEMBERS_MAX_PER_PAGE']))
+    page = database.get_member_history_page(member_id, per_page, request.args.get('after'))
 
-@app.route('/delete_member/<int:member_id>', methods=['POST'])
+    return render_template('member_history.html', member=member, per_page=per_page, **page)
+
+@app.route('/overdue')
 @login_required
 @role_required('Librarian')
-def delete_member(member_id):
+def overdue():
+    now = datetime.now()
+
+    per_page = request.args.get('per_page', app.config['OVERDUE_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['MEMBERS_MAX_PER_PAGE']))
+    page = database.get_overdue_page(now, per_page, request.args.get('after'))
+    total, fines = overdue_totals.get(None, lambda: database.get_overdue_totals(now))
+
+    return render_template('overdue.html', total=total, fines=fines, per_page=per_page, **page)
+
+def _dashboard_range():
+    """(start, end) months from the query string, defaulting to the last twelve."""
+    start, end = analytics.default_range()
+    requested = request.args.get('start', start), request.args.get('end', end)
+    if not all(analytics.valid_month(month) for month in requested):
+        flash("Months must be given as YYYY-MM.", 'error')
+        return start, end
+    return min(requested), max(requested)
+
+@app.route('/dashboard')
+@login_required
+@role_required('Librarian')
+def dashboard():
     db = get_db()
+    start, end = _dashboard_range()
+    # Every query reads a primary key range of the circulation_monthly rollup.
+    months, loans_by_genre = analytics.loans_by_genre(db, start, end)
+    return render_template('dashboard.html', start=start, end=end,
+                           by_month=analytics.summary(db, start, end, 'month'),
+                           by_genre=analytics.summary(db, start, end, 'genre'),
+                           months=months, loans_by_genre=loans_by_genre)
+
+@app.route('/dashboard/export')
+@login_required
+@role_required('Librarian')
+def export_dashboard():
+    start, end = _dashboard_range()
+    return Response(stream_with_context(analytics.iter_csv(get_db(), start, end)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=circulation-{start}-{end}.csv'})
 
-    member_borrowings = db.execute("""
-        SELECT COUNT(*) AS count FROM borrowings
-        WHERE user_id = ? AND return_date IS NULL
-    """, (member_id,)).fetchone()
-
-    if member_borrowings['count'] > 0:
+@app.route('/delete_member/<int:member_id>', methods=['POST'])
+@login_required
+@role_required('Librarian')
+def delete_member(member_id):
+    if database.open_loan_count(member_id) > 0:
         flash('Member cannot be deleted because they have active borrowings.', 'error')
         return redirect(url_for('members'))
 
-    db.execute("DELETE FROM users WHERE id = ?", (member_id,))
-    db.commit()
+    database.delete_user(member_id)
+    sessions.revoke_user(member_id)
     flash('Member successfully deleted.', 'success')
     return redirect(url_for('members'))
 
@@ -152,23 +300,18 @@ def logout():
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
-    db = get_db()
     user_id = session['user_id']
     
-    borrowed_books = db.execute("""
-        SELECT b.title, b.author, bo.borrow_date FROM borrowings bo
-        JOIN books b ON bo.book_id = b.id
-        WHERE bo.user_id = ? AND bo.return_date IS NULL
-    """, (user_id,)).fetchall()
+    borrowed_books = database.get_borrowed_books(user_id)
 
     if request.method == 'POST':
         name = request.form['name']
         email = request.form['email']
-        db.execute("UPDATE users SET name = ?, email = ? WHERE id = ?", (name, email, user_id))
-        db.commit()
+        database.update_user(user_id, name, email)
     
-    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    return render_template('profile.html', user=user, borrowed_books=borrowed_books)
+    user = get_user_by_id(user_id)
+    recommended = recommendations.for_member(get_db(), user_id) if session.get('role') == 'Member' else []
+    return render_template('profile.html', user=user, borrowed_books=borrowed_books, recommended=recommended)
 
 @app.route('/')
 @login_required
@@ -180,59 +323,55 @@ def index():
 def books():
     db = get_db()
 
-    page = request.args.get('page', 1, type=int)
-    per_page = 5
-    search = request.form.get('search', '')  
-    
-    query = """
-        SELECT b.*, 
-               (SELECT COUNT(*) FROM borrowings WHERE book_id = b.id AND return_date IS NULL) AS is_borrowed,
-               (SELECT user_id FROM borrowings WHERE book_id = b.id AND return_date IS NULL LIMIT 1) AS borrowed_by_user_id
-        FROM books b
-        WHERE b.title LIKE ? OR b.author LIKE ? OR b.genre LIKE ?
-        LIMIT ? OFFSET ?
-    """
-    
-    search_pattern = f"%{search}%"  
-    books = db.execute(query, (search_pattern, search_pattern, search_pattern, per_page, (page - 1) * per_page)).fetchall()
-
-    total_books = db.execute("""
-        SELECT COUNT(*) 
-        FROM books b
-        WHERE b.title LIKE ? OR b.author LIKE ? OR b.genre LIKE ?
-    """, (search_pattern, search_pattern, search_pattern)).fetchone()[0]
-    
-    total_pages = (total_books + per_page - 1) // per_page
-
-    books_data = []
-    for book in books:
-        book_dict = dict(book) 
-        if book_dict['is_borrowed'] > 0:
-            book_dict['status'] = 'Borrowed'
-        else:
-            book_dict['status'] = 'Available'
-
-        book_dict['borrowed_by_user_id'] = book_dict['borrowed_by_user_id']
-        books_data.append(book_dict)
-
-    return render_template('books.html', books=books_data, page=page, total_pages=total_pages, search=search)
-
+    per_page = request.args.get('per_page', app.config['BOOKS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['BOOKS_MAX_PER_PAGE']))
+    search = request.values.get('search', '')
+    after = request.args.get('after')
+    before = request.args.get('before') if after is None else None
+    sort = request.args.get('sort', 'id')
+
+    # Members see borrow/reserve buttons that depend on who they are;
+    # librarians all see the same page.
+    version, changed_at = page_cache.books_version(db)
+    role = session.get('role')
+    viewer = (role, session['user_id'] if role == 'Member' else None)
+    fragment_key = (version, search, sort, per_page, after, before)
+    etag = page_cache.make_etag(fragment_key, viewer)
+
+    if request.method == 'GET' and not is_resource_modified(request.environ, etag=etag,
+                                                            last_modified=changed_at):
+        response = Response(status=304)
+    else:
+        body = page_cache.page_cache.get(etag)
+        if body is None:
+            fragment = page_cache.books_fragment(*fragment_key)
+            body = render_template('books.html', search=search, **fragment).encode('utf-8')
+            page_cache.page_cache.set(etag, body)
+        response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.last_modified = changed_at
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
 
 @app.route('/my_books')
 @login_required
 @role_required('Member')
 def my_books():
-    db = get_db()
-
-    borrowed_books = db.execute("""
-        SELECT b.title, b.author, bo.borrow_date, bo.return_date
-        FROM borrowings bo
-        JOIN books b ON bo.book_id = b.id
-        WHERE bo.user_id = ? AND bo.return_date IS NULL
-    """, (session['user_id'],)).fetchall()
+    borrowed_books = database.get_borrowed_books(session['user_id'])
 
     return render_template('my_books.html', borrowed_books=borrowed_books)
 
+@app.route('/notifications')
+@login_required
+def notifications_inbox():
+    db = get_db()
+    inbox = notifications.inbox(db, session['user_id'])
+    notifications.mark_read(db, session['user_id'])
+    db.commit()
+    return render_template('notifications.html', notifications=inbox)
+
 @app.route('/add_book', methods=['GET', 'POST'])
 @login_required
 @role_required('Librarian')
@@ -242,36 +381,60 @@ def add_book():
         author = request.form['author']
         genre = request.form['genre']
 
-        db = get_db()
-        db.execute("""
-            INSERT INTO books (title, author, genre)
-            VALUES (?, ?, ?)
-        """, (title, author, genre))
-        db.commit()
+        database.add_book(title, author, genre)
+        book_counts.invalidate()
         flash("New book added.", 'success')
         return redirect(url_for('books'))
 
     return render_template('edit_book.html', book=None)
 
+@app.route('/import_books', methods=['GET', 'POST'])
+@login_required
+@role_required('Librarian')
+def import_books():
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash("Choose a file to import.", 'danger')
+            return redirect(url_for('import_books'))
+
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        try:
+            report = catalog_io.import_books(get_db(), stream, catalog_io.detect_format(upload.filename)).as_dict()
+        except (UnicodeDecodeError, csv.Error) as e:
+            flash(f"Could not read the file: {e}", 'danger')
+            return redirect(url_for('import_books'))
+        book_counts.invalidate()
+        flash(f"Imported {report['inserted']} books.", 'success')
+
+    return render_template('import_books.html', report=report)
+
+@app.route('/export_books')
+@login_required
+@role_required('Librarian')
+def export_books():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in catalog_io.FORMATS:
+        return "Unsupported format", 400
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(catalog_io.iter_export(get_db(), fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=books.{fmt}'})
+
 @app.route('/edit_book/<int:book_id>', methods=['GET', 'POST'])
 @login_required
 @role_required('Librarian')
 def edit_book(book_id):
-    db = get_db()
-    book = db.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+    book = database.get_book(book_id)
 
     if request.method == 'POST':
         title = request.form['title']
         author = request.form['author']
         genre = request.form['genre']
 
-        db.execute("""
-            UPDATE books
-            SET title = ?, author = ?, genre = ?
-            WHERE id = ?
-        """, (title, author, genre, book_id))
-
-        db.commit()
+        database.update_book(book_id, title=title, author=author, genre=genre)
+        book_counts.invalidate()
         flash("Book has been updated.", 'success')
         return redirect(url_for('books'))
 
@@ -281,9 +444,8 @@ def edit_book(book_id):
 @login_required
 @role_required('Librarian')
 def delete_book(book_id):
-    db = get_db()
-    db.execute("DELETE FROM books WHERE id = ?", (book_id,))
-    db.commit()
+    database.delete_book(book_id)
+    book_counts.invalidate()
     flash("Book has been deleted.", 'success')
     return redirect(url_for('books'))
 
@@ -291,36 +453,13 @@ def delete_book(book_id):
 @login_required
 @role_required('Member')
 def borrow_book(book_id):
-    db = get_db()
-
-    book = db.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
-
-    if book is None:
-        flash("The requested book does not exist.", 'danger')
-        return redirect(url_for('books'))
-
-    if book['status'] == 'Available':
-        try:
-
-            db.execute("""
-                INSERT INTO borrowings (book_id, user_id, borrow_date)
-                VALUES (?, ?, ?)
-            """, (book_id, session['user_id'], datetime.now()))
-
-            db.execute("""
-                UPDATE books
-                SET status = 'Borrowed'
-                WHERE id = ?
-            """, (book_id,))
-            
-            db.commit()
-
-            flash("You have successfully borrowed the book.", 'success')
-        except Exception as e:
-            db.rollback()
-            flash(f"An error occurred while borrowing the book: {str(e)}", 'danger')
-    else:
-        flash("This book is currently not available.", 'danger')
+    try:
+        lend_book(book_id, session['user_id'])
+        flash("You have successfully borrowed the book.", 'success')
+    except TransactionConflict as e:
+        flash(str(e), 'danger')
+    except DatabaseError as e:
+        flash(f"An error occurred while borrowing the book: {str(e)}", 'danger')
 
     return redirect(url_for('books'))
 
@@ -328,33 +467,20 @@ def borrow_book(book_id):
 @login_required
 @role_required('Librarian')
 def return_book(borrowing_id):
-    db = get_db()
-
-    borrowing = db.execute("SELECT * FROM borrowings WHERE id = ?", (borrowing_id,)).fetchone()
-    if not borrowing:
-        flash("Borrowing record not found.", "danger")
-        return redirect(url_for('books'))
-
     try:
-
-        db.execute("UPDATE borrowings SET return_date = ? WHERE id = ?", (datetime.now(), borrowing_id))
-
-        next_reservation = db.execute("""
-            SELECT * FROM reservations 
-            WHERE book_id = ? 
-            ORDER BY queue_position LIMIT 1
-        """, (borrowing['book_id'],)).fetchone()
-
-        if next_reservation:
-
-            flash(f"Book is now available for {next_reservation['user_id']}.", "info")
-
-        db.commit()
-        flash("Book returned successfully.", "success")
-    except Exception as e:
-        db.rollback()
+        borrowing = return_borrowing(borrowing_id)
+    except TransactionConflict as e:
+        flash(str(e), "danger")
+        return redirect(url_for('books'))
+    except DatabaseError as e:
         flash(f"An error occurred: {str(e)}", "danger")
+        return redirect(url_for('books'))
+
+    if borrowing['held_for']:
+        holder = get_user_by_id(borrowing['held_for'])
+        flash(f"Book is now on hold for {holder['name'] or borrowing['held_for']}.", "info")
 
+    flash("Book returned successfully.", "success")
     return redirect(url_for('books'))
 
 
@@ -362,55 +488,19 @@ def return_book(borrowing_id):
 @login_required
 @role_required('Member')
 def my_borrowed_books():
-    db = get_db()
-    borrowed_books = db.execute("""
-        SELECT bo.id AS borrowing_id, b.title, b.author, bo.borrow_date, bo.return_date
-        FROM borrowings bo
-        JOIN books b ON bo.book_id = b.id
-        WHERE bo.user_id = ? 
-        ORDER BY bo.borrow_date DESC
-    """, (session['user_id'],)).fetchall()
+    borrowed_books = database.get_borrowing_history(session['user_id'])
     return render_template('my_borrowed_books.html', borrowed_books=borrowed_books)
 
 @app.route('/reserve_book/<int:book_id>', methods=['POST'])
 @login_required
 @role_required('Member')
 def reserve_book(book_id):
-    db = get_db()
-    user_id = session['user_id']
-
-    borrowed = db.execute("""
-        SELECT * FROM borrowings WHERE book_id = ? AND return_date IS NULL
-    """, (book_id,)).fetchone()
-
-    if not borrowed:
-        flash("The book is available! You can borrow it directly.", "info")
-        return redirect(url_for('books'))
-
-    existing_reservation = db.execute("""
-        SELECT * FROM reservations WHERE book_id = ? AND user_id = ?
-    """, (book_id, user_id)).fetchone()
-
-    if existing_reservation:
-        flash("You have already reserved this book.", "warning")
-        return redirect(url_for('books'))
-
-    last_position = db.execute("""
-        SELECT MAX(queue_position) FROM reservations WHERE book_id = ?
-    """, (book_id,)).fetchone()[0]
-
-    queue_position = (last_position or 0) + 1
-
     try:
-
-        db.execute("""
-            INSERT INTO reservations (book_id, user_id, reservation_date, queue_position)
-            VALUES (?, ?, ?, ?)
-        """, (book_id, user_id, datetime.now(), queue_position))
-        db.commit()
+        queue_position = queue_reservation(book_id, session['user_id'])
         flash(f"You have reserved the book. Your queue position is {queue_position}.", "success")
-    except Exception as e:
-        db.rollback()
+    except TransactionConflict as e:
+        flash(str(e), "warning")
+    except DatabaseError as e:
         flash(f"An error occurred: {str(e)}", "danger")
 
     return redirect(url_for('books'))
@@ -420,109 +510,54 @@ def reserve_book(book_id):
 @login_required
 @role_required('Librarian')
 def book_reservations(book_id):
-    db = get_db()
+    reservations = database.get_reservations_by_book(book_id)
+    book = database.get_book(book_id)
 
-    reservations = db.execute("""
-        SELECT r.queue_position, u.name, u.email, r.reservation_date
-        FROM reservations r
-        JOIN users u ON r.user_id = u.id
-        WHERE r.book_id = ?
-        ORDER BY r.queue_position
-    """, (book_id,)).fetchall()
-
-    parsed_reservations = []
-    for reservation in reservations:
-        reservation_date = reservation['reservation_date']
-        try:
-
-            parsed_date = datetime.strptime(reservation_date, '%Y-%m-%d %H:%M:%S')
-        except ValueError:
-
-            parsed_date = datetime.strptime(reservation_date, '%Y-%m-%d')
-
-        parsed_reservations.append({
-            'queue_position': reservation['queue_position'],
-            'name': reservation['name'],
-            'email': reservation['email'],
-            'reservation_date': parsed_date  # Pass as datetime
-        })
-
-    book = db.execute("SELECT title FROM books WHERE id = ?", (book_id,)).fetchone()
-
-    return render_template('book_reservations.html', reservations=parsed_reservations, book_title=book['title'])
+    return render_template('book_reservations.html', reservations=reservations, book_title=book['title'])
 
 @app.route('/my_reservations')
 @login_required
 @role_required('Member')
 def my_reservations():
-    db = get_db()
-    user_id = session['user_id']
-
-    reservations = db.execute("""
-        SELECT r.queue_position, b.title, b.author, r.reservation_date
-        FROM reservations r
-        JOIN books b ON r.book_id = b.id
-        WHERE r.user_id = ?
-        ORDER BY r.queue_position
-    """, (user_id,)).fetchall()
-
-    parsed_reservations = []
-    for reservation in reservations:
-        reservation_date = reservation['reservation_date']
-        try:
-
-            parsed_date = datetime.strptime(reservation_date, '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            try:
-
-                parsed_date = datetime.strptime(reservation_date, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-
-                parsed_date = datetime.strptime(reservation_date, '%Y-%m-%d')
-
-        parsed_reservations.append({
-            'queue_position': reservation['queue_position'],
-            'title': reservation['title'],
-            'author': reservation['author'],
-            'reservation_date': parsed_date  
-        })
+    reservations = database.get_reservations_by_user(session['user_id'])
 
-    return render_template('my_reservations.html', reservations=parsed_reservations)
+    return render_template('my_reservations.html', reservations=reservations)
 
 
 @app.route('/edit_member/<int:member_id>', methods=['GET', 'POST'])
 @login_required
 @role_required('Librarian')
 def edit_member(member_id):
-    db = get_db()
-
-    member = db.execute("SELECT * FROM users WHERE id = ?", (member_id,)).fetchone()
+    member = get_user_by_id(member_id)
 
     if not member:
         flash("Member not found.", "error")
         return redirect(url_for('members'))
 
-    borrowed_books = db.execute("""
-        SELECT bo.id AS borrowing_id, b.id AS book_id, b.title, b.author, bo.borrow_date, bo.return_date
-        FROM borrowings bo
-        JOIN books b ON bo.book_id = b.id
-        WHERE bo.user_id = ? AND bo.return_date IS NULL
-    """, (member_id,)).fetchall()
-
     member_data = dict(member)  
 
-    member_data['borrowed_books'] = [dict(book) for book in borrowed_books]
+    member_data['borrowed_books'] = database.get_borrowed_books(member_id)
 
     return render_template('edit_member.html', member=member_data)
 
+@app.route('/db_stats')
+@login_required
+@role_required('Librarian')
+def db_stats():
+    return jsonify(pool=pool_stats(), transactions=transaction_stats(), user_cache=database.user_cache.stats(),
+                   page_cache=page_cache.stats(), password_hashing=passwords.pool_stats(),
+                   login_limits=ratelimit.login_stats(), sessions=sessions.stats(), jobs=database.job_stats(),
+                   routes=metrics.route_summary())
+
 @app.route('/return_book/<int:book_id>/<int:member_id>', methods=['POST'])
 @login_required
 @role_required('Librarian')
 def return_book_action(book_id, member_id):
-    return_book(book_id, member_id)
+    database.return_book(book_id, member_id)
     flash("Book marked as returned.")
     return redirect(url_for('edit_member', member_id=member_id))
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server only; see serve.py for production.
+    create_app({'DEBUG': True}).run(debug=True)
@@ -0,0 +1,104 @@
+"""Move old closed loans and finished reservations out of the hot tables.
+
+Returned borrowings and Fulfilled/Expired reservations older than the cutoff
+are copied into borrowings_archive / reservations_archive and deleted from
+the live tables in small batches, one short write transaction per batch, so
+the app keeps serving borrows and returns while the archiver runs. Member
+history reads both through the borrowing_history view.
+
+    python archive.py --older-than-days 365 --batch-size 500 --pause 0.05
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+OLDER_THAN_DAYS = 365
+BATCH_SIZE = 500
+PAUSE = 0.05
+
+BORROWING_COLUMNS = ("id, book_id, user_id, borrow_date, return_date, due_date, fine_cents, fine_per_day_cents, "
+                     "max_fine_cents, fines_through")
+RESERVATION_COLUMNS = ("id, book_id, user_id, reservation_date, queue_position, status, "
+                       "hold_expires, fulfilled_date")
+
+# Candidate lookups are served by the partial indexes from migration 10, so
+# open loans and active queue entries are never visited.
+CLOSED_BORROWINGS_SQL = """
+    SELECT id FROM borrowings
+    WHERE return_date IS NOT NULL AND return_date < ?
+    ORDER BY return_date LIMIT ?
+"""
+FINISHED_RESERVATIONS_SQL = """
+    SELECT id FROM reservations
+    WHERE status IN ('Fulfilled', 'Expired') AND reservation_date < ?
+    ORDER BY reservation_date LIMIT ?
+"""
+
+def _move(db, table, columns, ids, archived_at):
+    marks = ','.join('?' * len(ids))
+    db.execute(f"""
+        INSERT OR REPLACE INTO {table}_archive ({columns}, archived_at)
+        SELECT {columns}, ? FROM {table} WHERE id IN ({marks})
+    """, (archived_at, *ids))
+    db.execute(f"DELETE FROM {table} WHERE id IN ({marks})", ids)
+
+def _archive_batch(select_sql, table, columns, cutoff, batch_size):
+    from database import run_transaction
+
+    def work(db):
+        ids = [row['id'] for row in db.execute(select_sql, (cutoff, batch_size))]
+        if ids:
+            _move(db, table, columns, ids, datetime.now())
+        return len(ids)
+    return run_transaction(work)
+
+def archive_history(older_than_days=OLDER_THAN_DAYS, batch_size=BATCH_SIZE, pause=PAUSE,
+                    now=None, progress=None):
+    """Archive everything closed before now - older_than_days.
+
+    Returns {'borrowings': n, 'reservations': n}. progress, if given, is
+    called with that dict after every batch. pause seconds are slept between
+    batches to leave the write lock free for the app.
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=older_than_days)
+    moved = {'borrowings': 0, 'reservations': 0}
+    jobs = (
+        ('borrowings', CLOSED_BORROWINGS_SQL, BORROWING_COLUMNS),
+        ('reservations', FINISHED_RESERVATIONS_SQL, RESERVATION_COLUMNS),
+    )
+    for table, select_sql, columns in jobs:
+        while True:
+            count = _archive_batch(select_sql, table, columns, cutoff, batch_size)
+            moved[table] += count
+            if progress:
+                progress(moved)
+            if count < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return moved
+
+def main(argv=None):
+    import database
+
+    parser = argparse.ArgumentParser(description="Archive old borrowing and reservation history.")
+    parser.add_argument('--older-than-days', type=int, default=OLDER_THAN_DAYS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=PAUSE,
+                        help="Seconds to sleep between batches.")
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    try:
+        moved = archive_history(args.older_than_days, args.batch_size, args.pause,
+                                progress=lambda m: print(f"\r{m}", end='', file=sys.stderr))
+        print(file=sys.stderr)
+        print(f"Archived {moved['borrowings']} borrowings and "
+              f"{moved['reservations']} reservations.")
+    finally:
+        database.close_db()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""Storage backends: how pooled connections are opened, set up and migrated.
+
+database.DATABASE is a connection string that names a backend:
+
+    library.db                    a SQLite file; a bare path, as before
+    sqlite:///library.db          the same, relative to the working directory
+    sqlite:////var/lib/library.db an absolute path
+    memory://test                 an in-memory SQLite database shared by every
+                                  connection in the process, as a stand-in for a
+                                  separate database server in tests and checks
+
+The connection pool, run_transaction() and the background jobs only use
+what Backend defines: connect(), begin() for a write transaction,
+is_busy() to tell a retryable lock error from a real failure, initialize()
+to migrate the schema, and close(). Every backend hands out DB-API
+connections that return rows addressable by column name and raise this
+module's DatabaseError, IntegrityError and OperationalError in place of
+their driver's exceptions, so nothing above the backend imports a driver.
+Another backend plugs in with register_backend(). The schema and queries
+are written in SQLite's dialect, so a server database also needs a driver
+that takes qmark parameters and a matching migration set.
+"""
+import sqlite3
+
+import metrics
+import timestamps
+
+# Named storage profiles for SQLite. 'legacy' reproduces SQLite's defaults (rollback journal),
+# 'wal' lets readers on /books and /members run while a borrow or return commits.
+STORAGE_PROFILES = {
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+        'checkpoint_interval': 0,
+        'checkpoint_mode': 'PASSIVE',
+    },
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+        'checkpoint_interval': 30,
+        'checkpoint_mode': 'PASSIVE',
+    },
+}
+STORAGE_PROFILE = dict(STORAGE_PROFILES['wal'])
+
+def configure_storage(profile=None, **overrides):
+    """Select a named storage profile and/or override individual settings.
+
+    Takes effect for connections opened afterwards; call before init_db().
+    """
+    if profile is not None:
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile}")
+        STORAGE_PROFILE.clear()
+        STORAGE_PROFILE.update(STORAGE_PROFILES[profile])
+    unknown = set(overrides) - set(STORAGE_PROFILE)
+    if unknown:
+        raise ValueError(f"Unknown storage settings: {', '.join(sorted(unknown))}")
+    STORAGE_PROFILE.update(overrides)
+    return dict(STORAGE_PROFILE)
+
+def apply_storage_profile(conn, profile=None):
+    """Apply the per-connection PRAGMAs of a storage profile."""
+    profile = STORAGE_PROFILE if profile is None else profile
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {int(profile['wal_autocheckpoint'])}")
+
+class DatabaseError(Exception):
+    """A failure reported by a backend's driver, which is kept as __cause__."""
+
+class IntegrityError(DatabaseError):
+    """A write broke a constraint, such as a unique index or a foreign key."""
+
+class OperationalError(DatabaseError):
+    """The database could not run a statement: it was locked, unreachable or out of connections."""
+
+def _translate(error):
+    """The DatabaseError to raise for a sqlite3 exception."""
+    if isinstance(error, sqlite3.IntegrityError):
+        return IntegrityError(str(error))
+    if isinstance(error, sqlite3.OperationalError):
+        return OperationalError(str(error))
+    return DatabaseError(str(error))
+
+class SQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection that raises DatabaseError and its subclasses instead of sqlite3's exceptions.
+
+    Statements, commits and rollbacks are covered; an error while stepping
+    a cursor past its first row still surfaces as sqlite3.Error.
+    """
+
+    def execute(self, sql, params=()):
+        try:
+            return super().execute(sql, params)
+        except sqlite3.Error as e:
+            raise _translate(e) from e
+
+    def executemany(self, sql, seq_of_params):
+        try:
+            return super().executemany(sql, seq_of_params)
+        except sqlite3.Error as e:
+            raise _translate(e) from e
+
+    def executescript(self, script):
+        try:
+            return super().executescript(script)
+        except sqlite3.Error as e:
+            raise _translate(e) from e
+
+    def commit(self):
+        try:
+            super().commit()
+        except sqlite3.Error as e:
+            raise _translate(e) from e
+
+    def rollback(self):
+        try:
+            super().rollback()
+        except sqlite3.Error as e:
+            raise _translate(e) from e
+
+class InstrumentedSQLiteConnection(metrics.InstrumentedConnection, SQLiteConnection):
+    """SQLiteConnection timed for the metrics registry."""
+
+class Backend:
+    """A database the pool can open connections to. Subclasses set scheme and implement connect()."""
+
+    scheme = None
+    # What connections raise, whichever driver is underneath.
+    Error = DatabaseError
+    IntegrityError = IntegrityError
+    OperationalError = OperationalError
+
+    def __init__(self, url):
+        self.url = url
+
+    @classmethod
+    def from_url(cls, url, location):
+        """Build the backend for url; location is the part after 'scheme://'."""
+        raise NotImplementedError
+
+    def connect(self):
+        """Open a new connection, ready for use by any thread."""
+        raise NotImplementedError
+
+    def begin(self, conn):
+        """Start a transaction that will write, taking the write lock up front where there is one."""
+        conn.execute("BEGIN")
+
+    def is_busy(self, error):
+        """True if error is a lock timeout worth retrying rather than a failure."""
+        return False
+
+    def initialize(self):
+        """Create the schema or bring it up to the latest migration."""
+        raise NotImplementedError
+
+    @property
+    def checkpoints(self):
+        """True if the database wants the background WAL checkpointer."""
+        return False
+
+    def close(self):
+        """Release anything the backend holds beyond its pooled connections."""
+
+class SQLiteBackend(Backend):
+    """A SQLite database file, tuned by the active storage profile."""
+
+    scheme = 'sqlite'
+
+    def __init__(self, url, path):
+        super().__init__(url)
+        self.path = path
+
+    @classmethod
+    def from_url(cls, url, location):
+        # sqlite:///relative.db and sqlite:////absolute.db, as in other connection strings.
+        if not location.startswith('/') or location == '/':
+            raise ValueError(f"Expected sqlite:///path, got {url}")
+        return cls(url, location[1:])
+
+    def _open(self, **kwargs):
+        return sqlite3.connect(self.path, check_same_thread=False, **kwargs)
+
+    def _connect(self, **kwargs):
+        try:
+            return self._open(**kwargs)
+        except sqlite3.Error as e:
+            raise _translate(e) from e
+
+    def connect(self):
+        factory = InstrumentedSQLiteConnection if metrics.ENABLED else SQLiteConnection
+        conn = self._connect(detect_types=timestamps.DETECT_TYPES, factory=factory)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        apply_storage_profile(conn)
+        return conn
+
+    def connect_maintenance(self):
+        """A plain connection for background upkeep such as checkpoints."""
+        conn = self._connect(factory=SQLiteConnection)
+        apply_storage_profile(conn)
+        return conn
+
+    def begin(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+
+    def is_busy(self, error):
+        code = getattr(error.__cause__, 'sqlite_errorcode', None)
+        if code is not None:
+            return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        return 'locked' in str(error) or 'busy' in str(error)
+
+    def initialize(self):
+        import migrations
+
+        try:
+            with self._open() as conn:
+                conn.execute(f"PRAGMA journal_mode = {STORAGE_PROFILE['journal_mode']}")
+                apply_storage_profile(conn)
+                migrations.migrate(conn)
+        except sqlite3.Error as e:
+            raise _translate(e) from e
+
+    @property
+    def checkpoints(self):
+        return bool(STORAGE_PROFILE['checkpoint_interval']) and STORAGE_PROFILE['journal_mode'].upper() == 'WAL'
+
+class MemoryBackend(SQLiteBackend):
+    """A named in-memory SQLite database, shared by every connection in the process.
+
+    It lives while the backend holds its anchor connection and is gone after
+    close(), so each test or check starts from an empty, migrated schema
+    without touching the disk. Connections read uncommitted data so a
+    reader never fails on another connection's table lock.
+    """
+
+    scheme = 'memory'
+
+    def __init__(self, url, name):
+        super().__init__(url, f"file:{name}?mode=memory&cache=shared")
+        self._anchor = sqlite3.connect(self.path, uri=True, check_same_thread=False)
+
+    @classmethod
+    def from_url(cls, url, location):
+        return cls(url, location or 'library')
+
+    def _open(self, **kwargs):
+        conn = sqlite3.connect(self.path, uri=True, check_same_thread=False, **kwargs)
+        conn.execute("PRAGMA read_uncommitted = 1")
+        return conn
+
+    def initialize(self):
+        import migrations
+
+        conn = self._connect()
+        try:
+            migrations.migrate(conn)
+        finally:
+            conn.close()
+
+    @property
+    def checkpoints(self):
+        return False
+
+    def close(self):
+        if self._anchor is not None:
+            self._anchor.close()
+            self._anchor = None
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'memory': MemoryBackend,
+}
+
+def register_backend(cls):
+    """Make cls available under its scheme in connection strings."""
+    BACKENDS[cls.scheme] = cls
+    return cls
+
+def backend_for(url):
+    """The backend named by a connection string; a string without a scheme is a SQLite path."""
+    scheme, separator, location = url.partition('://')
+    if not separator:
+        return SQLiteBackend(url, url)
+    if scheme not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{scheme}' in {url}")
+    return BACKENDS[scheme].from_url(url, location)
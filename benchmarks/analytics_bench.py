@@ -0,0 +1,119 @@
+"""Time the circulation dashboard queries against the raw history they summarise.
+
+Times the dashboard's rollup reads for the last --months months, the same
+loans-per-genre-per-month report computed straight from the live and
+archived loans, a full rebuild() of the rollups, and what the rollup
+triggers add to each loan written. The trigger comparison runs inside
+transactions that are rolled back; the rebuild rewrites the rollups.
+
+    python benchmarks/datagen.py /tmp/bench.db --history 10000000
+    python benchmarks/analytics_bench.py /tmp/bench.db
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+import database
+import results
+
+ROLLUP_TRIGGERS = ('borrowings_rollup_lend', 'borrowings_rollup_insert_returned', 'borrowings_rollup_return')
+
+# What the dashboard would run without the rollup table.
+RAW_SQL = """
+    SELECT substr(bo.borrow_date, 1, 7) AS month, COALESCE(b.genre, '') AS genre, COUNT(*) AS loans
+    FROM borrowing_history bo JOIN books b ON b.id = bo.book_id
+    WHERE bo.borrow_date >= ? AND bo.borrow_date < ?
+    GROUP BY month, genre
+"""
+
+def _timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[max(int(len(samples) * 0.99) - 1, 0)]
+
+def _month_after(month):
+    year, month = map(int, month.split('-'))
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+
+def _insert_cost(path, rows, drop_triggers):
+    """Seconds to insert rows closed loans, optionally without the rollup triggers, then roll back."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    book_id, user_id = conn.execute("SELECT book_id, user_id FROM borrowings LIMIT 1").fetchone()
+    now = datetime.now()
+    conn.execute("BEGIN")
+    for name in ROLLUP_TRIGGERS if drop_triggers else ():
+        conn.execute(f"DROP TRIGGER {name}")
+    start = time.perf_counter()
+    conn.executemany("INSERT INTO borrowings (book_id, user_id, borrow_date, return_date) VALUES (?, ?, ?, ?)",
+                     ((book_id, user_id, now, now) for _ in range(rows)))
+    elapsed = time.perf_counter() - start
+    conn.execute("ROLLBACK")
+    conn.close()
+    return elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help="Database produced by datagen.py; its rollups are rebuilt by the run.")
+    parser.add_argument('--months', type=int, default=analytics.DEFAULT_MONTHS)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--raw-iterations', type=int, default=3)
+    parser.add_argument('--insert-rows', type=int, default=20000)
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+
+    database.DATABASE = args.path
+    database.init_db()
+    db = database.get_db()
+    history = db.execute("SELECT COUNT(*) FROM borrowing_history").fetchone()[0]
+    # The range ends at the newest loan, so older datagen databases still have data in it.
+    newest = db.execute("SELECT MAX(borrow_date) FROM borrowing_history").fetchone()[0]
+    start, end = analytics.default_range(datetime.fromisoformat(newest).date(), args.months)
+    metrics = {}
+
+    began = time.perf_counter()
+    database.run_transaction(analytics.rebuild)
+    metrics['rebuild_s'] = time.perf_counter() - began
+    metrics['rollup_rows'] = db.execute("SELECT COUNT(*) FROM circulation_monthly").fetchone()[0]
+    print(f"rebuild: {history} loans -> {metrics['rollup_rows']} rollup rows in {metrics['rebuild_s']:.2f}s")
+
+    cases = {
+        'by_month': (lambda: analytics.summary(db, start, end, 'month'), args.iterations),
+        'by_genre': (lambda: analytics.summary(db, start, end, 'genre'), args.iterations),
+        'loans_by_genre': (lambda: analytics.loans_by_genre(db, start, end), args.iterations),
+        'csv': (lambda: ''.join(analytics.iter_csv(db, start, end)), args.iterations),
+        'raw_loans_by_genre': (lambda: db.execute(RAW_SQL, (start, _month_after(end))).fetchall(),
+                               args.raw_iterations),
+    }
+    for name, (fn, iterations) in cases.items():
+        median, p99 = _timed(fn, iterations)
+        metrics[f"{name}.median_ms"] = median * 1000
+        metrics[f"{name}.p99_ms"] = p99 * 1000
+        print(f"{name:<20} median {median * 1000:10.3f}ms  p99 {p99 * 1000:10.3f}ms")
+    database.close_db()
+
+    with_triggers = _insert_cost(args.path, args.insert_rows, drop_triggers=False)
+    without = _insert_cost(args.path, args.insert_rows, drop_triggers=True)
+    metrics['insert_us_per_loan'] = with_triggers / args.insert_rows * 1e6
+    metrics['trigger_us_per_loan'] = (with_triggers - without) / args.insert_rows * 1e6
+    print(f"insert: {metrics['insert_us_per_loan']:.1f}us per closed loan, "
+          f"{metrics['trigger_us_per_loan']:.1f}us of it in the rollup triggers")
+
+    path = results.save('analytics', {'months': args.months, 'start': start, 'end': end, 'history': history,
+                                      'iterations': args.iterations, 'insert_rows': args.insert_rows},
+                        metrics, args.out)
+    print(f"results written to {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Run the same library workload against each storage backend and compare.
+
+Every backend gets a fresh, migrated database and the same sequence of
+loans, holds, batches and concurrent borrows through database.py. Each
+step's observable result must match what the application guarantees, and
+must be the same on every backend; that includes failed statements
+raising the errors in backends.py rather than the driver's. The script also times a lend/return
+cycle on each backend. It exits non-zero on any mismatch.
+
+    python benchmarks/backend_conformance.py                  # a temporary SQLite file and memory://
+    python benchmarks/backend_conformance.py sqlite:////tmp/c.db memory://check
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import migrations
+import results
+
+THREADS = 8
+
+def _conflict(fn, *args):
+    try:
+        fn(*args)
+    except database.TransactionConflict:
+        return 'conflict'
+    return 'ok'
+
+def _concurrently(fn, args_list):
+    """Call fn(*args) for each args on its own thread, all released together; returns the outcomes."""
+    barrier = threading.Barrier(len(args_list))
+    outcomes = []
+    lock = threading.Lock()
+
+    def run(args):
+        barrier.wait()
+        try:
+            outcome = _conflict(fn, *args)
+        finally:
+            database.close_db()
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=run, args=(args,)) for args in args_list]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(outcomes)
+
+def workload(cycles):
+    """Yield (check, observed, expected) for one backend, then ('lend_return_ms', ms, None)."""
+    db = database.get_db()
+    yield 'schema_version', migrations.current_version(db), migrations.MIGRATIONS[-1][0]
+
+    db.executemany("INSERT INTO users (username, password_hash, role) VALUES (?, 'x', ?)",
+                   [('lib', 'Librarian')] + [(f"m{i}", 'Member') for i in range(THREADS)])
+    db.executemany("INSERT INTO books (title, author, genre) VALUES (?, 'Anon', 'Fiction')",
+                   ((f"Book {i}",) for i in range(THREADS + 2)))
+    db.commit()
+    members = [row['id'] for row in db.execute("SELECT id FROM users WHERE role = 'Member' ORDER BY id")]
+    books = [row['id'] for row in db.execute("SELECT id FROM books ORDER BY id")]
+    first, second, third = members[:3]
+    book = books[0]
+
+    yield 'duplicate_username', isinstance(database.create_user('lib', 'pw', 'Librarian'), str), True
+    # Connections raise the backend-neutral errors that routes catch, never the driver's own.
+    try:
+        db.execute("INSERT INTO users (id, username, password_hash, role) VALUES (?, 'dup', 'x', 'Member')", (first,))
+        raised = None
+    except database.DatabaseError as e:
+        raised = type(e).__module__, type(e).__name__
+    yield 'constraint_error', raised, ('backends', 'IntegrityError')
+    try:
+        db.execute("SELECT no_such_column FROM books")
+        raised = None
+    except database.DatabaseError as e:
+        raised = type(e).__module__, type(e).__name__
+    yield 'statement_error', raised, ('backends', 'OperationalError')
+    # As at the end of a request: releasing the connection rolls back the failed insert.
+    database.close_db()
+    db = database.get_db()
+
+    borrowing = database.lend_book(book, first)
+    yield 'book_borrowed', db.execute("SELECT status FROM books WHERE id = ?", (book,)).fetchone()[0], 'Borrowed'
+    yield 'second_lend', _conflict(database.lend_book, book, second), 'conflict'
+    yield 'queue_positions', [database.queue_reservation(book, second), database.queue_reservation(book, third)], [1, 2]
+    yield 'repeat_reservation', _conflict(database.queue_reservation, book, second), 'conflict'
+
+    returned = database.return_borrowing(borrowing)
+    yield 'hold_handed_to', returned['held_for'], second
+    yield 'lend_to_other_while_held', _conflict(database.lend_book, book, third), 'conflict'
+    database.lend_book(book, second)
+    yield 'hold_fulfilled', db.execute(
+        "SELECT status FROM reservations WHERE book_id = ? AND user_id = ?", (book, second)).fetchone()[0], 'Fulfilled'
+
+    batch = database.lend_books([books[1], books[1], 999999], first)
+    yield 'batch_errors', [error is not None for _, _, error in batch], [False, True, True]
+
+    yield 'contended_lend', _concurrently(database.lend_book, [(books[2], m) for m in members]), \
+        ['conflict'] * (THREADS - 1) + ['ok']
+    yield 'parallel_lends', _concurrently(database.lend_book, [(b, m) for b, m in zip(books[3:], members)]), \
+        ['ok'] * min(THREADS, len(books) - 3)
+    db = database.get_db()
+    yield 'open_loans', db.execute("SELECT COUNT(*) FROM borrowings WHERE return_date IS NULL").fetchone()[0], \
+        3 + min(THREADS, len(books) - 3)
+    yield 'availability_drift', len(database.check_availability()), 0
+    yield 'rollup_loans', db.execute("SELECT SUM(loans) FROM circulation_monthly").fetchone()[0], \
+        db.execute("SELECT COUNT(*) FROM borrowings").fetchone()[0]
+
+    spare = books[-1]
+    db.execute("UPDATE books SET status = 'Available' WHERE id = ?", (spare,))
+    db.execute("DELETE FROM borrowings WHERE book_id = ? AND return_date IS NULL", (spare,))
+    db.commit()
+    start = time.perf_counter()
+    for _ in range(cycles):
+        database.return_borrowing(database.lend_book(spare, third))
+    yield 'lend_return_ms', (time.perf_counter() - start) / cycles * 1000, None
+    yield 'pool_within_limit', database.pool_stats()['size'] <= database.POOL_SIZE, True
+
+def check(url, cycles):
+    """Run the workload against url; returns ({check: observed}, [failures])."""
+    database.DATABASE = url
+    database.init_db()
+    observed, failures = {}, []
+    try:
+        for name, value, expected in workload(cycles):
+            observed[name] = value
+            if expected is not None and value != expected:
+                failures.append(f"{name}: got {value!r}, expected {expected!r}")
+    finally:
+        database.close_db()
+        database.shutdown()
+    return observed, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='*', help="Connection strings (default: a temporary SQLite file and memory://).")
+    parser.add_argument('--cycles', type=int, default=200, help="Lend/return cycles to time per backend.")
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+
+    urls = args.urls or [f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='conformance_'), 'conformance.db')}",
+                         'memory://conformance']
+    database.POOL_SIZE = THREADS + 2
+    runs = {}
+    failed = False
+    for url in urls:
+        observed, failures = check(url, args.cycles)
+        runs[url] = observed
+        failed = failed or bool(failures)
+        print(f"{url}: {'FAIL' if failures else 'ok'} ({observed.get('lend_return_ms', 0):.2f}ms per lend/return)")
+        for failure in failures:
+            print(f"  {failure}")
+
+    # Beyond the expectations, every backend must observe exactly the same results.
+    reference = {k: v for k, v in runs[urls[0]].items() if k != 'lend_return_ms'}
+    for url in urls[1:]:
+        differences = sorted(k for k, v in reference.items() if runs[url].get(k) != v)
+        if differences:
+            failed = True
+            print(f"{url} differs from {urls[0]} in: {', '.join(differences)}")
+
+    path = results.save('backend_conformance', {'urls': urls, 'cycles': args.cycles},
+                        {f"{url}.lend_return_ms": run.get('lend_return_ms', 0.0) for url, run in runs.items()},
+                        args.out)
+    print(f"results written to {path}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
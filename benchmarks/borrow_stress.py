@@ -0,0 +1,94 @@
+"""Hammer one book from many threads and check no loan or queue slot is ever shared.
+
+Every round, all threads are released at once to borrow the same book;
+exactly one may succeed. The losers then reserve it, and their queue
+positions must be unique and contiguous. Exits non-zero on any violation.
+
+    python benchmarks/borrow_stress.py --threads 16 --rounds 50
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix='borrow_stress_'), 'stress.db')
+    database.DATABASE = path
+    database.POOL_SIZE = args.threads + 1
+    database.init_db()
+    setup = sqlite3.connect(path)
+    setup.executemany("INSERT INTO users (username, password_hash, role) VALUES (?, 'x', 'Member')",
+                      ((f"m{i}",) for i in range(args.threads)))
+    book_id = setup.execute("INSERT INTO books (title, author) VALUES ('Contended', 'Anon')").lastrowid
+    setup.commit()
+    user_ids = [row[0] for row in setup.execute("SELECT id FROM users ORDER BY id")]
+
+    failures = []
+    start = time.perf_counter()
+    for round_no in range(args.rounds):
+        barrier = threading.Barrier(args.threads)
+        lent = []
+        queued = []
+        lock = threading.Lock()
+
+        def member(user_id):
+            barrier.wait()
+            try:
+                borrowing_id = database.lend_book(book_id, user_id)
+                with lock:
+                    lent.append(borrowing_id)
+            except database.TransactionConflict:
+                position = database.queue_reservation(book_id, user_id)
+                with lock:
+                    queued.append(position)
+            finally:
+                database.close_db()
+
+        threads = [threading.Thread(target=member, args=(user_id,)) for user_id in user_ids]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if len(lent) != 1:
+            failures.append(f"round {round_no}: {len(lent)} concurrent loans")
+        if sorted(queued) != list(range(1, args.threads)):
+            failures.append(f"round {round_no}: queue positions {sorted(queued)}")
+
+        # Close the loan and clear the queue for the next round.
+        for borrowing_id in lent:
+            database.return_borrowing(borrowing_id)
+        database.get_db().execute("DELETE FROM reservations WHERE book_id = ?", (book_id,))
+        database.get_db().commit()
+        database.close_db()
+
+    elapsed = time.perf_counter() - start
+    open_loans = setup.execute("SELECT COUNT(*) FROM borrowings WHERE return_date IS NULL").fetchone()[0]
+    if open_loans:
+        failures.append(f"{open_loans} loans left open")
+    setup.close()
+
+    print(f"{args.rounds} rounds x {args.threads} threads in {elapsed:.2f}s")
+    print(f"transactions: {database.transaction_stats()}")
+    if failures:
+        print("FAILED")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("OK: no double lends, no shared queue slots")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
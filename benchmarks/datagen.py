@@ -0,0 +1,145 @@
+"""Generate a large, reproducible library database for benchmarks.
+
+Creates a fresh database at the latest schema and fills it with books,
+members, a closed borrowing history, open loans and reservation queues.
+The same --seed always produces the same data. Every account gets the
+password 'pw', hashed with a deliberately cheap method so load tests
+measure the app rather than the KDF.
+
+    python benchmarks/datagen.py /tmp/bench.db --books 100000 --members 10000 --history 500000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+import database
+from loans import DEFAULT_LOAN_DAYS
+
+GENRES = ('Fiction', 'Mystery', 'Science', 'History', 'Fantasy', 'Biography', 'Poetry', 'Travel',
+          'Romance', 'Horror', 'Philosophy', 'Children')
+WORDS = ('river', 'shadow', 'garden', 'winter', 'empire', 'silent', 'glass', 'stone', 'memory',
+         'ocean', 'letters', 'house', 'night', 'iron', 'summer', 'kingdom', 'secret', 'light',
+         'forest', 'island', 'machine', 'journey', 'fire', 'city', 'song', 'broken', 'golden')
+SURNAMES = ('Smith', 'Okafor', 'Tanaka', 'Garcia', 'Novak', 'Singh', 'Muller', 'Rossi', 'Kim',
+            'Haddad', 'Olsen', 'Dubois', 'Silva', 'Kowalski', 'Nguyen', 'Ahmed', 'Brown', 'Ivanova')
+BENCH_PASSWORD = 'pw'
+START = datetime(2020, 1, 1)
+
+def _chunks(rows, size=10000):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def generate(path, books=10000, members=1000, librarians=5, history=50000, open_loans=0.05,
+             reservations=0.3, seed=42, progress=print):
+    """Build the database at path. Returns a dict of row counts.
+
+    open_loans is the fraction of books currently on loan; reservations is
+    the fraction of those loans with a queue (of one to three members).
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    password = generate_password_hash(BENCH_PASSWORD, method='pbkdf2:sha256:1000')
+    started = time.perf_counter()
+
+    conn.executemany(
+        "INSERT INTO users (username, password_hash, role, name, email) VALUES (?, ?, 'Librarian', ?, ?)",
+        ((f"lib{i}", password, f"Librarian {i}", f"lib{i}@example.org") for i in range(librarians)))
+    conn.executemany(
+        "INSERT INTO users (username, password_hash, role, name, email) VALUES (?, ?, 'Member', ?, ?)",
+        ((f"member{i}", password, f"{rng.choice(SURNAMES)} {i}", f"member{i}@example.org")
+         for i in range(members)))
+    member_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'Member' ORDER BY id")]
+    progress(f"users: {librarians + members}")
+
+    def book_rows():
+        for i in range(books):
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+            author = f"{rng.choice(SURNAMES)}, {chr(65 + rng.randrange(26))}."
+            yield (f"{title} {i}", author, rng.choice(GENRES))
+    for chunk in _chunks(book_rows()):
+        conn.executemany("INSERT INTO books (title, author, genre) VALUES (?, ?, ?)", chunk)
+    book_ids = [row[0] for row in conn.execute("SELECT id FROM books ORDER BY id")]
+    progress(f"books: {books}")
+
+    # Closed loans spread over the last few years, skewed towards popular books.
+    span = (datetime.now() - timedelta(days=30) - START).total_seconds()
+    def history_rows():
+        for _ in range(history):
+            book = book_ids[min(int(rng.paretovariate(1.2)) - 1, len(book_ids) - 1)
+                            if rng.random() < 0.3 else rng.randrange(len(book_ids))]
+            borrowed = START + timedelta(seconds=rng.random() * span)
+            returned = borrowed + timedelta(days=rng.randint(1, 28), seconds=rng.randint(0, 86399))
+            yield (book, rng.choice(member_ids), borrowed, returned)
+    for chunk in _chunks(history_rows()):
+        conn.executemany("INSERT INTO borrowings (book_id, user_id, borrow_date, return_date) VALUES (?, ?, ?, ?)",
+                         chunk)
+    progress(f"history: {history}")
+
+    # Open loans go through the lend trigger, which marks the books Borrowed.
+    # Borrow dates reach back past the default loan period so some are overdue.
+    on_loan = rng.sample(book_ids, int(len(book_ids) * open_loans))
+    now = datetime.now()
+    loans = [(book, rng.choice(member_ids), now - timedelta(days=rng.randint(0, 20))) for book in on_loan]
+    conn.executemany("""
+        INSERT INTO borrowings (book_id, user_id, borrow_date, due_date, fine_per_day_cents, max_fine_cents)
+        SELECT ?, ?, ?, ?, fine_per_day_cents, max_fine_cents FROM loan_policies WHERE genre IS NULL AND role IS NULL
+    """, ((book, member, borrowed, borrowed + timedelta(days=DEFAULT_LOAN_DAYS))
+          for book, member, borrowed in loans))
+
+    queued = 0
+    reservation_rows = []
+    for book, borrower, borrowed in loans:
+        if rng.random() >= reservations:
+            continue
+        waiting = rng.sample([m for m in rng.sample(member_ids, 4) if m != borrower][:3], rng.randint(1, 3))
+        for position, member in enumerate(waiting, 1):
+            reservation_rows.append((book, member, borrowed + timedelta(hours=position), position))
+        queued += len(waiting)
+    conn.executemany("""
+        INSERT INTO reservations (book_id, user_id, reservation_date, queue_position, status)
+        VALUES (?, ?, ?, ?, 'Pending')
+    """, reservation_rows)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    counts = {'books': books, 'members': members, 'librarians': librarians, 'history': history,
+              'open_loans': len(loans), 'reservations': queued}
+    progress(f"open loans: {len(loans)}, reservations: {queued} ({time.perf_counter() - started:.1f}s)")
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--librarians', type=int, default=5)
+    parser.add_argument('--history', type=int, default=50000)
+    parser.add_argument('--open-loans', type=float, default=0.05)
+    parser.add_argument('--reservations', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    generate(args.path, args.books, args.members, args.librarians, args.history, args.open_loans,
+             args.reservations, args.seed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Replay a realistic library workload through the Flask test client.
+
+Each worker thread signs in as a different member and loops over a
+weighted mix of operations: browsing /books (random sort and page
+size), searching, borrowing a random available book, returning one of
+its loans (through a librarian session, as at the desk) and reserving a
+book that is out. Latency percentiles per operation and overall
+throughput are printed and saved with results.save.
+
+    python benchmarks/datagen.py /tmp/bench.db
+    python benchmarks/load_driver.py /tmp/bench.db --concurrency 8 --seconds 30
+    python benchmarks/load_driver.py /tmp/bench.db --mix browse=70,search=30
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import results
+
+DEFAULT_MIX = 'browse=45,search=20,borrow=12,return=12,reserve=11'
+SEARCH_TERMS = ('river', 'garden', 'night', 'iron', 'winter shadow', 'author:smith', 'genre:poetry',
+                'title:island', 'glass', 'kingdom of')
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('browse', 'search', 'borrow', 'return', 'reserve'):
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def _percentile(samples, q):
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+class Worker(threading.Thread):
+    def __init__(self, app, username, librarian, books, mix, deadline, seed):
+        super().__init__(daemon=True)
+        self.client = app.test_client()
+        self.librarian = librarian
+        self.username = username
+        self.books = books
+        self.ops = list(mix)
+        self.weights = list(mix.values())
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.samples = {op: [] for op in mix}
+        self.errors = {op: 0 for op in mix}
+
+    def run(self):
+        response = self.client.post('/login', data={'username': self.username, 'password': 'pw'})
+        if response.status_code != 302:
+            raise RuntimeError(f"login failed for {self.username}: {response.status_code}")
+        self.user_id = self._db().execute("SELECT id FROM users WHERE username = ?",
+                                          (self.username,)).fetchone()[0]
+        while time.perf_counter() < self.deadline:
+            op = self.rng.choices(self.ops, self.weights)[0]
+            start = time.perf_counter()
+            ok = getattr(self, f"op_{op}")()
+            if ok is None:  # nothing to do (e.g. no open loan to return)
+                continue
+            self.samples[op].append(time.perf_counter() - start)
+            if not ok:
+                self.errors[op] += 1
+
+    def _db(self):
+        if not hasattr(self, '_conn'):
+            self._conn = sqlite3.connect(database.DATABASE, check_same_thread=False)
+        return self._conn
+
+    def op_browse(self):
+        sort = self.rng.choice(('id', 'title', 'author'))
+        return self.client.get(f'/books?sort={sort}&per_page={self.rng.choice((5, 20, 50))}').status_code == 200
+
+    def op_search(self):
+        return self.client.post('/books', data={'search': self.rng.choice(SEARCH_TERMS)}).status_code == 200
+
+    def op_borrow(self):
+        return self.client.post(f'/borrow_book/{self.rng.choice(self.books)}').status_code == 302
+
+    def op_return(self):
+        row = self._db().execute("SELECT id FROM borrowings WHERE user_id = ? AND return_date IS NULL LIMIT 1",
+                                 (self.user_id,)).fetchone()
+        if row is None:
+            return None
+        return self.librarian.post(f'/return_book/{row[0]}').status_code == 302
+
+    def op_reserve(self):
+        row = self._db().execute("""
+            SELECT id FROM books WHERE status = 'Borrowed' AND id >= ? ORDER BY id LIMIT 1
+        """, (self.rng.choice(self.books),)).fetchone()
+        if row is None:
+            return None
+        return self.client.post(f'/reserve_book/{row[0]}').status_code == 302
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help="Database produced by datagen.py; it is modified by the run.")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+
+    database.DATABASE = args.path
+    database.POOL_SIZE = max(database.POOL_SIZE, args.concurrency + 2)
+    import app as app_module
+    import ratelimit
+    app = app_module.create_app()
+    # Every worker signs in from the same test-client address.
+    ratelimit.configure_login(ip_burst=0)
+
+    conn = sqlite3.connect(args.path)
+    books = [row[0] for row in conn.execute("SELECT id FROM books")]
+    members = [row[0] for row in conn.execute("SELECT username FROM users WHERE role = 'Member' ORDER BY id")]
+    librarian_name = conn.execute("SELECT username FROM users WHERE role = 'Librarian' LIMIT 1").fetchone()
+    conn.close()
+    if len(members) < args.concurrency or librarian_name is None:
+        parser.error("the database needs a librarian and at least --concurrency members; use datagen.py")
+
+    librarian = app.test_client()
+    librarian.post('/login', data={'username': librarian_name[0], 'password': 'pw'})
+
+    deadline = time.perf_counter() + args.seconds
+    workers = [Worker(app, members[i], librarian, books, args.mix, deadline, args.seed + i)
+               for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    metrics = {}
+    total = 0
+    for op in args.mix:
+        samples = sorted(s for w in workers for s in w.samples[op])
+        errors = sum(w.errors[op] for w in workers)
+        total += len(samples)
+        metrics[f"{op}.count"] = len(samples)
+        metrics[f"{op}.errors"] = errors
+        metrics[f"{op}.p50_ms"] = _percentile(samples, 0.50) * 1000
+        metrics[f"{op}.p95_ms"] = _percentile(samples, 0.95) * 1000
+        metrics[f"{op}.p99_ms"] = _percentile(samples, 0.99) * 1000
+        metrics[f"{op}.ops_per_s"] = len(samples) / elapsed
+        print(f"{op:<8} n={len(samples):>6}  err={errors:>4}  p50={metrics[f'{op}.p50_ms']:7.2f}ms  "
+              f"p95={metrics[f'{op}.p95_ms']:7.2f}ms  p99={metrics[f'{op}.p99_ms']:7.2f}ms")
+    metrics['total.ops_per_s'] = total / elapsed
+    print(f"total    {total} operations in {elapsed:.1f}s, {metrics['total.ops_per_s']:.1f} ops/s")
+
+    path = results.save('load', {'concurrency': args.concurrency, 'seconds': args.seconds, 'mix': args.mix,
+                                 'seed': args.seed, 'books': len(books), 'members': len(members)},
+                        metrics, args.out)
+    print(f"results written to {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
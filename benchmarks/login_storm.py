@@ -0,0 +1,128 @@
+"""Catalog browsing latency while a storm of logins runs against the same server.
+
+Serves the app on a local threaded WSGI server, then measures GET /books
+latency three ways: with no other load, during a login storm with the
+bounded hashing pool, and during the same storm with as many hashing
+workers as storm threads (roughly what hashing on the request thread
+does). Login throttling is switched off so every attempt reaches the KDF.
+
+    python benchmarks/login_storm.py --storm-threads 32 --seconds 5
+"""
+import argparse
+import http.client
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import page_cache
+import passwords
+import ratelimit
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def _request(port, method, path, body=None, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    if cookie:
+        headers['Cookie'] = cookie
+    start = time.perf_counter()
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return response, elapsed
+
+def _browse(port, cookie, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        sort = ('id', 'title', 'author')[i % 3]
+        _, elapsed = _request(port, 'GET', f'/books?sort={sort}&per_page=20', cookie=cookie)
+        latencies.append(elapsed)
+        i += 1
+    return latencies
+
+def _storm(port, stop, counts):
+    body = urllib.parse.urlencode({'username': 'm0', 'password': 'wrong'})
+    while not stop.is_set():
+        response, _ = _request(port, 'POST', '/login', body=body)
+        counts[response.status] = counts.get(response.status, 0) + 1
+
+def _summary(label, latencies, counts=None):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    extra = f"  logins={dict(sorted(counts.items()))}" if counts else ''
+    print(f"{label:<28} requests={len(latencies):>5}  p50={statistics.median(latencies) * 1000:7.1f}ms  "
+          f"p95={p95 * 1000:7.1f}ms{extra}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--storm-threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--method', default=passwords.HASH_METHOD,
+                        help="werkzeug hash method for the storm account, e.g. scrypt or pbkdf2:sha256:600000")
+    parser.add_argument('--workers', type=int, default=passwords.HASH_WORKERS)
+    args = parser.parse_args(argv)
+
+    path = database.DATABASE if 'app' in sys.modules else os.path.join(tempfile.mkdtemp(prefix='login_storm_'), 'bench.db')
+    if 'app' not in sys.modules:
+        database.DATABASE = path
+    database.POOL_SIZE = args.storm_threads + 8
+    import app as app_module
+    app_module.create_app()
+
+    passwords.configure(method=args.method)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (username, password_hash, role) VALUES ('m0', ?, 'Member')",
+                 (passwords.hash_password('pw'),))
+    conn.execute("INSERT INTO users (username, password_hash, role) VALUES ('reader', ?, 'Member')",
+                 (passwords.hash_password('pw'),))
+    conn.executemany("INSERT INTO books (title, author, genre) VALUES (?, ?, 'Bench')",
+                     ((f"Title {i:05d}", f"Author {i % 300}") for i in range(5000)))
+    conn.commit()
+    conn.close()
+    ratelimit.configure_login(account_burst=0, ip_burst=0)
+    # Render every page, so the measurement is not just cache hits.
+    page_cache.configure(max_page_bytes=0, max_fragment_bytes=0)
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True, request_handler=QuietHandler)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    response, _ = _request(port, 'POST', '/login', body='username=reader&password=pw')
+    cookie = response.getheader('Set-Cookie').split(';', 1)[0]
+
+    _summary('no storm', _browse(port, cookie, args.seconds))
+    for label, workers in ((f'storm, {args.workers} hash workers', args.workers),
+                           (f'storm, {args.storm_threads} hash workers', args.storm_threads)):
+        passwords.configure(method=args.method, workers=workers, queue_depth=args.storm_threads)
+        stop = threading.Event()
+        counts = {}
+        storm = [threading.Thread(target=_storm, args=(port, stop, counts)) for _ in range(args.storm_threads)]
+        for t in storm:
+            t.start()
+        time.sleep(0.5)
+        latencies = _browse(port, cookie, args.seconds)
+        stop.set()
+        for t in storm:
+            t.join()
+        _summary(label, latencies, counts)
+
+    server.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
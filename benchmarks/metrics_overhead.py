@@ -0,0 +1,60 @@
+"""Cost of the metrics layer per SQL statement and per request.
+
+Times a cheap primary-key lookup on a plain sqlite3 connection and on an
+InstrumentedConnection, and the request hooks on their own, so the
+overhead can be compared with a typical request.
+
+    python benchmarks/metrics_overhead.py --statements 200000 --requests 20000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, Response
+
+import metrics
+
+def _time_statements(conn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        conn.execute("SELECT title FROM books WHERE id = ?", (i % 1000 + 1,)).fetchone()
+    return (time.perf_counter() - start) / n
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--statements', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix='metrics_overhead_'), 'bench.db')
+    setup = sqlite3.connect(path)
+    setup.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT)")
+    setup.executemany("INSERT INTO books (title) VALUES (?)", ((f"Title {i}",) for i in range(1000)))
+    setup.commit()
+    setup.close()
+
+    plain = sqlite3.connect(path)
+    instrumented = sqlite3.connect(path, factory=metrics.InstrumentedConnection)
+    base = _time_statements(plain, args.statements)
+    timed = _time_statements(instrumented, args.statements)
+    print(f"statement  plain {base * 1e6:6.2f}us  instrumented {timed * 1e6:6.2f}us  "
+          f"overhead {(timed - base) * 1e6:5.2f}us")
+
+    app = Flask(__name__)
+    response = Response('ok')
+    with app.test_request_context('/'):
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            metrics._begin_request()
+            metrics._end_request(response)
+        hooks = (time.perf_counter() - start) / args.requests
+    print(f"request hooks {hooks * 1e6:6.2f}us per request")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
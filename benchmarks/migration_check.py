@@ -0,0 +1,195 @@
+"""Upgrade databases that hold legacy values and check what the migrations leave.
+
+A scratch database is migrated up to just before a migration that rewrites
+stored values, filled with rows in every shape older releases wrote,
+including ones no parser reads, and then migrated to the latest version.
+The script checks that the upgrade finishes and that each row comes out
+as expected:
+- borrowings, reservations and their archives (migration 13): date-only
+  values, microseconds and 'T' separators become 'YYYY-MM-DD HH:MM:SS';
+- notifications.created_at (migration 19): rows written by the old UTC
+  default become local time, local rows keep their time, and missing or
+  unreadable values get the time the notifications table was added.
+
+Every time column in the upgraded databases, in the shipped library.db
+after its upgrade, and in a database written by a loan, hold, overdue
+scan, archive and session workload must then be in that canonical form
+(see timestamps.py). It reports how long each upgrade took and exits
+non-zero if a check fails.
+
+    python benchmarks/migration_check.py
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+import database
+import migrations
+import notifications
+import results
+import sessions
+from timestamps import FORMAT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# When migration 16 added the notifications table, in the scratch database.
+APPLIED = '2026-01-10 12:00:00'
+
+# Every column that holds a point in time. fines_through holds a day and
+# circulation_monthly.month a month, so neither is listed.
+TIME_COLUMNS = dict(migrations.TIMESTAMP_COLUMNS, **{
+    'schema_version': ('applied_at',),
+    'catalog_version': ('changed_at',),
+    'recommendation_state': ('refreshed_at',),
+    'jobs': ('run_after', 'created_at'),
+    'notifications': ('created_at',),
+    'sessions': ('expires_at',),
+})
+
+def canonical(conn, prefix):
+    """Yield one check per time column: how many of its values are not in the canonical form."""
+    for table, columns in TIME_COLUMNS.items():
+        for column in columns:
+            count = conn.execute(f"""
+                SELECT COUNT(*) FROM {table}
+                WHERE {column} IS NOT NULL AND strftime('{FORMAT}', {column}) IS NOT {column}
+            """).fetchone()[0]
+            yield f'{prefix}.canonical.{table}.{column}', count, 0
+
+def _upgrade(conn, before):
+    """Migrate to the latest version; yield its outcome, and the time taken under before's name."""
+    start = time.perf_counter()
+    try:
+        version = migrations.migrate(conn)
+    except migrations.MigrationError as e:
+        version = str(e)
+    yield f'{before}.upgrade_ms', (time.perf_counter() - start) * 1000, None
+    yield f'{before}.schema_version', version, migrations.MIGRATIONS[-1][0]
+
+def _local(utc):
+    """The local reading of a naive UTC time, in the stored form."""
+    return (datetime.fromisoformat(utc).replace(tzinfo=timezone.utc).astimezone()
+            .strftime('%Y-%m-%d %H:%M:%S'))
+
+def loan_times(path):
+    """Yield (check, observed, expected) for migration 13."""
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn, target=12)
+    conn.execute("INSERT INTO users (id, username, password_hash, role) VALUES (900, 'migration', '', 'Member')")
+    conn.execute("INSERT INTO books (id, title, author) VALUES (900, 'Migration', 'Check')")
+    # (stored before, expected after); one shape per column so a mix-up shows.
+    shapes = [
+        ('2024-03-01', '2024-03-01 00:00:00'),
+        ('2024-03-01 09:30:00.123456', '2024-03-01 09:30:00'),
+        ('2024-03-01T09:30:00', '2024-03-01 09:30:00'),
+        ('2024-03-01 09:30:00', '2024-03-01 09:30:00'),
+    ]
+    expected = {}
+    for table, columns in migrations.TIMESTAMP_COLUMNS.items():
+        values = {column: shapes[i % len(shapes)] for i, column in enumerate(columns)}
+        names = ', '.join(values)
+        conn.execute(f"INSERT INTO {table} (id, book_id, user_id, {names}) VALUES (900, 900, 900, "
+                     f"{', '.join('?' * len(values))})", [before for before, _ in values.values()])
+        expected[table] = {column: after for column, (_, after) in values.items()}
+    conn.commit()
+    yield from _upgrade(conn, 'loans')
+    for table, columns in expected.items():
+        row = conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE id = 900").fetchone()
+        for (column, after), value in zip(columns.items(), row):
+            yield f'loans.{table}.{column}', value, after
+    yield from canonical(conn, 'loans')
+    conn.close()
+
+def notification_times(path):
+    """Yield (check, observed, expected) for migration 19."""
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn, target=18)
+    conn.execute("UPDATE schema_version SET applied_at = ? WHERE version = 16", (APPLIED,))
+    conn.execute("INSERT INTO users (id, username, password_hash, role) VALUES (900, 'migration', '', 'Member')")
+    rows = {
+        # old CURRENT_TIMESTAMP default, in UTC
+        'utc_default': ('2026-01-01 08:00:00', _local('2026-01-01 08:00:00')),
+        # written by notify() after the upgrade to 16, already local
+        'local': ('2026-02-01 09:30:00', '2026-02-01 09:30:00'),
+        'microseconds': ('2026-02-01 09:30:00.123456', '2026-02-01 09:30:00'),
+        'missing': (None, APPLIED),
+        'empty': ('', APPLIED),
+        'day_first': ('01/02/2026 09:30', APPLIED),
+        'words': ('yesterday', APPLIED),
+    }
+    for message, (created_at, _) in rows.items():
+        conn.execute("INSERT INTO notifications (user_id, message, created_at) VALUES (900, ?, ?)",
+                     (message, created_at))
+    conn.commit()
+    yield from _upgrade(conn, 'notifications')
+    stored = dict(conn.execute("SELECT message, created_at FROM notifications"))
+    for message, (_, expected) in rows.items():
+        yield f'notifications.{message}', stored.get(message), expected
+    yield from canonical(conn, 'notifications')
+    conn.close()
+
+def shipped(path):
+    """Yield (check, observed, expected) for an upgrade of the shipped library.db."""
+    shutil.copy(os.path.join(ROOT, 'library.db'), path)
+    conn = sqlite3.connect(path)
+    yield from _upgrade(conn, 'shipped')
+    yield from canonical(conn, 'shipped')
+    conn.close()
+
+def workload(path):
+    """Yield (check, observed, expected) for times written by the application itself."""
+    database.DATABASE = path
+    database.init_db()
+    try:
+        member = database.create_user('time_member', 'pw', 'Member')
+        waiting = database.create_user('time_waiting', 'pw', 'Member')
+        book = database.add_book('Time', 'Check', None)
+        loan = database.lend_book(book, member)
+        database.queue_reservation(book, waiting)
+        database.return_borrowing(loan)
+        database.lend_book(book, waiting)
+        later = datetime.now() + timedelta(days=60)
+        database.scan_overdue(later)
+        database.refresh_recommendations()
+        database.run_transaction(lambda db: notifications.notify(db, member, 'Time check'))
+        database.run_due_jobs()
+        archive.archive_history(older_than_days=0, pause=0, now=later)
+        store = sessions.SQLiteSessionStore(database.get_backend(), 1)
+        store.create('time-check', member, '{}', datetime.now() + timedelta(hours=1))
+        store.close()
+        yield from canonical(database.get_db(), 'workload')
+    finally:
+        database.close_db()
+        database.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='migrations_')
+    measured, failed = {}, False
+    for scenario in (loan_times, notification_times, shipped, workload):
+        for name, value, expected in scenario(os.path.join(workdir, f'{scenario.__name__}.db')):
+            if expected is None:
+                measured[name] = value
+                print(f"{name}: {value:.3f}")
+            else:
+                ok = value == expected
+                failed = failed or not ok
+                print(f"{name}: {'ok' if ok else f'FAIL (got {value!r}, expected {expected!r})'}")
+
+    path = results.save('migrations', {'workdir': workdir}, measured, args.out)
+    print(f"results written to {path}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
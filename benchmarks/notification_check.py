@@ -0,0 +1,235 @@
+"""Check the job queue end to end against local SMTP and webhook stubs, and time it.
+
+Loans are returned to members waiting in the reservation queue, and an old
+loan is scanned as overdue. The script starts the job workers and checks
+four things:
+- every waiting member gets one inbox row, one email and one webhook call;
+- webhook failures are retried, and a job with no handler ends up as a
+  dead letter that --retry-dead would requeue;
+- a rolled-back enqueue never runs;
+- rescanning an overdue loan does not send a second reminder.
+
+It reports the cost of enqueue() inside a transaction, the time for a
+return that queues a notice, and the delay from return to webhook
+delivery. It exits non-zero if a check fails.
+
+    python benchmarks/notification_check.py
+    python benchmarks/notification_check.py --holds 500 --webhook-failures 4
+"""
+import argparse
+import http.server
+import json
+import os
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import jobs
+import notifications
+import results
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """Just enough of SMTP for smtplib to hand over a message, which is kept in messages."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.messages = []
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply('220 stub')
+        lines = None
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if lines is not None:
+                if line == '.':
+                    self.server.messages.append('\n'.join(lines))
+                    lines = None
+                    self.reply('250 queued')
+                else:
+                    lines.append(line)
+                continue
+            verb = line[:4].upper()
+            if verb == 'DATA':
+                lines = []
+                self.reply('354 end with .')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+class WebhookStub(http.server.ThreadingHTTPServer):
+    """Records JSON POSTs with their arrival time; answers 503 to the first `failures` of them."""
+
+    daemon_threads = True
+
+    def __init__(self, failures=0):
+        super().__init__(('127.0.0.1', 0), WebhookHandler)
+        self.failures = failures
+        self.received = []
+        self.lock = threading.Lock()
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            failing = self.server.failures > 0
+            if failing:
+                self.server.failures -= 1
+            else:
+                self.server.received.append((time.perf_counter(), body))
+        self.send_response(503 if failing else 200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _drain(timeout):
+    """Wait until nothing is queued or running; returns the final job stats."""
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = database.job_stats()
+        if not stats['queued'] and not stats['running'] or time.monotonic() > deadline:
+            return stats
+        time.sleep(0.05)
+
+def _enqueue_cost(count):
+    """Microseconds per enqueue() inside one write transaction, rolled back so nothing runs."""
+    class Rollback(Exception):
+        pass
+
+    def work(db):
+        start = time.perf_counter()
+        for i in range(count):
+            jobs.enqueue(db, 'benchmark_noop', {'i': i})
+        work.elapsed = time.perf_counter() - start
+        raise Rollback()
+    try:
+        database.run_transaction(work)
+    except Rollback:
+        pass
+    return work.elapsed / count * 1e6
+
+def run(holds, failures, timeout):
+    """Yield (check, observed, expected); expected None marks a measurement."""
+    smtp = _serve(SMTPStub())
+    webhook = _serve(WebhookStub(failures))
+    notifications.configure(smtp_host='127.0.0.1', smtp_port=smtp.server_address[1],
+                            webhook_url=f"http://127.0.0.1:{webhook.server_address[1]}/hook")
+    db = database.get_db()
+    db.executemany("INSERT INTO users (username, password_hash, role, email) VALUES (?, 'x', 'Member', ?)",
+                   [(f"m{i}", f"m{i}@example.org") for i in range(3)])
+    db.executemany("INSERT INTO books (title, author, genre) VALUES (?, 'Anon', 'Fiction')",
+                   ((f"Book {i}",) for i in range(holds + 1)))
+    db.commit()
+    borrower, waiter, late = [row['id'] for row in db.execute("SELECT id FROM users ORDER BY id")]
+    books = [row['id'] for row in db.execute("SELECT id FROM books ORDER BY id")]
+
+    yield 'enqueue_us', _enqueue_cost(1000), None
+    yield 'rolled_back_enqueue', database.job_stats()['queued'], 0
+
+    loans = [database.lend_book(book, borrower) for book in books[:holds]]
+    for book in books[:holds]:
+        database.queue_reservation(book, waiter)
+
+    database.start_job_workers()
+    returned_at = {}
+    durations = []
+    for book, borrowing in zip(books, loans):
+        start = time.perf_counter()
+        database.return_borrowing(borrowing)
+        durations.append(time.perf_counter() - start)
+        returned_at[f"Book {book - books[0]}"] = start
+    yield 'return_ms', statistics.mean(durations) * 1000, None
+
+    overdue = database.lend_book(books[-1], late)
+    db.execute("UPDATE borrowings SET due_date = ? WHERE id = ?", (datetime.now() - timedelta(days=3), overdue))
+    db.commit()
+    database.scan_overdue()
+    database.scan_overdue(now=datetime.now() + timedelta(days=1))
+    jobs.enqueue(db, 'no_such_job', max_attempts=2)
+    db.commit()
+
+    stats = _drain(timeout)
+    database.stop_job_workers()
+    yield 'left_queued', stats['queued'] + stats['running'], 0
+    yield 'hold_notices', db.execute(
+        "SELECT COUNT(*) FROM notifications WHERE user_id = ?", (waiter,)).fetchone()[0], holds
+    yield 'overdue_reminders', db.execute(
+        "SELECT COUNT(*) FROM notifications WHERE user_id = ?", (late,)).fetchone()[0], 1
+    yield 'emails', len(smtp.messages), holds + 1
+    yield 'webhooks', len(webhook.received), holds + 1
+    yield 'webhook_retries', stats['retried'] >= failures, True
+    yield 'dead_letters', stats['dead'], 1
+    yield 'requeued', database.run_transaction(jobs.retry_dead), 1
+    db.execute("DELETE FROM jobs")
+    db.commit()
+
+    delays = sorted((arrived - returned_at[body['message'].split("'")[1]]) * 1000
+                    for arrived, body in webhook.received if body['message'].split("'")[1] in returned_at)
+    if delays:
+        yield 'delivery_p50_ms', delays[len(delays) // 2], None
+        yield 'delivery_p95_ms', delays[int(len(delays) * 0.95)], None
+    yield 'job_run_p95_ms', stats['run_seconds_p95'] * 1000, None
+    smtp.shutdown()
+    webhook.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help="Connection string (default: a temporary SQLite file).")
+    parser.add_argument('--holds', type=int, default=200, help="Returns that hand a book to a waiting member.")
+    parser.add_argument('--webhook-failures', type=int, default=3,
+                        help="Webhook calls the stub rejects first; fewer than jobs.MAX_ATTEMPTS.")
+    parser.add_argument('--workers', type=int, default=jobs.WORKERS, help="Job worker threads.")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds to wait for the queue to drain.")
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+    if args.webhook_failures >= jobs.MAX_ATTEMPTS:
+        parser.error(f"--webhook-failures must be below jobs.MAX_ATTEMPTS ({jobs.MAX_ATTEMPTS}), "
+                     "or one delivery could fail every attempt")
+
+    database.DATABASE = args.database or os.path.join(tempfile.mkdtemp(prefix='notifications_'), 'check.db')
+    database.init_db()
+    jobs.WORKERS = args.workers
+    jobs.POLL_INTERVAL = 0.1
+    jobs.RETRY_BACKOFF = 0
+    measured, failed = {}, False
+    try:
+        for name, value, expected in run(args.holds, args.webhook_failures, args.timeout):
+            if expected is None:
+                measured[name] = value
+                print(f"{name}: {value:.3f}")
+            else:
+                ok = value == expected
+                failed = failed or not ok
+                print(f"{name}: {'ok' if ok else f'FAIL (got {value!r}, expected {expected!r})'}")
+    finally:
+        database.close_db()
+        database.shutdown()
+
+    path = results.save('notifications', {'database': database.DATABASE, 'holds': args.holds,
+                                          'webhook_failures': args.webhook_failures, 'workers': args.workers},
+                        measured, args.out)
+    print(f"results written to {path}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
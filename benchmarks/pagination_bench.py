@@ -0,0 +1,56 @@
+"""Deep-page latency on /books: LIMIT/OFFSET versus keyset cursors.
+
+    python benchmarks/pagination_bench.py --books 200000 --per-page 20
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from pagination import keyset_clause
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix='pagination_bench_'), 'bench.db')
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO books (title, author, genre) VALUES (?, ?, 'Fiction')",
+                     ((f"Title {i * 7919 % args.books:08d}", f"Author {i % 997}") for i in range(args.books)))
+    conn.commit()
+
+    print(f"{args.books} books, {args.per_page} per page, mean ms of {args.repeat} runs")
+    print(f"{'page':>8}{'OFFSET':>10}{'keyset':>10}")
+    last_page = args.books // args.per_page
+    for page in (1, 10, 100, 1000, last_page // 2, last_page):
+        offset = (page - 1) * args.per_page
+        # The cursor is the last row of the previous page.
+        cursor = conn.execute("SELECT title, id FROM books ORDER BY title, id LIMIT 1 OFFSET ?",
+                              (max(offset - 1, 0),)).fetchone() if offset else None
+        keyset, order, params = keyset_clause('title', 'id', cursor)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            conn.execute("SELECT * FROM books ORDER BY title, id LIMIT ? OFFSET ?", (args.per_page, offset)).fetchall()
+        offset_ms = (time.perf_counter() - start) / args.repeat * 1000
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            conn.execute(f"SELECT * FROM books {'WHERE ' + keyset if keyset else ''} ORDER BY {order} LIMIT ?",
+                         (*params, args.per_page)).fetchall()
+        keyset_ms = (time.perf_counter() - start) / args.repeat * 1000
+        print(f"{page:>8}{offset_ms:>10.2f}{keyset_ms:>10.2f}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Microbenchmarks for the catalog, member, loan and reservation queries.
+
+Times every statement in migrations.hot_queries() (writes run inside a
+transaction that is rolled back) and the read helpers in database.py,
+against a database from datagen.py. Reports median and p95 per call and
+stores the run with results.save.
+
+    python benchmarks/datagen.py /tmp/bench.db
+    python benchmarks/query_bench.py /tmp/bench.db --iterations 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import migrations
+import results
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+def _timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[max(0, int(len(samples) * 0.95) - 1)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help="Database produced by datagen.py.")
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+
+    database.DATABASE = args.path
+    database.init_db()
+    db = database.get_db()
+    rng = random.Random(args.seed)
+    members = [row[0] for row in db.execute("SELECT id FROM users WHERE role = 'Member'")]
+    books = [row[0] for row in db.execute("SELECT id FROM books")]
+    if not members or not books:
+        parser.error("the database has no members or books; generate one with datagen.py")
+
+    def hot_query(sql, params):
+        def run():
+            if sql.lstrip().upper().startswith(WRITE_PREFIXES):
+                db.execute("BEGIN")
+                db.execute(sql, params).fetchall()
+                db.rollback()
+            else:
+                db.execute(sql, params).fetchall()
+        return run
+
+    cases = {f"sql.{name}": hot_query(sql, params)
+             for name, (sql, params, _) in migrations.hot_queries().items()}
+    first_page = database.get_books_page(per_page=20)
+    cases.update({
+        'db.get_books_page': lambda: database.get_books_page(per_page=20),
+        'db.get_books_page.next': lambda: database.get_books_page(per_page=20, after=first_page['next_cursor']),
+        'db.get_books_page.sort_title': lambda: database.get_books_page(sort='title', per_page=20),
+        'db.get_books_page.search': lambda: database.get_books_page(rng.choice(('river', 'garden', 'night', 'iron')),
+                                                                     per_page=20),
+        'db.get_books_page.field_search': lambda: database.get_books_page('author:smith', per_page=20),
+        'db.get_members_page': lambda: database.get_members_page(per_page=20),
+        'db.get_members_page.search': lambda: database.get_members_page('member12', per_page=20),
+        'db.get_user_by_id.cold': lambda: (database.user_cache.clear(),
+                                           database.get_user_by_id(rng.choice(members))),
+        'db.get_user_by_id.cached': lambda: database.get_user_by_id(members[0]),
+        'db.get_borrowed_books': lambda: database.get_borrowed_books(rng.choice(members)),
+        'db.get_reservations_by_user': lambda: database.get_reservations_by_user(rng.choice(members)),
+        'db.get_reservations_by_book': lambda: database.get_reservations_by_book(rng.choice(books)),
+        'db.check_availability': lambda: database.check_availability(),
+    })
+
+    metrics = {}
+    for name, fn in cases.items():
+        fn()  # warm the page cache and statement cache
+        median, p95 = _timed(fn, args.iterations)
+        metrics[f"{name}.median_ms"] = median * 1000
+        metrics[f"{name}.p95_ms"] = p95 * 1000
+        print(f"{name:<44} median {median * 1000:8.3f}ms  p95 {p95 * 1000:8.3f}ms")
+
+    counts = {table: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('books', 'users', 'borrowings', 'reservations')}
+    database.close_db()
+    path = results.save('queries', {'iterations': args.iterations, 'seed': args.seed, 'rows': counts},
+                        metrics, args.out)
+    print(f"results written to {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Simulate thousands of concurrent reservation queues.
+
+Every book starts on loan. Worker threads then pick random actions: a member
+joins a queue, a loan is returned (handing the book to the queue head), a
+holder collects their book, or lapsed holds are expired. At the end the
+queue invariants are checked and per-operation latencies are printed.
+
+    python benchmarks/queue_sim.py --books 2000 --members 5000 --ops 20000 --threads 8
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+def seed(path, books, members):
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO users (username, password_hash, role) VALUES (?, 'x', 'Member')",
+                     ((f"m{i}",) for i in range(members)))
+    conn.executemany("INSERT INTO books (title, author) VALUES (?, 'Sim')", ((f"Book {i}",) for i in range(books)))
+    now = datetime.now()
+    conn.executemany("INSERT INTO borrowings (book_id, user_id, borrow_date) VALUES (?, ?, ?)",
+                     ((book_id, random.randint(1, members), now) for book_id in range(1, books + 1)))
+    conn.commit()
+    conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix='queue_sim_'), 'sim.db')
+    database.DATABASE = path
+    database.POOL_SIZE = args.threads + 1
+    database.init_db()
+    seed(path, args.books, args.members)
+
+    timings = {'reserve': [], 'return': [], 'collect': [], 'expire': []}
+    lock = threading.Lock()
+    remaining = [args.ops]
+
+    def worker(seed_value):
+        rng = random.Random(seed_value)
+        db = database.get_db()
+        local = {key: [] for key in timings}
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            roll = rng.random()
+            book_id = rng.randint(1, args.books)
+            start = time.perf_counter()
+            try:
+                if roll < 0.6:
+                    action = 'reserve'
+                    database.queue_reservation(book_id, rng.randint(1, args.members))
+                elif roll < 0.8:
+                    action = 'return'
+                    loan = db.execute("SELECT id FROM borrowings WHERE book_id = ? AND return_date IS NULL",
+                                      (book_id,)).fetchone()
+                    if loan is None:
+                        continue
+                    database.return_borrowing(loan['id'])
+                elif roll < 0.98:
+                    action = 'collect'
+                    book = db.execute("SELECT held_for FROM books WHERE id = ?", (book_id,)).fetchone()
+                    if book['held_for'] is None:
+                        continue
+                    database.lend_book(book_id, book['held_for'])
+                else:
+                    action = 'expire'
+                    # Pretend a few days have passed so some holds lapse.
+                    database.expire_holds(now=datetime.now() + timedelta(days=rng.randint(0, 5)))
+            except database.TransactionConflict:
+                pass
+            local[action].append(time.perf_counter() - start)
+        database.close_db()
+        with lock:
+            for key, values in local.items():
+                timings[key].extend(values)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(path)
+    pending, holds, longest = conn.execute("""
+        SELECT SUM(status = 'Pending'), SUM(status = 'Ready'),
+               (SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM reservations
+                                    WHERE status = 'Pending' GROUP BY book_id))
+        FROM reservations
+    """).fetchone()
+    problems = conn.execute("""
+        SELECT COUNT(*) FROM books b
+        WHERE (b.status = 'On Hold') != EXISTS (SELECT 1 FROM reservations r
+                                                WHERE r.book_id = b.id AND r.status = 'Ready')
+    """).fetchone()[0]
+    conn.close()
+    drift = database.check_availability()
+    database.close_db()
+
+    print(f"{args.ops} operations on {args.books} queues, {args.threads} threads: "
+          f"{args.ops / elapsed:.0f} ops/s")
+    print(f"pending={pending} holds={holds} longest queue={longest}")
+    print(f"{'operation':<10}{'count':>8}{'mean ms':>10}{'p99 ms':>10}")
+    for action, values in timings.items():
+        if values:
+            values.sort()
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            print(f"{action:<10}{len(values):>8}{sum(values) / len(values) * 1000:>10.2f}{p99 * 1000:>10.2f}")
+    if problems or drift:
+        print(f"FAILED: {problems} hold mismatches, {len(drift)} availability drifts")
+        return 1
+    print("OK: queues consistent")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Time the recommendation rebuild, incremental refresh and page lookups.
+
+Rebuilds every recommendation table from the history of a datagen.py
+database, then lends --new-loans more books and folds them in with
+refresh(), and finally times the lookups /books, /profile and the API make.
+The database is modified.
+
+    python benchmarks/datagen.py /tmp/bench.db
+    python benchmarks/recommendation_bench.py /tmp/bench.db --new-loans 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import recommendations
+import results
+
+def _lookup(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help="Database produced by datagen.py; it is modified by the run.")
+    parser.add_argument('--new-loans', type=int, default=2000)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=3)
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+
+    database.DATABASE = args.path
+    database.init_db()
+    db = database.get_db()
+    rng = random.Random(args.seed)
+    members = [row[0] for row in db.execute("SELECT id FROM users WHERE role = 'Member'")]
+    books = [row[0] for row in db.execute("SELECT id FROM books")]
+    history = db.execute("SELECT COUNT(*) FROM borrowing_history").fetchone()[0]
+    metrics = {}
+
+    start = time.perf_counter()
+    database.run_transaction(recommendations.rebuild)
+    metrics['rebuild_s'] = time.perf_counter() - start
+    metrics['co_borrow_cells'] = db.execute("SELECT COUNT(*) FROM co_borrows").fetchone()[0]
+    print(f"rebuild: {history} loans -> {metrics['co_borrow_cells']} co-borrow cells "
+          f"in {metrics['rebuild_s']:.2f}s")
+
+    # New closed loans, as if lent and returned since the last refresh.
+    now = datetime.now()
+    db.executemany("INSERT INTO borrowings (book_id, user_id, borrow_date, return_date) VALUES (?, ?, ?, ?)",
+                   ((rng.choice(books), rng.choice(members), now, now) for _ in range(args.new_loans)))
+    db.commit()
+    start = time.perf_counter()
+    processed = database.refresh_recommendations()
+    elapsed = time.perf_counter() - start
+    metrics['refresh_s'] = elapsed
+    metrics['refresh_loans_per_s'] = processed / elapsed if elapsed else 0.0
+    print(f"refresh: {processed} new loans in {elapsed:.2f}s ({metrics['refresh_loans_per_s']:.0f} loans/s)")
+
+    db = database.get_db()
+    page = books[:20]
+    cases = {
+        'popular': lambda: recommendations.popular(db, 5),
+        'similar.page20': lambda: recommendations.similar(db, page),
+        'for_member': lambda: recommendations.for_member(db, rng.choice(members)),
+    }
+    for name, fn in cases.items():
+        median, p99 = _lookup(fn, args.iterations)
+        metrics[f"{name}.median_ms"] = median * 1000
+        metrics[f"{name}.p99_ms"] = p99 * 1000
+        print(f"{name:<16} median {median * 1000:7.3f}ms  p99 {p99 * 1000:7.3f}ms")
+    database.close_db()
+
+    path = results.save('recommendations', {'new_loans': args.new_loans, 'iterations': args.iterations,
+                                            'seed': args.seed, 'history': history, 'books': len(books),
+                                            'members': len(members)}, metrics, args.out)
+    print(f"results written to {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
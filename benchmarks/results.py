@@ -0,0 +1,91 @@
+"""Store benchmark results as JSON and compare two runs.
+
+Each run is written to benchmarks/results/<suite>-<timestamp>.json with the
+parameters, the environment (git commit, Python and SQLite versions) and a
+flat {metric: value} dict. Metrics whose names end in _ms or _s are
+latencies (lower is better); anything ending in _per_s is throughput
+(higher is better).
+
+    python benchmarks/results.py compare old.json new.json --threshold 10
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def save(suite, params, metrics, out=None):
+    """Write a result file and return its path. out may be a file or directory."""
+    record = {
+        'suite': suite,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'params': params,
+        'metrics': metrics,
+    }
+    out = out or RESULTS_DIR
+    if not out.endswith('.json'):
+        os.makedirs(out, exist_ok=True)
+        out = os.path.join(out, f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, 'w') as f:
+        json.dump(record, f, indent=2, sort_keys=True)
+    return out
+
+def _direction(metric):
+    if metric.endswith('_per_s'):
+        return 1
+    if metric.endswith(('_ms', '_s', '_us')):
+        return -1
+    return 0
+
+def compare(old, new, threshold=10.0):
+    """Yield (metric, old, new, change %, verdict) for metrics present in both runs."""
+    for metric in sorted(set(old['metrics']) & set(new['metrics'])):
+        before, after = old['metrics'][metric], new['metrics'][metric]
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        direction = _direction(metric)
+        verdict = ''
+        if direction and abs(change) >= threshold:
+            verdict = 'better' if change * direction > 0 else 'REGRESSION'
+        yield metric, before, after, change, verdict
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    cmp = sub.add_parser('compare')
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=10.0, help="Percent change to flag.")
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old['params'] != new['params']:
+        print("warning: runs used different parameters", file=sys.stderr)
+    regressions = 0
+    for metric, before, after, change, verdict in compare(old, new, args.threshold):
+        regressions += verdict == 'REGRESSION'
+        print(f"{metric:<48} {before:>12.3f} {after:>12.3f} {change:>+8.1f}%  {verdict}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Catalog search: the original LIKE scan versus the FTS5 index.
+
+Each query is timed the way /books runs it: one page of results plus the
+total match count.
+
+    python benchmarks/search_bench.py --books 200000 --repeat 20
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import search
+
+WORDS = ("river night garden silent empire winter glass orchard stone letters "
+         "shadow harbor crown machine forest daughter ocean mirror summer thief").split()
+GENRES = ("Fiction", "Classic Fiction", "Dystopian Fiction", "Literature", "Mystery",
+          "Science Fiction", "History", "Poetry", "Biography", "Fantasy")
+
+LIKE_PAGE = """
+    SELECT b.* FROM books b
+    WHERE b.title LIKE ? OR b.author LIKE ? OR b.genre LIKE ?
+    LIMIT 5 OFFSET 0
+"""
+LIKE_COUNT = """
+    SELECT COUNT(*) FROM books b
+    WHERE b.title LIKE ? OR b.author LIKE ? OR b.genre LIKE ?
+"""
+FTS_PAGE = f"""
+    SELECT b.* FROM books_fts f JOIN books b ON b.id = f.rowid
+    WHERE books_fts MATCH ? ORDER BY {search.RANK} LIMIT 5 OFFSET 0
+"""
+
+def seed(path, books):
+    rng = random.Random(42)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO books (title, author, genre) VALUES (?, ?, ?)", (
+        (" ".join(rng.choice(WORDS).title() for _ in range(3)),
+         f"Author{rng.randrange(5000)} {rng.choice(WORDS).title()}",
+         rng.choice(GENRES))
+        for _ in range(books)))
+    conn.commit()
+    conn.close()
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--query', action='append', help="Search text (repeatable).")
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix='search_bench_'), 'bench.db')
+    database.DATABASE = path
+    database.init_db()
+    seed(path, args.books)
+    conn = sqlite3.connect(path)
+
+    queries = args.query or ['garden', 'Author12', 'mystery', 'silent empire', 'author:author42']
+    print(f"{args.books} books, mean of {args.repeat} runs (page + count)")
+    print(f"{'query':<20}{'LIKE ms':>10}{'FTS5 ms':>10}{'matches':>10}")
+    for text in queries:
+        pattern = f"%{text}%"
+        match = search.match_expression(text)
+        like_ms = timed(lambda: (conn.execute(LIKE_PAGE, (pattern,) * 3).fetchall(),
+                                 conn.execute(LIKE_COUNT, (pattern,) * 3).fetchone()), args.repeat)
+        fts_ms = timed(lambda: (conn.execute(FTS_PAGE, (match,)).fetchall(),
+                                search.count_matches(conn, match)), args.repeat)
+        print(f"{text:<20}{like_ms:>10.2f}{fts_ms:>10.2f}{search.count_matches(conn, match):>10}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
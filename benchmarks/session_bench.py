@@ -0,0 +1,131 @@
+"""Time the per-request cost of server-side sessions against signed cookies.
+
+Each session store is filled with --sessions sessions spread over
+--sessions-per-user per member. The script then opens and saves sessions
+for random cookies through the Flask session interface, the same work
+done around every request. It times:
+- a request that only reads the session;
+- a request that changes it, such as a flashed message;
+- revoking all sessions of one member;
+- sweeping a batch of expired sessions.
+
+Flask's default signed-cookie session is the baseline.
+
+    python benchmarks/session_bench.py
+    python benchmarks/session_bench.py --sessions 1000000 --requests 50000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.test import EnvironBuilder
+
+import database
+import results
+import sessions
+
+DATA = {'user_id': 1, 'role': 'Member'}
+
+def _requests(app, cookies, count, seed):
+    rng = random.Random(seed)
+    name = app.config['SESSION_COOKIE_NAME']
+    return [EnvironBuilder(headers={'Cookie': f"{name}={rng.choice(cookies)}"}).get_request()
+            for _ in range(count)]
+
+def _per_request_us(app, interface, requests, modify):
+    responses = [app.response_class() for _ in requests]
+    start = time.perf_counter()
+    for request, response in zip(requests, responses):
+        session = interface.open_session(app, request)
+        if session.get('user_id') is None:
+            raise AssertionError("session not found")
+        if modify:
+            session['_flashes'] = [('message', 'Book borrowed.')]
+        interface.save_session(app, session, response)
+    return (time.perf_counter() - start) / len(requests) * 1e6
+
+def _fill(store, count, per_user, expires, prefix='bench'):
+    """Create count sessions, per_user for each member or ownerless if per_user is None; returns their ids."""
+    data = sessions.ServerSessionInterface.serializer.dumps(DATA)
+    sids = [f"{prefix}-{i}" for i in range(count)]
+    if isinstance(store, sessions.SQLiteSessionStore):
+        with store._db() as db:
+            db.executemany("INSERT INTO sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)",
+                           ((sid, per_user and i // per_user, data, expires) for i, sid in enumerate(sids)))
+            db.commit()
+    else:
+        for i, sid in enumerate(sids):
+            store.create(sid, per_user and i // per_user, data, expires)
+    return sids
+
+def bench_store(app, store, args):
+    interface = sessions.ServerSessionInterface(store)
+    # Oldest first, as idle sessions would be; sweep() measures clearing them below.
+    _fill(store, sessions.SWEEP_BATCH * 10, None, datetime.now() - timedelta(seconds=1), 'expired')
+    sids = _fill(store, args.sessions, args.sessions_per_user, datetime.now() + timedelta(hours=1))
+    metrics = {
+        'read_us': _per_request_us(app, interface, _requests(app, sids, args.requests, 1), False),
+        'write_us': _per_request_us(app, interface, _requests(app, sids, args.requests, 2), True),
+    }
+    members = random.Random(3).sample(range(args.sessions // args.sessions_per_user), 100)
+    start = time.perf_counter()
+    revoked = sum(store.revoke_user(member) for member in members)
+    metrics['revoke_user_us'] = (time.perf_counter() - start) / len(members) * 1e6
+    if revoked != len(members) * args.sessions_per_user:
+        raise AssertionError(f"revoked {revoked} sessions, expected {len(members) * args.sessions_per_user}")
+
+    start = time.perf_counter()
+    swept = sum(store.sweep(datetime.now()) for _ in range(10))
+    metrics['sweep_batch_ms'] = (time.perf_counter() - start) / 10 * 1000
+    if swept != sessions.SWEEP_BATCH * 10:
+        raise AssertionError(f"swept {swept} sessions, expected {sessions.SWEEP_BATCH * 10}")
+    store.close()
+    return metrics
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100000, help="Sessions in each store.")
+    parser.add_argument('--sessions-per-user', type=int, default=2)
+    parser.add_argument('--requests', type=int, default=20000, help="Requests timed per case.")
+    parser.add_argument('--out', help="Result file or directory (default benchmarks/results).")
+    args = parser.parse_args(argv)
+
+    app = Flask('session_bench')
+    app.secret_key = 'bench'
+    # Sweeps are timed on their own; keep them out of the request timings.
+    sessions.SWEEP_EVERY = args.requests * 10
+    metrics = {}
+
+    cookie = SecureCookieSessionInterface()
+    signed = [cookie.get_signing_serializer(app).dumps(DATA)]
+    metrics['cookie.read_us'] = _per_request_us(app, cookie, _requests(app, signed, args.requests, 1), False)
+    metrics['cookie.write_us'] = _per_request_us(app, cookie, _requests(app, signed, args.requests, 2), True)
+
+    database.DATABASE = os.path.join(tempfile.mkdtemp(prefix='sessions_'), 'sessions.db')
+    database.init_db()
+    stores = {
+        'memory': sessions.MemorySessionStore(args.sessions * 2),
+        'sqlite': sessions.SQLiteSessionStore(database.get_backend()),
+    }
+    for name, store in stores.items():
+        for metric, value in bench_store(app, store, args).items():
+            metrics[f"{name}.{metric}"] = value
+    database.shutdown()
+
+    for name, value in metrics.items():
+        print(f"{name:28} {value:10.2f}")
+    path = results.save('sessions', {'sessions': args.sessions, 'sessions_per_user': args.sessions_per_user,
+                                     'requests': args.requests}, metrics, args.out)
+    print(f"results written to {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
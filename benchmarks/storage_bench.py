@@ -0,0 +1,138 @@
+"""Mixed read/write throughput for each storage profile.
+
+Readers run the /books listing query while writers borrow and return books,
+each on its own connection, for a fixed duration per profile.
+
+    python benchmarks/storage_bench.py --readers 4 --writers 2 --seconds 5
+    python benchmarks/storage_bench.py --profile wal --set synchronous=FULL
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import database
+
+LIST_QUERY = """
+    SELECT b.*,
+           (SELECT COUNT(*) FROM borrowings WHERE book_id = b.id AND return_date IS NULL) AS is_borrowed
+    FROM books b
+    WHERE b.title LIKE ? OR b.author LIKE ? OR b.genre LIKE ?
+    LIMIT 5 OFFSET ?
+"""
+
+def seed(path, books, members):
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO users (username, password_hash, role, name) VALUES (?, 'x', 'Member', ?)",
+                     ((f"m{i}", f"Member {i}") for i in range(members)))
+    conn.executemany("INSERT INTO books (title, author, genre) VALUES (?, ?, ?)",
+                     ((f"Title {i}", f"Author {i % 500}", f"Genre {i % 20}") for i in range(books)))
+    conn.commit()
+    conn.close()
+
+def run_profile(name, settings, args):
+    workdir = tempfile.mkdtemp(prefix='storage_bench_')
+    path = os.path.join(workdir, 'bench.db')
+    database.DATABASE = path
+    backends.configure_storage(name, **settings)
+    database.init_db()
+    seed(path, args.books, args.members)
+
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'busy': 0}
+    lock = threading.Lock()
+
+    def connect():
+        conn = sqlite3.connect(path, check_same_thread=False)
+        backends.apply_storage_profile(conn)
+        return conn
+
+    def reader():
+        conn = connect()
+        done = 0
+        while not stop.is_set():
+            conn.execute(LIST_QUERY, ('%1%', '%1%', '%1%', random.randrange(0, args.books // 2))).fetchall()
+            done += 1
+        conn.close()
+        with lock:
+            counts['reads'] += done
+
+    def writer():
+        conn = connect()
+        done = busy = 0
+        while not stop.is_set():
+            book_id = random.randint(1, args.books)
+            user_id = random.randint(1, args.members)
+            try:
+                conn.execute("INSERT INTO borrowings (book_id, user_id, borrow_date) "
+                             "VALUES (?, ?, date('now', 'localtime'))", (book_id, user_id))
+                conn.execute("UPDATE books SET status = 'Borrowed' WHERE id = ?", (book_id,))
+                conn.commit()
+                conn.execute("UPDATE borrowings SET return_date = date('now', 'localtime') "
+                             "WHERE book_id = ? AND return_date IS NULL", (book_id,))
+                conn.execute("UPDATE books SET status = 'Available' WHERE id = ?", (book_id,))
+                conn.commit()
+                done += 2
+            except sqlite3.OperationalError:
+                conn.rollback()
+                busy += 1
+        conn.close()
+        with lock:
+            counts['writes'] += done
+            counts['busy'] += busy
+
+    checkpointer = database.start_checkpointer()
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    database.stop_checkpointer()
+
+    return {
+        'profile': name,
+        'reads_per_sec': counts['reads'] / args.seconds,
+        'writes_per_sec': counts['writes'] / args.seconds,
+        'busy_errors': counts['busy'],
+        'checkpoints': checkpointer.runs if checkpointer else 0,
+    }
+
+def parse_settings(pairs):
+    settings = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        settings[key] = int(value) if value.lstrip('-').isdigit() else value
+    return settings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', action='append', choices=sorted(backends.STORAGE_PROFILES),
+                        help="Profile to run (repeatable). Defaults to every profile.")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="Override a storage setting, e.g. --set cache_size=-64000")
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--members', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    settings = parse_settings(args.set)
+    print(f"{'profile':<10}{'reads/s':>12}{'writes/s':>12}{'busy':>8}{'ckpts':>8}")
+    for name in args.profile or sorted(backends.STORAGE_PROFILES):
+        result = run_profile(name, settings, args)
+        print(f"{result['profile']:<10}{result['reads_per_sec']:>12.0f}{result['writes_per_sec']:>12.0f}"
+              f"{result['busy_errors']:>8}{result['checkpoints']:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Queries per request on the hot member routes, with and without the user cache.
+
+Drives /profile and /edit_member through the Flask test
+client and counts the SQL statements each request sends to SQLite.
+
+    python benchmarks/user_cache_bench.py --requests 2000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+import database
+from cache import LRUCache
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix='user_cache_bench_'), 'bench.db')
+    database.DATABASE = path
+    import app as app_module
+    app = app_module.create_app()
+
+    password = generate_password_hash('pw', method='pbkdf2:sha256:1000')
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (username, password_hash, role, name) VALUES ('lib', ?, 'Librarian', 'Lib')",
+                 (password,))
+    conn.executemany("INSERT INTO users (username, password_hash, role, name, email) VALUES (?, ?, 'Member', ?, ?)",
+                     ((f"m{i}", password, f"Member {i}", f"m{i}@example.com") for i in range(args.members)))
+    conn.commit()
+    conn.close()
+
+    statements = [0]
+
+    @app.before_request
+    def count_statements():
+        database.get_db().set_trace_callback(lambda sql: statements.__setitem__(0, statements[0] + 1))
+
+    @app.teardown_request
+    def stop_counting(exception=None):
+        database.get_db().set_trace_callback(None)
+
+    librarian = app.test_client()
+    librarian.post('/login', data={'username': 'lib', 'password': 'pw'})
+    member = app.test_client()
+    member.post('/login', data={'username': 'm0', 'password': 'pw'})
+    routes = [
+        (member, '/profile'),
+        (librarian, '/profile'),
+        (librarian, '/edit_member/2'),
+        (librarian, '/edit_member/3'),
+    ]
+
+    print(f"{'user cache':<12}{'requests':>10}{'queries/req':>13}{'ms/req':>9}{'hit rate':>10}")
+    for label, cache in (('off', LRUCache(0)), ('on', LRUCache(database.USER_CACHE_SIZE, database.USER_CACHE_TTL))):
+        database.user_cache = cache
+        statements[0] = 0
+        start = time.perf_counter()
+        for i in range(args.requests):
+            client, url = routes[i % len(routes)]
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<12}{args.requests:>10}{statements[0] / args.requests:>13.2f}"
+              f"{elapsed / args.requests * 1000:>9.3f}{cache.stats()['hit_rate']:>10.1%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""Streaming bulk import and export of the book catalog (CSV or JSON Lines).
+
+Imports read the source lazily, validate and de-duplicate each record on
+(title, author), and insert with executemany in batches, committing once
+per transaction_size rows. Exports page through books with fetchmany, so
+neither direction ever holds the whole catalog in memory.
+
+    python catalog_io.py import catalog.csv --batch-size 2000
+    python catalog_io.py export catalog.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('title', 'author', 'genre')
+MAX_FIELD_LENGTH = 500
+BATCH_SIZE = 1000
+TRANSACTION_SIZE = 50000
+
+# Skips a row whose (title, author) is already in the catalog. The lookup is
+# served by idx_books_title.
+INSERT_SQL = """
+    INSERT INTO books (title, author, genre)
+    SELECT ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM books WHERE title = ? AND author = ?)
+"""
+
+class ImportReport:
+    """Running totals for an import, passed to the progress callback after every batch."""
+
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'read': self.read,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'seconds': round(self.elapsed, 3),
+            'errors': self.errors,
+        }
+
+    def __str__(self):
+        rate = self.read / self.elapsed if self.elapsed else 0
+        return (f"{self.read} read, {self.inserted} inserted, {self.duplicates} duplicates, "
+                f"{self.invalid} invalid ({rate:.0f} rows/s)")
+
+def detect_format(name):
+    """Guess the format from a file name; defaults to CSV."""
+    return 'jsonl' if name.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def iter_records(stream, fmt):
+    """Yield (line_number, dict) pairs from a text stream, one record at a time."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(f"invalid JSON: {e}")
+                continue
+            yield line_number, record
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+def _clean(value):
+    if value is None:
+        return ''
+    return ' '.join(str(value).split())
+
+def validate(record):
+    """Return a (title, author, genre) tuple, or raise ValueError."""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+    title = _clean(record.get('title'))
+    author = _clean(record.get('author'))
+    genre = _clean(record.get('genre')) or None
+    if not title:
+        raise ValueError("missing title")
+    if not author:
+        raise ValueError("missing author")
+    for name, value in (('title', title), ('author', author), ('genre', genre or '')):
+        if len(value) > MAX_FIELD_LENGTH:
+            raise ValueError(f"{name} longer than {MAX_FIELD_LENGTH} characters")
+    return title, author, genre
+
+def import_books(db, stream, fmt='csv', batch_size=BATCH_SIZE, transaction_size=TRANSACTION_SIZE,
+                 progress=None, max_errors=100):
+    """Stream records from a text stream into books. Returns an ImportReport.
+
+    Rows are inserted batch_size at a time and committed every
+    transaction_size rows. Duplicates within the source and against the
+    existing catalog are skipped. The first max_errors validation problems are
+    kept in the report.
+    """
+    report = ImportReport()
+    seen = set()
+    batch = []
+    pending = 0
+
+    def flush():
+        nonlocal pending
+        if not batch:
+            return
+        if not db.in_transaction:
+            db.execute("BEGIN IMMEDIATE")
+        # rowcount excludes rows written by triggers (books_fts), so it is
+        # exactly the number of books inserted.
+        inserted = db.executemany(INSERT_SQL, [(t, a, g, t, a) for t, a, g in batch]).rowcount
+        report.inserted += inserted
+        report.duplicates += len(batch) - inserted
+        pending += len(batch)
+        batch.clear()
+        if pending >= transaction_size:
+            db.commit()
+            pending = 0
+        if progress:
+            progress(report)
+
+    try:
+        for line_number, record in iter_records(stream, fmt):
+            report.read += 1
+            try:
+                row = validate(record)
+            except ValueError as e:
+                report.invalid += 1
+                if len(report.errors) < max_errors:
+                    report.errors.append(f"line {line_number}: {e}")
+                continue
+            key = row[:2]
+            if key in seen:
+                report.duplicates += 1
+                continue
+            seen.add(key)
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        if db.in_transaction:
+            db.commit()
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return report
+
+def export_books(db, stream, fmt='csv', batch_size=BATCH_SIZE):
+    """Write every book to a text stream, fetching batch_size rows at a time. Returns the row count."""
+    count = 0
+    for chunk, rows in _export_chunks(db, fmt, batch_size):
+        stream.write(chunk)
+        count += rows
+    return count
+
+def iter_export(db, fmt='csv', batch_size=BATCH_SIZE):
+    """Yield the catalog as text chunks of at most batch_size books each."""
+    for chunk, _ in _export_chunks(db, fmt, batch_size):
+        yield chunk
+
+def _export_chunks(db, fmt, batch_size):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    columns = ('id',) + FIELDS + ('status',)
+    cursor = db.execute(f"SELECT {', '.join(columns)} FROM books ORDER BY id")
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue(), 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        if fmt == 'csv':
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(tuple(row) for row in rows)
+            chunk = buffer.getvalue()
+        else:
+            chunk = ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+        yield chunk, len(rows)
+
+def main(argv=None):
+    import database
+
+    parser = argparse.ArgumentParser(description="Bulk import or export the book catalog.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    imp = sub.add_parser('import', help="Load books from a CSV or JSONL file ('-' for stdin).")
+    imp.add_argument('path')
+    imp.add_argument('--format', choices=FORMATS)
+    imp.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    imp.add_argument('--transaction-size', type=int, default=TRANSACTION_SIZE)
+    exp = sub.add_parser('export', help="Write every book to a CSV or JSONL file ('-' for stdout).")
+    exp.add_argument('path')
+    exp.add_argument('--format', choices=FORMATS)
+    exp.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+    database.init_db()
+    db = database.get_db()
+    try:
+        if args.command == 'import':
+            stream = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+            with stream:
+                report = import_books(db, stream, fmt, args.batch_size, args.transaction_size,
+                                      progress=lambda r: print(f"\r{r}", end='', file=sys.stderr))
+            print(file=sys.stderr)
+            for error in report.errors:
+                print(error, file=sys.stderr)
+            print(report)
+        else:
+            stream = sys.stdout if args.path == '-' else open(args.path, 'w', newline='', encoding='utf-8')
+            with stream:
+                for chunk in iter_export(db, fmt, args.batch_size):
+                    stream.write(chunk)
+            if args.path != '-':
+                print(f"Exported catalog to {os.path.abspath(args.path)}", file=sys.stderr)
+    finally:
+        database.close_db()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,108 +1,308 @@
-import sqlite3
-from flask import flash, redirect, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
-
-DATABASE = 'library.db'
+import random
+import threading
+import time
+from datetime import datetime
+from queue import LifoQueue, Empty
+from flask import flash, redirect, url_for, g, has_app_context
+
+import backends
+import passwords
+from backends import STORAGE_PROFILE, DatabaseError
+from cache import LRUCache
+import jobs
+import notifications  # registers the notification job handlers
+import reservations
+import loans
+import recommendations
+import search as search_index
+from pagination import decode_cursor, encode_cursor, keyset_clause
+from timestamps import parse_timestamp
+
+DATABASE = 'library.db'  # a connection string, see backends.py
+POOL_SIZE = 10
+POOL_TIMEOUT = 5.0
+TXN_RETRIES = 5
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 60.0
+TXN_BACKOFF = 0.01
+
+class Checkpointer:
+    """Background thread that checkpoints the WAL on a fixed interval.
+
+    Autocheckpointing runs inside whichever request happens to commit past the
+    threshold; doing it here keeps that cost off the request path.
+    """
+
+    def __init__(self, connect, interval, mode='PASSIVE'):
+        self.connect = connect
+        self.interval = interval
+        self.mode = mode
+        self.runs = 0
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='wal-checkpointer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def checkpoint(self, conn):
+        # Returns (busy, wal_pages, checkpointed_pages).
+        self.last_result = tuple(conn.execute(f"PRAGMA wal_checkpoint({self.mode})").fetchone())
+        self.runs += 1
+        return self.last_result
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.checkpoint(conn)
+                except DatabaseError as e:
+                    print(f"Error checkpointing database: {e}")
+        finally:
+            conn.close()
+
+_checkpointer = None
+
+def start_checkpointer():
+    """Start the background checkpointer if the backend and active profile ask for one."""
+    global _checkpointer
+    backend = get_backend()
+    if _checkpointer is not None or not backend.checkpoints:
+        return _checkpointer
+    _checkpointer = Checkpointer(backend.connect_maintenance, STORAGE_PROFILE['checkpoint_interval'],
+                                 STORAGE_PROFILE['checkpoint_mode']).start()
+    return _checkpointer
+
+def stop_checkpointer():
+    global _checkpointer
+    if _checkpointer is not None:
+        _checkpointer.stop()
+        _checkpointer = None
+
+class ConnectionPool:
+    """A bounded pool of connections to a backend, each set up once when it is opened."""
+
+    def __init__(self, backend, max_size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.backend = backend
+        self.database = backend.url
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def checkout(self):
+        """Take a connection from the pool, opening a new one if below max_size."""
+        start = time.perf_counter()
+        conn = None
+        with self._lock:
+            if self._idle.empty() and self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                conn = self.backend.connect()
+            except self.backend.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except Empty:
+                raise self.backend.OperationalError(
+                    f"Timed out after {self.timeout}s waiting for a database connection")
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work.
+
+        A connection released after close() is closed instead of kept.
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            broken = False
+        except self.backend.Error:
+            broken = True
+        with self._lock:
+            self._in_use -= 1
+            discard = broken or self._closed
+            if discard:
+                self._created -= 1
+            else:
+                # Under the lock, so close() cannot drain the queue in between.
+                self._idle.put(conn)
+        if discard:
+            conn.close()
+
+    def close(self):
+        """Close every idle connection. Checked-out connections are closed on release."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        """Return pool size, checkout wait times and connections in use."""
+        with self._lock:
+            return {
+                'database': self.database,
+                'backend': self.backend.scheme,
+                'max_size': self.max_size,
+                'size': self._created,
+                'idle': self._idle.qsize(),
+                'in_use': self._in_use,
+                'checkouts': self._checkouts,
+                'wait_seconds_total': self._wait_total,
+                'wait_seconds_avg': self._wait_total / self._checkouts if self._checkouts else 0.0,
+                'wait_seconds_max': self._wait_max,
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def get_pool():
+    """Return the process-wide pool, rebuilding it if DATABASE has changed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database != DATABASE:
+            if _pool is not None:
+                _pool.close()
+                _pool.backend.close()
+            _pool = ConnectionPool(backends.backend_for(DATABASE), POOL_SIZE, POOL_TIMEOUT)
+        return _pool
+
+def get_backend():
+    """The backend named by DATABASE."""
+    return get_pool().backend
 
 def get_db():
-    """Get a database connection with row_factory as sqlite3.Row."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row 
-    conn.execute("PRAGMA foreign_keys = ON") 
-    return conn
+    """Get the connection for the current request (or thread) with row_factory as sqlite3.Row.
+
+    Inside a Flask app context the connection is stored on ``g`` and handed back
+    to the pool by ``close_db`` at teardown. Outside one (scripts, background
+    threads) the connection is kept per thread until ``close_db`` is called.
+    """
+    if has_app_context():
+        if '_database' not in g:
+            pool = get_pool()
+            g._database = (pool, pool.checkout())
+        return g._database[1]
+    held = getattr(_local, 'conn', None)
+    if held is None:
+        pool = get_pool()
+        held = _local.conn = (pool, pool.checkout())
+    return held[1]
+
+def close_db(exception=None):
+    """Release the current request's (or thread's) connection back to the pool."""
+    if has_app_context():
+        held = g.pop('_database', None)
+    else:
+        held = getattr(_local, 'conn', None)
+        _local.conn = None
+    if held is not None:
+        pool, conn = held
+        pool.release(conn)
+
+def pool_stats():
+    """Metrics for the connection pool."""
+    return get_pool().stats()
+
+def init_app(app, background=True):
+    """Register the connection teardown with a Flask app and start the background jobs."""
+    app.teardown_appcontext(close_db)
+    if background:
+        start_checkpointer()
+        start_periodic_workers()
+        start_job_workers()
+
+def shutdown():
+    """Stop the background jobs and close every pooled connection."""
+    global _pool
+    stop_job_workers()
+    stop_periodic_workers()
+    stop_checkpointer()
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+        pool.backend.close()
 
 def init_db():
-    """Initialize the database with tables for books, members, users, borrowings, and reservations."""
+    """Initialize the database and bring its schema up to the latest migration."""
+    backend = get_backend()
     try:
-        with sqlite3.connect(DATABASE) as conn:
-            conn.row_factory = sqlite3.Row 
-
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                password_hash TEXT NOT NULL,
-                role TEXT NOT NULL,
-                name TEXT,
-                email TEXT
-            )
-            """)
-
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                author TEXT NOT NULL,
-                genre TEXT,
-                status TEXT DEFAULT 'Available'
-            )
-            """)
-
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS borrowings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id INTEGER,
-                user_id INTEGER,
-                borrow_date TEXT,
-                return_date TEXT,
-                FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-            """)
-
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS reservations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id INTEGER,
-                user_id INTEGER,
-                reservation_date TEXT,
-                queue_position INTEGER,
-                status TEXT DEFAULT 'Pending',  -- Can be 'Pending' or 'Fulfilled'
-                FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-            """)
-
-            conn.commit()
-    except sqlite3.Error as e:
+        backend.initialize()
+    except backend.Error as e:
         print(f"Error initializing database: {e}")
 
-def add_queue_position_column():
-    """Add the queue_position column to the reservations table if it doesn't exist."""
-    db = get_db()
-    try:
-        db.execute("ALTER TABLE reservations ADD COLUMN queue_position INTEGER;")
-        db.commit()
-    except sqlite3.Error as e:
-        print(f"Error adding column: {e}")
-
 def create_user(userid, password, role, name=None, email=None):
-    """Create a new user with a hashed password."""
+    """Create a new user with a hashed password. Returns the new id, or an error message if userid is taken."""
     db = get_db()
-    password_hash = generate_password_hash(password)  # Hash the password
+    password_hash = passwords.hash_password(password)  # Hash the password
     try:
-        db.execute("INSERT INTO users (username, password_hash, role, name, email) VALUES (?, ?, ?, ?, ?)",
-                   (userid, password_hash, role, name, email))
+        user_id = db.execute("INSERT INTO users (username, password_hash, role, name, email) VALUES (?, ?, ?, ?, ?)",
+                             (userid, password_hash, role, name, email)).lastrowid
         db.commit()
-    except sqlite3.IntegrityError as e:
-
+    except get_backend().IntegrityError:
+        db.rollback()
         return f"Error: User ID '{userid}' already exists. Please choose a different User ID."
-    return db.lastrowid
+    return user_id
+
+def get_user_by_username(userid):
+    """Fetch a user row by username, or None."""
+    return get_db().execute("SELECT * FROM users WHERE username = ?", (userid,)).fetchone()
 
 def check_user_credentials(userid, password):
     """Check if the user's credentials are correct."""
-    db = get_db()
-    user = db.execute("SELECT * FROM users WHERE username = ?", (userid,)).fetchone()
+    user = get_user_by_username(userid)
 
-    if user and check_password_hash(user['password_hash'], password): 
+    if user and passwords.check_password(user['password_hash'], password): 
         return user
     return None
 
+# Users by id, as dicts. Invalidate through invalidate_user() on every write to a user row.
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
 def get_user_by_id(user_id):
-    """Fetch user details by user_id."""
-    db = get_db()
-    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    return user
+    """Fetch user details by user_id, from the user cache when possible."""
+    def load():
+        user = get_db().execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return dict(user) if user else None
+    return user_cache.get_or_load(user_id, load)
+
+def invalidate_user(user_id):
+    """Drop a user from the user cache after their row changes."""
+    user_cache.invalidate(user_id)
 
 def get_members():
     """Fetch all members from the database (users with 'Member' role)."""
@@ -110,14 +310,109 @@ def get_members():
     members = db.execute("SELECT * FROM users WHERE role = 'Member'").fetchall()
     return members
 
+# Counts come from the per-user borrowing indexes, so each row costs
+# a few index range scans however long the member's history is.
+# {conditions} is joined with AND; {order} comes from keyset_clause().
+MEMBERS_PAGE_SQL = """
+    SELECT u.id, u.username, u.name, u.email,
+           (SELECT COUNT(*) FROM borrowings
+            WHERE user_id = u.id AND return_date IS NULL) AS active_count,
+           (SELECT COUNT(*) FROM borrowings WHERE user_id = u.id)
+           + (SELECT COUNT(*) FROM borrowings_archive WHERE user_id = u.id) AS total_count
+    FROM users u
+    WHERE {conditions}
+    ORDER BY {order}
+    LIMIT ?
+"""
+
+# Walks the (user_id, borrow_date) indexes of both tables backwards from the cursor.
+# {keyset} is empty or 'AND ' plus the keyset_clause() condition.
+MEMBER_HISTORY_SQL = """
+    SELECT bo.id, b.title, b.author, bo.borrow_date, bo.return_date
+    FROM borrowing_history bo
+    JOIN books b ON bo.book_id = b.id
+    WHERE bo.user_id = ? {keyset}
+    ORDER BY {order}
+    LIMIT ?
+"""
+
+OPEN_LOAN_COUNT_SQL = """
+    SELECT COUNT(*) AS count FROM borrowings
+    WHERE user_id = ? AND return_date IS NULL
+"""
+
+def get_members_page(search='', per_page=20, after=None, before=None):
+    """Fetch one keyset page of members ordered by username, with their loan counts.
+
+    Returns a dict shaped like get_books_page's: members, cursors and page_args.
+    """
+    db = get_db()
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+    cursor = after or before
+
+    keyset, order, keyset_params = keyset_clause('u.username', 'u.id', cursor, backwards=before is not None)
+    conditions = ["u.role = 'Member'"]
+    params = []
+    if search:
+        conditions.append("(u.name LIKE ? OR u.email LIKE ? OR u.username LIKE ?)")
+        params += [f"%{search}%"] * 3
+    if keyset:
+        conditions.append(keyset)
+        params += keyset_params
+
+    sql = MEMBERS_PAGE_SQL.format(conditions=' AND '.join(conditions), order=order)
+    rows = db.execute(sql, (*params, per_page + 1)).fetchall()
+
+    more = len(rows) > per_page
+    members = [dict(row, returned_count=row['total_count'] - row['active_count']) for row in rows[:per_page]]
+    if before is not None:
+        members.reverse()
+    has_next = more if before is None else True
+    has_prev = cursor is not None and (before is None or more)
+
+    return {
+        'members': members,
+        'page_args': {'search': search or None, 'per_page': per_page},
+        'next_cursor': encode_cursor((members[-1]['username'], members[-1]['id'])) if has_next and members else None,
+        'prev_cursor': encode_cursor((members[0]['username'], members[0]['id'])) if has_prev and members else None,
+        'first_page': cursor is None,
+    }
+
+def get_member_history_page(member_id, per_page=20, after=None):
+    """Fetch one keyset page of a member's loans, newest first, across hot and archived history.
+
+    Returns a dict with the history rows and the next_cursor, if there are more.
+    """
+    after = decode_cursor(after)
+    keyset, order, keyset_params = keyset_clause('bo.borrow_date', 'bo.id', after, backwards=True)
+    sql = MEMBER_HISTORY_SQL.format(keyset='AND ' + keyset if keyset else '', order=order)
+    rows = get_db().execute(sql, (member_id, *keyset_params, per_page + 1)).fetchall()
+
+    history = rows[:per_page]
+    more = len(rows) > per_page
+    return {
+        'history': history,
+        'next_cursor': encode_cursor((history[-1]['borrow_date'], history[-1]['id'])) if more else None,
+    }
+
+def open_loan_count(user_id):
+    """Number of books a user has borrowed and not yet returned."""
+    return get_db().execute(OPEN_LOAN_COUNT_SQL, (user_id,)).fetchone()['count']
+
 def update_user(user_id, name=None, email=None):
     """Update user's profile information."""
     db = get_db()
-    if name:
-        db.execute("UPDATE users SET name = ? WHERE id = ?", (name, user_id))
-    if email:
-        db.execute("UPDATE users SET email = ? WHERE id = ?", (email, user_id))
+    db.execute("UPDATE users SET name = ?, email = ? WHERE id = ?", (name, email, user_id))
+    db.commit()
+    invalidate_user(user_id)
+
+def delete_user(user_id):
+    """Delete a user; their borrowing history, reservations and notifications go with them."""
+    db = get_db()
+    db.execute("DELETE FROM users WHERE id = ?", (user_id,))
     db.commit()
+    invalidate_user(user_id)
 
 def get_books():
     """Fetch all books from the database."""
@@ -125,35 +420,434 @@ def get_books():
     books = db.execute("SELECT * FROM books").fetchall()
     return books
 
+# Sort orders offered on the catalog pages; each has an index on (column, id).
+BOOK_SORTS = {
+    'id': 'b.id',
+    'title': 'b.title',
+    'author': 'b.author',
+}
+
+# Catalog pages. {sort_key} is a BOOK_SORTS expression or search.RANK and
+# {order} comes from keyset_clause(); {where} is empty or 'WHERE ' plus the
+# keyset condition, {keyset} empty or 'AND ' plus it.
+BOOKS_PAGE_SQL = """
+    SELECT b.*, {sort_key} AS sort_key
+    FROM books b
+    {where}
+    ORDER BY {order}
+    LIMIT ?
+"""
+BOOKS_SEARCH_SQL = """
+    SELECT b.*, {sort_key} AS sort_key
+    FROM books_fts f
+    JOIN books b ON b.id = f.rowid
+    WHERE books_fts MATCH ? {keyset}
+    ORDER BY {order}
+    LIMIT ?
+"""
+
+def get_books_page(search='', sort='id', per_page=5, after=None, before=None, counts=None):
+    """Fetch one keyset page of the catalog, optionally filtered by a search string.
+
+    after/before are opaque cursors from a previous page. counts, if given,
+    is a CountCache for the total. Returns a dict with the books (as dicts),
+    total_books, the cursors for the neighbouring pages and the page_args
+    needed to build their links.
+    """
+    db = get_db()
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+    cursor = after or before
+
+    match = search_index.match_expression(search)
+    if match:
+        sort = 'rank'
+        sort_expr = search_index.RANK
+    else:
+        if sort not in BOOK_SORTS:
+            sort = 'id'
+        sort_expr = BOOK_SORTS[sort]
+
+    keyset, order, keyset_params = keyset_clause(sort_expr, 'b.id', cursor, backwards=before is not None)
+
+    # One extra row tells us whether there is another page in this direction.
+    if match:
+        sql = BOOKS_SEARCH_SQL.format(sort_key=sort_expr, keyset='AND ' + keyset if keyset else '', order=order)
+        rows = db.execute(sql, (match, *keyset_params, per_page + 1)).fetchall()
+        count = lambda: search_index.count_matches(db, match)
+    else:
+        sql = BOOKS_PAGE_SQL.format(sort_key=sort_expr, where='WHERE ' + keyset if keyset else '', order=order)
+        rows = db.execute(sql, (*keyset_params, per_page + 1)).fetchall()
+        count = lambda: db.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+    total_books = counts.get(match, count) if counts is not None else count()
+
+    more = len(rows) > per_page
+    books = [dict(row) for row in rows[:per_page]]
+    if before is not None:
+        books.reverse()
+    has_next = more if before is None else True
+    has_prev = cursor is not None and (before is None or more)
+
+    return {
+        'books': books,
+        'total_books': total_books,
+        'page_args': {'search': search or None, 'sort': None if match else sort, 'per_page': per_page},
+        'next_cursor': encode_cursor((books[-1]['sort_key'], books[-1]['id'])) if has_next and books else None,
+        'prev_cursor': encode_cursor((books[0]['sort_key'], books[0]['id'])) if has_prev and books else None,
+        'first_page': cursor is None,
+    }
+
+def get_book(book_id):
+    """Fetch a book row by id, or None."""
+    return get_db().execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+
 def add_book(title, author, genre):
-    """Add a new book to the catalog."""
+    """Add a new book to the catalog. Returns its id."""
     db = get_db()
-    db.execute("INSERT INTO books (title, author, genre) VALUES (?, ?, ?)", (title, author, genre))
+    book_id = db.execute("INSERT INTO books (title, author, genre) VALUES (?, ?, ?)",
+                         (title, author, genre)).lastrowid
     db.commit()
+    return book_id
 
-def update_book(book_id, title, author, genre):
-    """Update book details."""
+BOOK_FIELDS = ('title', 'author', 'genre')
+
+def update_book(book_id, **fields):
+    """Update the given BOOK_FIELDS of a book. Returns False if there is no such book."""
+    unknown = set(fields) - set(BOOK_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown book fields: {', '.join(sorted(unknown))}")
     db = get_db()
-    db.execute("UPDATE books SET title = ?, author = ?, genre = ? WHERE id = ?", (title, author, genre, book_id))
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    updated = db.execute(f"UPDATE books SET {assignments} WHERE id = ?", (*fields.values(), book_id)).rowcount
     db.commit()
+    return updated > 0
 
-def borrow_book(book_id, user_id):
-    """Record a book borrowing action."""
+def delete_book(book_id):
+    """Remove a book from the catalog. Returns False if there is no such book."""
     db = get_db()
+    deleted = db.execute("DELETE FROM books WHERE id = ?", (book_id,)).rowcount
+    db.commit()
+    return deleted > 0
+
+class TransactionConflict(Exception):
+    """A write lost a race (or found the row in the wrong state) and was rolled back."""
+
+_txn_lock = threading.Lock()
+_txn_stats = {'commits': 0, 'conflicts': 0, 'busy_retries': 0, 'busy_failures': 0}
+
+def _count(key):
+    with _txn_lock:
+        _txn_stats[key] += 1
+
+def transaction_stats():
+    """Counters for run_transaction: commits, conflicts, busy retries and busy failures."""
+    with _txn_lock:
+        return dict(_txn_stats)
+
+def run_transaction(work, retries=None, backoff=None):
+    """Run work(db) inside a write transaction (BEGIN IMMEDIATE on SQLite) and commit, returning its result.
+
+    The write lock is taken up front, so every read made by work sees the
+    state its writes will be applied to. Lock timeouts (SQLITE_BUSY) are
+    retried with exponential backoff and jitter. TransactionConflict raised by work rolls
+    back and propagates to the caller.
+    """
+    retries = TXN_RETRIES if retries is None else retries
+    backoff = TXN_BACKOFF if backoff is None else backoff
+    db = get_db()
+    backend = get_backend()
+    for attempt in range(retries + 1):
+        try:
+            backend.begin(db)
+            result = work(db)
+            db.commit()
+        except TransactionConflict:
+            db.rollback()
+            _count('conflicts')
+            raise
+        except backend.IntegrityError as e:
+            db.rollback()
+            _count('conflicts')
+            raise TransactionConflict(str(e)) from e
+        except backend.OperationalError as e:
+            if db.in_transaction:
+                db.rollback()
+            if not backend.is_busy(e):
+                raise
+            if attempt == retries:
+                _count('busy_failures')
+                raise
+            _count('busy_retries')
+            time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+            continue
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        _count('commits')
+        return result
+
+# The single-row steps of a loan, return and reservation, each a primary key
+# or partial index lookup.
+LEND_SQL = """
+    UPDATE books SET status = 'Borrowed', borrowed_by = ?, held_for = NULL
+    WHERE id = ? AND (status = 'Available' OR (status = 'On Hold' AND held_for = ?))
+"""
+RETURN_SQL = """
+    UPDATE borrowings SET return_date = ?
+    WHERE id = ? AND return_date IS NULL
+"""
+OPEN_LOAN_FOR_BOOK_SQL = "SELECT id FROM borrowings WHERE book_id = ? AND return_date IS NULL"
+OPEN_LOAN_SQL = """
+    SELECT id FROM borrowings
+    WHERE book_id = ? AND user_id = ? AND return_date IS NULL
+"""
+ACTIVE_RESERVATION_SQL = """
+    SELECT 1 FROM reservations
+    WHERE book_id = ? AND user_id = ? AND status IN ('Pending', 'Ready')
+"""
+
+def _lend(db, book_id, user_id):
+    updated = db.execute(LEND_SQL, (user_id, book_id, user_id)).rowcount
+    if not updated:
+        book = db.execute("SELECT status FROM books WHERE id = ?", (book_id,)).fetchone()
+        if book is None:
+            raise TransactionConflict("The requested book does not exist.")
+        if book['status'] == 'On Hold':
+            raise TransactionConflict("This book is on hold for another member.")
+        raise TransactionConflict("This book is currently not available.")
+    reservations.fulfil_hold(db, book_id, user_id)
+    now = datetime.now()
+    due_date, fine_per_day, max_fine = loans.loan_terms(db, book_id, user_id, now)
+    return db.execute("""
+        INSERT INTO borrowings (book_id, user_id, borrow_date, due_date, fine_per_day_cents, max_fine_cents)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (book_id, user_id, now, due_date, fine_per_day, max_fine)).lastrowid
+
+def _return(db, borrowing_id, user_id=None):
+    borrowing = db.execute("SELECT * FROM borrowings WHERE id = ?", (borrowing_id,)).fetchone()
+    if borrowing is None:
+        raise TransactionConflict("Borrowing record not found.")
+    if user_id is not None and borrowing['user_id'] != user_id:
+        raise TransactionConflict("This book was borrowed by another member.")
+    now = datetime.now()
+    updated = db.execute(RETURN_SQL, (now, borrowing_id)).rowcount
+    if not updated:
+        raise TransactionConflict("This book has already been returned.")
+    fine = loans.settle_fine(db, borrowing, now)
+    hold = reservations.hand_off(db, borrowing['book_id'])
+    return dict(borrowing, fine_cents=fine, held_for=hold['user_id'] if hold else None)
+
+def _reserve(db, book_id, user_id):
+    book = db.execute("SELECT status, held_for FROM books WHERE id = ?", (book_id,)).fetchone()
+    if book is None:
+        raise TransactionConflict("The requested book does not exist.")
+    if book['status'] == 'Available':
+        raise TransactionConflict("The book is available! You can borrow it directly.")
+    if book['status'] == 'On Hold' and book['held_for'] == user_id:
+        raise TransactionConflict("This book is on hold for you. You can borrow it now.")
+    existing = db.execute(ACTIVE_RESERVATION_SQL, (book_id, user_id)).fetchone()
+    if existing:
+        raise TransactionConflict("You have already reserved this book.")
+    queue_position = reservations.next_queue_position(db, book_id)
+    db.execute("""
+        INSERT INTO reservations (book_id, user_id, reservation_date, queue_position)
+        VALUES (?, ?, ?, ?)
+    """, (book_id, user_id, datetime.now(), queue_position))
+    return reservations.queue_rank(db, book_id, queue_position)
+
+def lend_book(book_id, user_id):
+    """Atomically lend an available book, or one on hold for user_id. Returns the new borrowing id.
+
+    The conditional UPDATE only matches while the book is free for this
+    member, and the one-open-loan-per-book unique index backs it up, so a
+    double lend is impossible even if availability has drifted.
+    """
+    return run_transaction(lambda db: _lend(db, book_id, user_id))
+
+def return_borrowing(borrowing_id):
+    """Atomically close an open borrowing and hand the book to the next reservation.
+
+    Returns the borrowing as a dict, with 'held_for' set to the member the
+    book is now on hold for (or None if it is available).
+    """
+    return run_transaction(lambda db: _return(db, borrowing_id))
+
+def queue_reservation(book_id, user_id):
+    """Atomically append a reservation to a book's queue. Returns the member's place in the queue."""
+    return run_transaction(lambda db: _reserve(db, book_id, user_id))
+
+def run_batch(work, items):
+    """Apply work(db, item) to every item in one transaction, each under its own savepoint.
+
+    An item that raises TransactionConflict (or breaks a constraint) is
+    rolled back on its own and reported; the rest still commit. Returns a
+    list of (item, result, error) in input order.
+    """
+    integrity_error = get_backend().IntegrityError
+
+    def batch(db):
+        results = []
+        for item in items:
+            db.execute("SAVEPOINT batch_item")
+            try:
+                results.append((item, work(db, item), None))
+            except (TransactionConflict, integrity_error) as e:
+                db.execute("ROLLBACK TO batch_item")
+                results.append((item, None, str(e)))
+            db.execute("RELEASE batch_item")
+        return results
+    return run_transaction(batch)
+
+def lend_books(book_ids, user_id):
+    """Lend several books to one member in a single transaction. See run_batch."""
+    return run_batch(lambda db, book_id: _lend(db, book_id, user_id), book_ids)
+
+def queue_reservations(book_ids, user_id):
+    """Reserve several books for one member in a single transaction. See run_batch."""
+    return run_batch(lambda db, book_id: _reserve(db, book_id, user_id), book_ids)
+
+def return_borrowings(borrowing_ids, user_id=None):
+    """Close several borrowings in a single transaction. See run_batch.
+
+    With user_id set, only that member's borrowings are accepted.
+    """
+    return run_batch(lambda db, borrowing_id: _return(db, borrowing_id, user_id), borrowing_ids)
+
+def return_books(book_ids, user_id=None):
+    """Close the open loan on each of several books in a single transaction. See run_batch."""
+    def work(db, book_id):
+        borrowing = db.execute(OPEN_LOAN_FOR_BOOK_SQL, (book_id,)).fetchone()
+        if borrowing is None:
+            raise TransactionConflict("This book is not currently borrowed.")
+        return _return(db, borrowing['id'], user_id)
+    return run_batch(work, book_ids)
+
+def expire_holds(now=None, batch=None):
+    """Expire lapsed holds in small transactions, passing each book on. Returns the number expired."""
+    batch = batch or reservations.SWEEP_BATCH
+    total = 0
+    try:
+        while True:
+            expired = run_transaction(lambda db: reservations.expire_due_holds(db, now, batch))
+            total += expired
+            if expired < batch:
+                return total
+    finally:
+        if not has_app_context():
+            close_db()
+
+def scan_overdue(now=None, batch=None):
+    """Bring fines on every overdue open loan up to date, one short transaction per batch.
+
+    Returns the number of loans charged.
+    """
+    batch = batch or loans.SCAN_BATCH
+    now = now or datetime.now()
+    cursor = ('', 0)
+    charged = 0
+    try:
+        while cursor is not None:
+            _, updated, cursor = run_transaction(lambda db: loans.assess_overdue(db, now, cursor, batch))
+            charged += updated
+        return charged
+    finally:
+        if not has_app_context():
+            close_db()
+
+def refresh_recommendations(now=None, batch=None):
+    """Fold new loans into the recommendation tables, one short transaction per batch.
+
+    Returns the number of loans processed.
+    """
+    batch = batch or recommendations.REFRESH_BATCH
+    processed = 0
+    try:
+        while True:
+            done = run_transaction(lambda db: recommendations.refresh(db, now, batch))
+            processed += done
+            if done < batch:
+                return processed
+    finally:
+        if not has_app_context():
+            close_db()
+
+def run_next_job(now=None):
+    """Claim one due job and run it. Returns False if nothing was due."""
+    try:
+        job = run_transaction(lambda db: jobs.claim(db, now))
+        if job is None:
+            return False
+        jobs.run(job, run_transaction, get_db())
+        return True
+    finally:
+        if not has_app_context():
+            close_db()
+
+def run_due_jobs(now=None):
+    """Run jobs until none is due. Returns the number run."""
+    count = 0
+    while run_next_job(now):
+        count += 1
+    return count
+
+def job_stats():
+    """Queue depth, outcome counts and latencies for the background job queue."""
+    return jobs.stats(get_db())
+
+_job_workers = None
+
+def start_job_workers(workers=None, interval=None):
+    """Start the background threads that run queued jobs."""
+    global _job_workers
+    if _job_workers is None:
+        _job_workers = jobs.JobWorkers(run_next_job, workers or jobs.WORKERS,
+                                       interval or jobs.POLL_INTERVAL).start()
+    return _job_workers
+
+def stop_job_workers():
+    global _job_workers
+    if _job_workers is not None:
+        _job_workers.stop()
+        _job_workers = None
+
+def periodic_tasks():
+    """{name: (task, interval)} for the upkeep run by a jobs.PeriodicWorker each.
+
+    Intervals are read when the workers start, so app config set before then applies.
+    """
+    return {
+        'hold-sweeper': (expire_holds, reservations.SWEEP_INTERVAL),
+        'overdue-scanner': (scan_overdue, loans.SCAN_INTERVAL),
+        'recommendation-refresher': (refresh_recommendations, recommendations.REFRESH_INTERVAL),
+    }
+
+_periodic_workers = {}
+
+def start_periodic_workers(intervals=None):
+    """Start a background thread for each of periodic_tasks(); intervals overrides some by name."""
+    intervals = intervals or {}
+    for name, (task, interval) in periodic_tasks().items():
+        if name not in _periodic_workers:
+            _periodic_workers[name] = jobs.PeriodicWorker(name, task, intervals.get(name, interval)).start()
+    return dict(_periodic_workers)
+
+def stop_periodic_workers():
+    while _periodic_workers:
+        _, worker = _periodic_workers.popitem()
+        worker.stop()
 
-    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+def borrow_book(book_id, user_id):
+    """Record a book borrowing action."""
+    user = get_user_by_id(user_id)
     if user['role'] != 'Member':
         return "Only members can borrow books."
 
-    book = db.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
-    if book['status'] == 'Borrowed':
+    try:
+        lend_book(book_id, user_id)
+    except TransactionConflict:
         return "This book is already borrowed by someone else."
 
-    db.execute("INSERT INTO borrowings (book_id, user_id, borrow_date) VALUES (?, ?, date('now'))",
-               (book_id, user_id))
-    db.execute("UPDATE books SET status = 'Borrowed' WHERE id = ?", (book_id,))
-    db.commit()
-
     flash("Book borrowed successfully!", 'success')
     return redirect(url_for('user_profile', user_id=user_id)) 
 
@@ -161,76 +855,167 @@ def return_book(book_id, user_id):
     """Record a book return action."""
     db = get_db()
     
-    # Check if the book is borrowed
-    book = db.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
-    if not book or book['status'] != 'Borrowed':
+    borrowing = db.execute(OPEN_LOAN_SQL, (book_id, user_id)).fetchone()
+    if not borrowing:
+        return "This book is not currently borrowed."
+
+    try:
+        return_borrowing(borrowing['id'])
+    except TransactionConflict:
         return "This book is not currently borrowed."
-    
-    db.execute("UPDATE books SET status = 'Available' WHERE id = ?", (book_id,))
-    db.execute("""
-        UPDATE borrowings 
-        SET return_date = date('now') 
-        WHERE book_id = ? AND user_id = ? AND return_date IS NULL
-    """, (book_id, user_id))
-    db.commit()
 
 def reserve_book(book_id, user_id):
     """Reserve a book."""
+    try:
+        queue_reservation(book_id, user_id)
+    except TransactionConflict as e:
+        return str(e)
+
+AVAILABILITY_DRIFT_QUERY = """
+    SELECT id, status, borrowed_by, held_for, expected_status, expected_borrowed_by,
+           expected_held_for, open_loans
+    FROM (
+        SELECT b.id, b.status, b.borrowed_by, b.held_for,
+               CASE WHEN o.book_id IS NOT NULL THEN 'Borrowed'
+                    WHEN h.book_id IS NOT NULL THEN 'On Hold'
+                    ELSE 'Available' END AS expected_status,
+               o.user_id AS expected_borrowed_by,
+               CASE WHEN o.book_id IS NULL THEN h.user_id END AS expected_held_for,
+               COALESCE(o.open_loans, 0) AS open_loans
+        FROM books b
+        LEFT JOIN (
+            SELECT book_id, MIN(user_id) AS user_id, COUNT(*) AS open_loans
+            FROM borrowings
+            WHERE return_date IS NULL
+            GROUP BY book_id
+        ) o ON o.book_id = b.id
+        LEFT JOIN reservations h ON h.book_id = b.id AND h.status = 'Ready'
+    )
+    WHERE status IS NOT expected_status
+       OR borrowed_by IS NOT expected_borrowed_by
+       OR held_for IS NOT expected_held_for
+       OR open_loans > 1
+"""
+
+def check_availability(repair=False):
+    """Compare books.status/borrowed_by/held_for with open borrowings and holds.
+
+    Returns the drifted rows. With repair=True the books rows are rewritten
+    from the borrowings and reservations tables in one transaction. Books with more than one
+    open loan are reported but need a librarian to close the extra loan.
+    """
     db = get_db()
-
-    existing_reservation = db.execute("""
-        SELECT * FROM reservations
-        WHERE book_id = ? AND user_id = ?
-    """, (book_id, user_id)).fetchone()
-
-    if existing_reservation:
-        return "You have already reserved this book."
-
-    if db.execute("SELECT status FROM books WHERE id = ?", (book_id,)).fetchone()['status'] == 'Available':
-        return "This book is currently available. You can borrow it directly."
-
-    last_position = db.execute("""
-        SELECT MAX(queue_position)
-        FROM reservations
-        WHERE book_id = ?
-    """, (book_id,)).fetchone()[0]
-
-    queue_position = (last_position or 0) + 1
-
-    db.execute("""
-        INSERT INTO reservations (book_id, user_id, reservation_date, queue_position)
-        VALUES (?, ?, date('now'), ?)
-    """, (book_id, user_id, queue_position))
-    db.commit()
+    drift = [dict(row) for row in db.execute(AVAILABILITY_DRIFT_QUERY)]
+    if repair and drift:
+        db.executemany("UPDATE books SET status = ?, borrowed_by = ?, held_for = ? WHERE id = ?",
+                       [(row['expected_status'], row['expected_borrowed_by'], row['expected_held_for'], row['id'])
+                        for row in drift])
+        db.commit()
+    return drift
+
+# Active reservations, ready holds first and then the queue in order.
+RESERVATIONS_BY_USER_SQL = f"""
+    SELECT r.id, r.book_id, b.title, b.author, r.status, r.reservation_date, r.hold_expires,
+           {reservations.POSITION_SQL} AS queue_position
+    FROM reservations r
+    JOIN books b ON r.book_id = b.id
+    WHERE r.user_id = ? AND r.status IN ('Pending', 'Ready')
+    ORDER BY r.status = 'Pending', r.queue_position
+"""
+RESERVATIONS_BY_BOOK_SQL = f"""
+    SELECT r.id, r.user_id, u.name, u.email, r.status, r.reservation_date, r.hold_expires,
+           {reservations.POSITION_SQL} AS queue_position
+    FROM reservations r
+    JOIN users u ON r.user_id = u.id
+    WHERE r.book_id = ? AND r.status IN ('Pending', 'Ready')
+    ORDER BY r.status = 'Pending', r.queue_position
+"""
+
+BORROWED_BOOKS_SQL = """
+    SELECT b.id, bo.id AS borrowing_id, b.title, b.author, bo.borrow_date, bo.return_date,
+           bo.due_date, bo.fine_cents
+    FROM borrowings bo
+    JOIN books b ON bo.book_id = b.id
+    WHERE bo.user_id = ? AND bo.return_date IS NULL
+    ORDER BY bo.due_date
+"""
+BORROWING_HISTORY_SQL = """
+    SELECT bo.id AS borrowing_id, b.title, b.author, bo.borrow_date, bo.return_date
+    FROM borrowing_history bo
+    JOIN books b ON bo.book_id = b.id
+    WHERE bo.user_id = ?
+    ORDER BY bo.borrow_date DESC
+"""
+
+# Straight off the idx_borrowings_open_due partial index; {keyset} and {order}
+# as in MEMBER_HISTORY_SQL.
+OVERDUE_PAGE_SQL = """
+    SELECT bo.id, bo.due_date, bo.borrow_date, bo.fine_cents, b.title, b.author,
+           u.id AS user_id, u.name, u.email
+    FROM borrowings bo
+    JOIN books b ON b.id = bo.book_id
+    JOIN users u ON u.id = bo.user_id
+    WHERE bo.return_date IS NULL AND bo.due_date < ? {keyset}
+    ORDER BY {order}
+    LIMIT ?
+"""
 
 def get_reservations_by_user(user_id):
-    """Fetch all reservations for a specific user."""
+    """Fetch a user's active reservations: holds ready to collect first, then their queue places."""
     db = get_db()
-    return db.execute("""
-        SELECT r.*, b.title, b.author
-        FROM reservations r
-        JOIN books b ON r.book_id = b.id
-        WHERE r.user_id = ?
-    """, (user_id,)).fetchall()
+    return db.execute(RESERVATIONS_BY_USER_SQL, (user_id,)).fetchall()
 
 def get_reservations_by_book(book_id):
-    """Fetch reservations for a specific book."""
+    """Fetch a book's active reservations: the member it is on hold for, then its queue in order."""
     db = get_db()
-    return db.execute("""
-        SELECT r.*, u.name, u.email
-        FROM reservations r
-        JOIN users u ON r.user_id = u.id
-        WHERE r.book_id = ?
-        ORDER BY r.queue_position ASC
-    """, (book_id,)).fetchall()
+    return db.execute(RESERVATIONS_BY_BOOK_SQL, (book_id,)).fetchall()
 
 def get_borrowed_books(user_id):
-    """Fetch all borrowed books for a user."""
-    db = get_db()
-    borrowed_books = db.execute("""
-        SELECT b.id, b.title, b.author, bo.borrow_date, bo.return_date
-        FROM borrowings bo
-        JOIN books b ON bo.book_id = b.id
-        WHERE bo.user_id = ? AND bo.return_date IS NULL
-    """, (user_id,)).fetchall()
+    """Fetch all borrowed books for a user, soonest due first."""
+    db = get_db()
+    borrowed_books = db.execute(BORROWED_BOOKS_SQL, (user_id,)).fetchall()
     return [dict(book) for book in borrowed_books]
+
+def get_borrowing_history(user_id):
+    """Fetch every loan a user has made, newest first, including archived ones."""
+    return get_db().execute(BORROWING_HISTORY_SQL, (user_id,)).fetchall()
+
+def get_overdue_page(now, per_page=50, after=None):
+    """Fetch one keyset page of open loans due before now, longest overdue first.
+
+    Returns a dict with the loans (as dicts with days_overdue) and the
+    next_cursor, if there are more.
+    """
+    after = decode_cursor(after)
+    keyset, order, keyset_params = keyset_clause('bo.due_date', 'bo.id', after)
+    sql = OVERDUE_PAGE_SQL.format(keyset='AND ' + keyset if keyset else '', order=order)
+    rows = get_db().execute(sql, (now, *keyset_params, per_page + 1)).fetchall()
+
+    loans_due = [dict(row, days_overdue=(now - parse_timestamp(row['due_date'])).days)
+                 for row in rows[:per_page]]
+    more = len(rows) > per_page
+    return {
+        'loans': loans_due,
+        'next_cursor': encode_cursor((loans_due[-1]['due_date'], loans_due[-1]['id'])) if more else None,
+    }
+
+def get_overdue_totals(now):
+    """(number of open loans due before now, their fines in cents)."""
+    return tuple(get_db().execute("""
+        SELECT COUNT(*), COALESCE(SUM(fine_cents), 0) FROM borrowings
+        WHERE return_date IS NULL AND due_date < ?
+    """, (now,)).fetchone())
+
+if __name__ == '__main__':
+    import sys
+
+    init_db()
+    if 'check-availability' in sys.argv[1:]:
+        repair = '--repair' in sys.argv[1:]
+        drift = check_availability(repair=repair)
+        for row in drift:
+            print(f"book {row['id']}: status={row['status']} borrowed_by={row['borrowed_by']} "
+                  f"held_for={row['held_for']} expected {row['expected_status']}/"
+                  f"{row['expected_borrowed_by']}/{row['expected_held_for']} "
+                  f"({row['open_loans']} open loans)")
+        print(f"{len(drift)} book(s) {'repaired' if repair else 'out of sync'}.")
@@ -0,0 +1,229 @@
+"""Durable background jobs for work that should not hold up a request.
+
+A job is a row in the jobs table, written by enqueue() inside the same
+transaction as the change that calls for it. A rolled-back return never
+sends a notice, and a crash after the commit never loses one. JobWorkers
+runs a few threads in the process; each claims one due job at a time and
+calls the handler registered for its kind.
+
+Claiming marks a job 'running' and pushes its run_after out by LEASE
+seconds, so a job whose worker died is claimed again once the lease
+lapses. A handler that raises is retried after RETRY_BACKOFF * 2**(attempt
+- 1) seconds, up to the job's max_attempts. After that the job stays in the
+table as a 'dead' letter until `python jobs.py --retry-dead` requeues it.
+Finished jobs are deleted, so the table only holds pending work and dead
+letters.
+
+PeriodicWorker is the other kind of background thread: it calls one
+function every interval seconds, for upkeep that scans for its own work
+(expiring holds, charging fines) rather than waiting in the queue.
+
+Handlers registered with transactional=True run in the transaction that
+deletes the job, so their database writes happen exactly once. The others
+(email, webhooks) run outside any transaction and are delivered at least
+once.
+
+    python jobs.py               # run every due job, then exit
+    python jobs.py --retry-dead  # requeue dead letters
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import LATENCY_BUCKETS, Histogram
+from timestamps import parse_timestamp
+
+WORKERS = 2
+POLL_INTERVAL = 1.0
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 30
+LEASE = 300
+
+# Seconds from enqueue to the start of the first attempt. Stored times have
+# whole seconds, so this is only as fine as that.
+WAIT_BUCKETS = (1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+HANDLERS = {}
+
+def register(kind, transactional=False):
+    """Decorator registering handler(db, payload) for jobs of kind."""
+    def decorator(handler):
+        HANDLERS[kind] = (handler, transactional)
+        return handler
+    return decorator
+
+# Set on enqueue so idle workers in this process look again without waiting out the poll.
+_wake = threading.Event()
+
+def enqueue(db, kind, payload=None, delay=0, max_attempts=None, now=None):
+    """Queue a job; it runs once the caller's transaction commits. Returns the job id."""
+    now = now or datetime.now()
+    job_id = db.execute("""
+        INSERT INTO jobs (kind, payload, status, attempts, max_attempts, run_after, created_at)
+        VALUES (?, ?, 'queued', 0, ?, ?, ?)
+    """, (kind, json.dumps(payload or {}), max_attempts or MAX_ATTEMPTS,
+          now + timedelta(seconds=delay), now)).lastrowid
+    _wake.set()
+    return job_id
+
+# The oldest due job, queued or with a lapsed lease, found through idx_jobs_due.
+CLAIM_SQL = """
+    UPDATE jobs SET status = 'running', attempts = attempts + 1, run_after = ?
+    WHERE id = (SELECT id FROM jobs
+                WHERE status IN ('queued', 'running') AND run_after <= ?
+                ORDER BY run_after, id LIMIT 1)
+    RETURNING id, kind, payload, attempts, max_attempts, created_at
+"""
+
+def claim(db, now=None, lease=LEASE):
+    """Take the next due job, or None. Must run in a write transaction."""
+    now = now or datetime.now()
+    rows = db.execute(CLAIM_SQL, (now + timedelta(seconds=lease), now)).fetchall()
+    return rows[0] if rows else None
+
+def finish(db, job_id):
+    """Delete a job that has run."""
+    db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+def fail(db, job, error, now=None):
+    """Schedule a retry of a job that raised, or bury it. Returns 'retried' or 'dead'."""
+    now = now or datetime.now()
+    if job['attempts'] >= job['max_attempts']:
+        db.execute("UPDATE jobs SET status = 'dead', last_error = ? WHERE id = ?", (error, job['id']))
+        return 'dead'
+    retry_at = now + timedelta(seconds=RETRY_BACKOFF * 2 ** (job['attempts'] - 1))
+    db.execute("UPDATE jobs SET status = 'queued', run_after = ?, last_error = ? WHERE id = ?",
+               (retry_at, error, job['id']))
+    return 'retried'
+
+def retry_dead(db, now=None):
+    """Requeue every dead letter with a fresh set of attempts. Returns how many."""
+    return db.execute("""
+        UPDATE jobs SET status = 'queued', attempts = 0, run_after = ?
+        WHERE status = 'dead'
+    """, (now or datetime.now(),)).rowcount
+
+_stats_lock = threading.Lock()
+_counts = {'done': 0, 'retried': 0, 'dead': 0}
+_run_seconds = Histogram(LATENCY_BUCKETS)
+_wait_seconds = Histogram(WAIT_BUCKETS)
+
+def run(job, transaction, db):
+    """Run a claimed job and record how it went. Returns 'done', 'retried' or 'dead'.
+
+    transaction(work) runs work(db) in a write transaction; db is a connection
+    outside one, for handlers that are not transactional.
+    """
+    started = time.perf_counter()
+    if job['attempts'] == 1:
+        waited = (datetime.now() - parse_timestamp(job['created_at'])).total_seconds()
+        with _stats_lock:
+            _wait_seconds.observe(max(waited, 0.0))
+    try:
+        if job['kind'] not in HANDLERS:
+            raise LookupError(f"No handler for job kind '{job['kind']}'")
+        handler, transactional = HANDLERS[job['kind']]
+        payload = json.loads(job['payload'])
+        if transactional:
+            transaction(lambda db: (handler(db, payload), finish(db, job['id'])))
+        else:
+            handler(db, payload)
+            transaction(lambda db: finish(db, job['id']))
+        outcome = 'done'
+    except Exception as e:
+        outcome = transaction(lambda db: fail(db, job, f"{type(e).__name__}: {e}"))
+    with _stats_lock:
+        _counts[outcome] += 1
+        _run_seconds.observe(time.perf_counter() - started)
+    return outcome
+
+def stats(db):
+    """Queue depth from the table plus this process's outcome counts and latencies."""
+    depth = {'queued': 0, 'running': 0, 'dead': 0}
+    oldest = None
+    for row in db.execute("SELECT status, COUNT(*) AS count, MIN(created_at) AS oldest FROM jobs GROUP BY status"):
+        depth[row['status']] = row['count']
+        if row['status'] != 'dead' and (oldest is None or row['oldest'] < oldest):
+            oldest = row['oldest']
+    age = (datetime.now() - parse_timestamp(oldest)).total_seconds() if oldest else 0.0
+    with _stats_lock:
+        return dict(depth, oldest_pending_seconds=max(age, 0.0), **_counts,
+                    run_seconds_p50=_run_seconds.quantile(0.5), run_seconds_p95=_run_seconds.quantile(0.95),
+                    wait_seconds_p50=_wait_seconds.quantile(0.5), wait_seconds_p95=_wait_seconds.quantile(0.95))
+
+class JobWorkers:
+    """Background threads that each run due jobs through run_next() until it returns False, then wait."""
+
+    def __init__(self, run_next, workers=WORKERS, interval=POLL_INTERVAL):
+        self.run_next = run_next
+        self.interval = interval
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                         for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        _wake.set()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_next():
+                    continue
+            except Exception as e:
+                print(f"Error running jobs: {e}")
+            _wake.wait(self.interval)
+            _wake.clear()
+
+class PeriodicWorker:
+    """Background thread that calls task() every interval seconds.
+
+    task returns how many items it handled; the counts add up in total.
+    """
+
+    def __init__(self, name, task, interval):
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.runs = 0
+        self.total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.total += self.task()
+                self.runs += 1
+            except Exception as e:
+                print(f"Error in {self.name}: {e}")
+
+if __name__ == '__main__':
+    import sys
+
+    import database
+
+    database.init_db()
+    if '--retry-dead' in sys.argv[1:]:
+        print(f"{database.run_transaction(retry_dead)} dead jobs requeued")
+    else:
+        print(f"{database.run_due_jobs()} jobs run")
+    database.close_db()
@@ -0,0 +1,86 @@
+"""Due dates, loan policies and overdue fines.
+
+A loan's due date and fine terms come from the most specific row in
+loan_policies matching the book's genre and the borrower's role (NULL
+columns match anything), and are copied onto the borrowing when it is
+lent. The overdue scanner walks open loans past their due date through
+the idx_borrowings_open_due partial index, in (due_date, id) keyset
+batches, and only writes to loans it has not charged for today. A fine is
+fine_per_day_cents for every whole day past the due date, capped at
+max_fine_cents, and is settled one last time when the book is returned.
+"""
+from datetime import datetime, timedelta
+
+import jobs
+from timestamps import parse_timestamp
+
+DEFAULT_LOAN_DAYS = 14
+SCAN_INTERVAL = 3600
+SCAN_BATCH = 500
+
+# Most specific policy first; a genre match outranks a role match.
+POLICY_SQL = """
+    SELECT p.loan_days, p.fine_per_day_cents, p.max_fine_cents
+    FROM books b, users u, loan_policies p
+    WHERE b.id = ? AND u.id = ?
+      AND (p.genre IS NULL OR p.genre = b.genre) AND (p.role IS NULL OR p.role = u.role)
+    ORDER BY (p.genre IS NOT NULL) + (p.role IS NOT NULL) DESC, p.genre IS NOT NULL DESC
+    LIMIT 1
+"""
+
+# Open loans past due, in (due_date, id) keyset order off idx_borrowings_open_due.
+OVERDUE_SCAN_SQL = """
+    SELECT id, due_date, fine_per_day_cents, max_fine_cents, fines_through FROM borrowings
+    WHERE return_date IS NULL AND due_date < ? AND (due_date, id) > (?, ?)
+    ORDER BY due_date, id LIMIT ?
+"""
+
+def policy_for(db, book_id, user_id):
+    """The loan policy for lending book_id to user_id, as (loan_days, fine_per_day_cents, max_fine_cents)."""
+    row = db.execute(POLICY_SQL, (book_id, user_id)).fetchone()
+    if row is None:
+        return DEFAULT_LOAN_DAYS, 0, 0
+    return row['loan_days'], row['fine_per_day_cents'], row['max_fine_cents']
+
+def loan_terms(db, book_id, user_id, now=None):
+    """Columns to store on a new borrowing: due_date, fine_per_day_cents, max_fine_cents."""
+    loan_days, rate, cap = policy_for(db, book_id, user_id)
+    return (now or datetime.now()) + timedelta(days=loan_days), rate, cap
+
+def fine_for(due_date, rate, cap, as_of):
+    """Fine in cents for a loan due at due_date, as of as_of."""
+    days = (as_of.date() - parse_timestamp(due_date).date()).days
+    if days <= 0 or not rate:
+        return 0
+    fine = days * rate
+    return min(fine, cap) if cap else fine
+
+def settle_fine(db, borrowing, returned):
+    """Charge the final fine for a loan being returned. Must run in the caller's transaction."""
+    if borrowing['due_date'] is None:
+        return 0
+    fine = fine_for(borrowing['due_date'], borrowing['fine_per_day_cents'], borrowing['max_fine_cents'],
+                    returned)
+    db.execute("UPDATE borrowings SET fine_cents = ?, fines_through = ? WHERE id = ?",
+               (fine, returned.date().isoformat(), borrowing['id']))
+    return fine
+
+def assess_overdue(db, now=None, after=('', 0), limit=SCAN_BATCH):
+    """Update fines for up to limit overdue open loans past the (due_date, id) cursor after.
+
+    Returns (loans examined, loans charged, cursor for the next batch or None).
+    Loans already charged through today are skipped without a write. The
+    first charge on a loan also queues an overdue reminder to its borrower.
+    """
+    now = now or datetime.now()
+    today = now.date().isoformat()
+    rows = db.execute(OVERDUE_SCAN_SQL, (now, after[0], after[1], limit)).fetchall()
+    updates = [(fine_for(row['due_date'], row['fine_per_day_cents'], row['max_fine_cents'], now), today, row['id'])
+               for row in rows if row['fines_through'] is None or row['fines_through'] < today]
+    if updates:
+        db.executemany("UPDATE borrowings SET fine_cents = ?, fines_through = ? WHERE id = ?", updates)
+    for row in rows:
+        if row['fines_through'] is None:
+            jobs.enqueue(db, 'overdue_reminder', {'borrowing_id': row['id']}, now=now)
+    cursor = (rows[-1]['due_date'], rows[-1]['id']) if len(rows) == limit else None
+    return len(rows), len(updates), cursor
@@ -0,0 +1,284 @@
+"""Request and SQL instrumentation with a Prometheus text endpoint.
+
+Every request records its latency into a fixed-bucket histogram for its
+route, method and status class, along with how many SQL statements it ran
+and how long they took. Statement timings are collected by the
+InstrumentedConnection factory the connection pool opens connections with,
+so every db.execute() goes through it. Anything slower than
+SLOW_QUERY_SECONDS is logged with its EXPLAIN QUERY PLAN.
+
+Histograms have fixed buckets, so recording costs a bisect and a few
+additions under a lock and memory does not grow with traffic. The
+p50/p95/p99 values are interpolated from the buckets.
+
+    GET /metrics   Prometheus text exposition (METRICS_TOKEN, if set, as a bearer token)
+"""
+import bisect
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from flask import Response, abort, g, request
+
+ENABLED = True
+SLOW_QUERY_SECONDS = 0.1
+MAX_STATEMENTS = 500
+
+# Upper bounds in seconds. Prometheus histograms are cumulative; we keep
+# per-bucket counts and accumulate on export.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+QUANTILES = (0.5, 0.95, 0.99)
+
+slow_query_log = logging.getLogger('library.slow_sql')
+
+class Histogram:
+    """Fixed-bucket histogram; the last bucket counts values above every bound."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q-quantile by linear interpolation inside the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            yield bound, total
+        yield '+Inf', self.count
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}     # (endpoint, method, status class) -> Histogram of seconds
+        self.request_sql = {}  # endpoint -> Histogram of statements per request
+        self.request_sql_time = {}  # endpoint -> Histogram of SQL seconds per request
+        self.statements = {}   # normalized SQL -> [count, total seconds, max seconds]
+        self.slow_queries = 0
+        self.gauges = []
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.request_sql.clear()
+            self.request_sql_time.clear()
+            self.statements.clear()
+            self.slow_queries = 0
+
+registry = _Registry()
+_local = threading.local()
+_normalized = {}
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize(sql):
+    """Collapse whitespace so the same statement text always maps to one series."""
+    key = _normalized.get(sql)
+    if key is None:
+        key = _WHITESPACE.sub(' ', sql).strip()
+        if len(_normalized) < MAX_STATEMENTS * 4:
+            _normalized[sql] = key
+    return key
+
+def record_query(conn, sql, params, elapsed):
+    request_sql = getattr(_local, 'sql', None)
+    if request_sql is not None:
+        request_sql[0] += 1
+        request_sql[1] += elapsed
+    key = normalize(sql)
+    with registry.lock:
+        stats = registry.statements.get(key)
+        if stats is None:
+            if len(registry.statements) >= MAX_STATEMENTS:
+                key = '(other)'
+                stats = registry.statements.setdefault(key, [0, 0.0, 0.0])
+            else:
+                stats = registry.statements[key] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        _log_slow_query(conn, sql, params, elapsed)
+
+def _log_slow_query(conn, sql, params, elapsed):
+    with registry.lock:
+        registry.slow_queries += 1
+    plan = ''
+    if params is not None and sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+        try:
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            plan = '\n'.join(f"  {row[3]}" for row in rows)
+        except sqlite3.Error as e:
+            plan = f"  (no plan: {e})"
+    slow_query_log.warning("slow query %.1fms: %s\n%s", elapsed * 1000, normalize(sql), plan)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times execute/executemany for the metrics registry.
+
+    The timing covers preparing the statement and stepping it to the first
+    row (or to completion for writes), which is where SQLite does the work.
+    """
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            record_query(self, sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            record_query(self, sql, None, time.perf_counter() - start)
+
+def register_gauges(collect):
+    """Add a callable returning {metric_name: value} to be sampled on every scrape."""
+    registry.gauges.append(collect)
+
+def _begin_request():
+    g._metrics_start = time.perf_counter()
+    _local.sql = [0, 0.0]
+
+def _end_request(response):
+    start = g.pop('_metrics_start', None)
+    sql = getattr(_local, 'sql', None)
+    _local.sql = None
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = request.url_rule.endpoint if request.url_rule is not None else '(unmatched)'
+    key = (endpoint, request.method, f"{response.status_code // 100}xx")
+    with registry.lock:
+        histogram = registry.requests.get(key)
+        if histogram is None:
+            histogram = registry.requests[key] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(elapsed)
+        if sql is not None:
+            per_request = registry.request_sql.get(endpoint)
+            if per_request is None:
+                per_request = registry.request_sql[endpoint] = Histogram(COUNT_BUCKETS)
+            per_request.observe(sql[0])
+            sql_time = registry.request_sql_time.get(endpoint)
+            if sql_time is None:
+                sql_time = registry.request_sql_time[endpoint] = Histogram(LATENCY_BUCKETS)
+            sql_time.observe(sql[1])
+    return response
+
+def route_summary():
+    """Per-route request counts and latency percentiles, for JSON stats pages."""
+    with registry.lock:
+        summary = {}
+        for (endpoint, method, status), h in sorted(registry.requests.items()):
+            entry = {'count': h.count, 'mean': h.sum / h.count if h.count else 0.0}
+            entry.update({f"p{int(q * 100)}": h.quantile(q) for q in QUANTILES})
+            sql = registry.request_sql.get(endpoint)
+            if sql is not None and sql.count:
+                entry['sql_per_request'] = sql.sum / sql.count
+                entry['sql_seconds_per_request'] = registry.request_sql_time[endpoint].sum / sql.count
+            summary[f"{method} {endpoint} {status}"] = entry
+        return summary
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+def render_prometheus():
+    lines = []
+    with registry.lock:
+        lines += ["# HELP library_request_duration_seconds Request latency by route.",
+                  "# TYPE library_request_duration_seconds histogram"]
+        for (endpoint, method, status), h in sorted(registry.requests.items()):
+            for bound, total in h.cumulative():
+                lines.append(f"library_request_duration_seconds_bucket"
+                             f"{_labels(endpoint=endpoint, method=method, status=status, le=bound)} {total}")
+            labels = _labels(endpoint=endpoint, method=method, status=status)
+            lines.append(f"library_request_duration_seconds_sum{labels} {h.sum}")
+            lines.append(f"library_request_duration_seconds_count{labels} {h.count}")
+
+        lines += ["# HELP library_request_duration_quantile_seconds Latency percentiles estimated from the histogram.",
+                  "# TYPE library_request_duration_quantile_seconds gauge"]
+        for (endpoint, method, status), h in sorted(registry.requests.items()):
+            for q in QUANTILES:
+                lines.append(f"library_request_duration_quantile_seconds"
+                             f"{_labels(endpoint=endpoint, method=method, status=status, quantile=q)} {h.quantile(q)}")
+
+        lines += ["# HELP library_request_sql_statements SQL statements executed per request.",
+                  "# TYPE library_request_sql_statements histogram"]
+        for endpoint, h in sorted(registry.request_sql.items()):
+            for bound, total in h.cumulative():
+                lines.append(f"library_request_sql_statements_bucket{_labels(endpoint=endpoint, le=bound)} {total}")
+            lines.append(f"library_request_sql_statements_sum{_labels(endpoint=endpoint)} {h.sum}")
+            lines.append(f"library_request_sql_statements_count{_labels(endpoint=endpoint)} {h.count}")
+
+        lines += ["# HELP library_request_sql_seconds Time spent in SQL per request.",
+                  "# TYPE library_request_sql_seconds histogram"]
+        for endpoint, h in sorted(registry.request_sql_time.items()):
+            for bound, total in h.cumulative():
+                lines.append(f"library_request_sql_seconds_bucket{_labels(endpoint=endpoint, le=bound)} {total}")
+            lines.append(f"library_request_sql_seconds_sum{_labels(endpoint=endpoint)} {h.sum}")
+            lines.append(f"library_request_sql_seconds_count{_labels(endpoint=endpoint)} {h.count}")
+
+        lines += ["# HELP library_sql_statements_total Executions per distinct SQL statement.",
+                  "# TYPE library_sql_statements_total counter"]
+        statements = sorted(registry.statements.items())
+        for sql, (count, total, _) in statements:
+            lines.append(f"library_sql_statements_total{_labels(statement=sql)} {count}")
+        lines += ["# HELP library_sql_duration_seconds_total Time spent per distinct SQL statement.",
+                  "# TYPE library_sql_duration_seconds_total counter"]
+        for sql, (count, total, _) in statements:
+            lines.append(f"library_sql_duration_seconds_total{_labels(statement=sql)} {total}")
+        lines += ["# HELP library_sql_duration_max_seconds Slowest execution per distinct SQL statement.",
+                  "# TYPE library_sql_duration_max_seconds gauge"]
+        for sql, (count, total, slowest) in statements:
+            lines.append(f"library_sql_duration_max_seconds{_labels(statement=sql)} {slowest}")
+        lines += ["# TYPE library_sql_slow_queries_total counter",
+                  f"library_sql_slow_queries_total {registry.slow_queries}"]
+        gauges = list(registry.gauges)
+
+    for collect in gauges:
+        for name, value in sorted(collect().items()):
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return '\n'.join(lines) + '\n'
+
+def metrics_view():
+    from flask import current_app
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    """Install the request hooks and the /metrics route."""
+    global SLOW_QUERY_SECONDS
+    SLOW_QUERY_SECONDS = app.config.setdefault('SLOW_QUERY_SECONDS', SLOW_QUERY_SECONDS)
+    if not ENABLED:
+        return
+    app.before_request(_begin_request)
+    app.after_request(_end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
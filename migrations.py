@@ -0,0 +1,810 @@
+"""Versioned schema migrations for the library database.
+
+Each migration runs in its own transaction and is recorded in the
+``schema_version`` table, so ``migrate()`` is safe to call on every start-up
+and only applies what a database has not seen yet.
+
+    python migrations.py            # migrate library.db to the latest version
+    python migrations.py --check    # show the query plan of every hot query
+"""
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+class MigrationError(Exception):
+    """Raised when a migration fails; the failing migration is rolled back."""
+
+def _initial_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL,
+        name TEXT,
+        email TEXT
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        author TEXT NOT NULL,
+        genre TEXT,
+        status TEXT DEFAULT 'Available'
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS borrowings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER,
+        user_id INTEGER,
+        borrow_date TEXT,
+        return_date TEXT,
+        FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER,
+        user_id INTEGER,
+        reservation_date TEXT,
+        queue_position INTEGER,
+        status TEXT DEFAULT 'Pending',  -- Can be 'Pending' or 'Fulfilled'
+        FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+
+def _reservation_queue_position(conn):
+    # Databases created before queue_position was part of the schema.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(reservations)")}
+    if 'queue_position' not in columns:
+        conn.execute("ALTER TABLE reservations ADD COLUMN queue_position INTEGER")
+
+def _secondary_indexes(conn):
+    # Open loans: the /books availability subqueries, return_book and the
+    # "currently borrowed" lists only ever look at rows with no return_date.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_borrowings_open_by_book
+        ON borrowings(book_id, user_id) WHERE return_date IS NULL
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_borrowings_open_by_user
+        ON borrowings(user_id, book_id) WHERE return_date IS NULL
+    """)
+    # Full history per member (/members, /my_borrowed_books).
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_borrowings_user_date
+        ON borrowings(user_id, borrow_date)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_book_queue
+        ON reservations(book_id, queue_position)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_user_book
+        ON reservations(user_id, book_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_role
+        ON users(role)
+    """)
+
+def _books_full_text_index(conn):
+    # External-content FTS5 index over the catalog; triggers keep it in step
+    # with every write to books, whichever code path makes it.
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, genre,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts(rowid, title, author, genre)
+            VALUES (new.id, new.title, new.author, new.genre);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+            VALUES ('delete', old.id, old.title, old.author, old.genre);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, genre ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+            VALUES ('delete', old.id, old.title, old.author, old.genre);
+            INSERT INTO books_fts(rowid, title, author, genre)
+            VALUES (new.id, new.title, new.author, new.genre);
+        END
+    """)
+    conn.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+def _books_sort_indexes(conn):
+    # Keyset pagination on /books walks these in (column, id) order.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_books_title ON books(title, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_books_author ON books(author, id)")
+
+def _book_availability(conn):
+    # books.status and books.borrowed_by are the single source of truth for
+    # availability. Triggers on borrowings keep them current in the same
+    # transaction as the loan itself, whichever code path writes the loan.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(books)")}
+    if 'borrowed_by' not in columns:
+        conn.execute("ALTER TABLE books ADD COLUMN borrowed_by INTEGER REFERENCES users(id) ON DELETE SET NULL")
+    conn.execute("""
+        UPDATE books SET
+            borrowed_by = (SELECT user_id FROM borrowings
+                           WHERE book_id = books.id AND return_date IS NULL
+                           ORDER BY id LIMIT 1),
+            status = CASE WHEN EXISTS (SELECT 1 FROM borrowings
+                                       WHERE book_id = books.id AND return_date IS NULL)
+                          THEN 'Borrowed' ELSE 'Available' END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS borrowings_lend AFTER INSERT ON borrowings
+        WHEN new.return_date IS NULL BEGIN
+            UPDATE books SET status = 'Borrowed', borrowed_by = new.user_id WHERE id = new.book_id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS borrowings_return AFTER UPDATE OF return_date ON borrowings
+        WHEN old.return_date IS NULL AND new.return_date IS NOT NULL BEGIN
+            UPDATE books SET status = 'Available', borrowed_by = NULL WHERE id = new.book_id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS borrowings_open_delete AFTER DELETE ON borrowings
+        WHEN old.return_date IS NULL BEGIN
+            UPDATE books SET status = 'Available', borrowed_by = NULL WHERE id = old.book_id;
+        END
+    """)
+
+def _loan_and_queue_constraints(conn):
+    # At most one open loan per book, one pending reservation per member and
+    # book, and one holder per queue slot. These back up the conditional
+    # updates in database.lend_book/queue_reservation.
+    conn.execute("DROP INDEX IF EXISTS idx_borrowings_open_by_book")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_borrowings_one_open_loan
+        ON borrowings(book_id) WHERE return_date IS NULL
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_pending_member
+        ON reservations(book_id, user_id) WHERE status = 'Pending'
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_pending_slot
+        ON reservations(book_id, queue_position) WHERE status = 'Pending'
+    """)
+
+def _reservation_holds(conn):
+    # Holds: the head of a book's queue gets the book 'On Hold' (books.held_for)
+    # until hold_expires. See reservations.py.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(reservations)")}
+    if 'hold_expires' not in columns:
+        conn.execute("ALTER TABLE reservations ADD COLUMN hold_expires TEXT")
+    if 'fulfilled_date' not in columns:
+        conn.execute("ALTER TABLE reservations ADD COLUMN fulfilled_date TEXT")
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(books)")}
+    if 'held_for' not in columns:
+        conn.execute("ALTER TABLE books ADD COLUMN held_for INTEGER REFERENCES users(id) ON DELETE SET NULL")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_one_hold
+        ON reservations(book_id) WHERE status = 'Ready'
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_hold_expiry
+        ON reservations(hold_expires) WHERE status = 'Ready'
+    """)
+    # A deleted hold (e.g. its member was deleted) frees the book.
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS reservations_hold_delete AFTER DELETE ON reservations
+        WHEN old.status = 'Ready' BEGIN
+            UPDATE books SET status = 'Available', held_for = NULL
+            WHERE id = old.book_id AND status = 'On Hold';
+        END
+    """)
+    # Books returned before holds existed may have a queue but no holder yet.
+    waiting = conn.execute("""
+        SELECT b.id, (SELECT r.id FROM reservations r
+                      WHERE r.book_id = b.id AND r.status = 'Pending'
+                      ORDER BY r.queue_position LIMIT 1) AS head_id
+        FROM books b
+        WHERE b.status = 'Available'
+    """).fetchall()
+    hold_expires = (datetime.now() + timedelta(days=3)).isoformat(sep=' ')
+    for book_id, head_id in waiting:
+        if head_id is None:
+            continue
+        conn.execute("UPDATE reservations SET status = 'Ready', hold_expires = ? WHERE id = ?",
+                     (hold_expires, head_id))
+        conn.execute("""
+            UPDATE books SET status = 'On Hold',
+                   held_for = (SELECT user_id FROM reservations WHERE id = ?)
+            WHERE id = ?
+        """, (head_id, book_id))
+
+def _members_listing_index(conn):
+    # /members filters on role and pages on (username, id).
+    conn.execute("DROP INDEX IF EXISTS idx_users_role")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_role_username ON users(role, username)")
+
+def _history_archive(conn):
+    # Closed loans and finished reservations are moved here by archive.py so
+    # the hot tables only hold open loans and recent history.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS borrowings_archive (
+            id INTEGER PRIMARY KEY,
+            book_id INTEGER,
+            user_id INTEGER,
+            borrow_date TEXT,
+            return_date TEXT,
+            archived_at TEXT NOT NULL,
+            FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reservations_archive (
+            id INTEGER PRIMARY KEY,
+            book_id INTEGER,
+            user_id INTEGER,
+            reservation_date TEXT,
+            queue_position INTEGER,
+            status TEXT,
+            hold_expires TEXT,
+            fulfilled_date TEXT,
+            archived_at TEXT NOT NULL,
+            FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_borrowings_archive_user_date
+        ON borrowings_archive(user_id, borrow_date)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_archive_user
+        ON reservations_archive(user_id)
+    """)
+    # Let the archiver find candidates without scanning open loans or queues.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_borrowings_closed_return_date
+        ON borrowings(return_date) WHERE return_date IS NOT NULL
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_finished_date
+        ON reservations(reservation_date) WHERE status IN ('Fulfilled', 'Expired')
+    """)
+    # Hot and archived loans read as one table.
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS borrowing_history AS
+        SELECT id, book_id, user_id, borrow_date, return_date FROM borrowings
+        UNION ALL
+        SELECT id, book_id, user_id, borrow_date, return_date FROM borrowings_archive
+    """)
+
+def _catalog_version(conn):
+    # A single-row counter bumped by every change to books, including the
+    # status updates made by the loan and hold triggers. Cached catalog pages
+    # are keyed on it, so any writer (routes, the hold sweeper, CLI imports,
+    # other worker processes) invalidates them.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            changed_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO catalog_version (id, version, changed_at)
+        VALUES (1, 1, strftime('%Y-%m-%d %H:%M:%S', 'now'))
+    """)
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS books_version_{event.lower()} AFTER {event} ON books BEGIN
+                UPDATE catalog_version
+                SET version = version + 1, changed_at = strftime('%Y-%m-%d %H:%M:%S', 'now')
+                WHERE id = 1;
+            END
+        """)
+
+def _loan_due_dates(conn):
+    # Due dates and fines. Each loan snapshots its policy's fine rate and cap
+    # when it is lent, so editing a policy never rewrites existing loans.
+    # fines_through is the last day the overdue scanner charged for. See loans.py.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS loan_policies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            genre TEXT,   -- NULL matches every genre
+            role TEXT,    -- NULL matches every role
+            loan_days INTEGER NOT NULL,
+            fine_per_day_cents INTEGER NOT NULL DEFAULT 0,
+            max_fine_cents INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (genre, role)
+        )
+    """)
+    if conn.execute("SELECT 1 FROM loan_policies WHERE genre IS NULL AND role IS NULL").fetchone() is None:
+        conn.execute("""
+            INSERT INTO loan_policies (genre, role, loan_days, fine_per_day_cents, max_fine_cents)
+            VALUES (NULL, NULL, 14, 25, 1000)
+        """)
+    for table in ('borrowings', 'borrowings_archive'):
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, decl in (('due_date', 'TEXT'), ('fine_cents', 'INTEGER NOT NULL DEFAULT 0'),
+                           ('fine_per_day_cents', 'INTEGER NOT NULL DEFAULT 0'),
+                           ('max_fine_cents', 'INTEGER NOT NULL DEFAULT 0'), ('fines_through', 'TEXT')):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+    # Existing loans get the default policy, counted from when they were borrowed.
+    conn.execute("""
+        UPDATE borrowings SET
+            due_date = datetime(borrow_date, '+' || p.loan_days || ' days'),
+            fine_per_day_cents = p.fine_per_day_cents,
+            max_fine_cents = p.max_fine_cents
+        FROM (SELECT * FROM loan_policies WHERE genre IS NULL AND role IS NULL) AS p
+        WHERE borrowings.due_date IS NULL
+    """)
+    # Overdue scans and the overdue report read open loans in due-date order.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_borrowings_open_due
+        ON borrowings(due_date) WHERE return_date IS NULL
+    """)
+
+TIMESTAMP_COLUMNS = {
+    'borrowings': ('borrow_date', 'return_date', 'due_date'),
+    'borrowings_archive': ('borrow_date', 'return_date', 'due_date', 'archived_at'),
+    'reservations': ('reservation_date', 'hold_expires', 'fulfilled_date'),
+    'reservations_archive': ('reservation_date', 'hold_expires', 'fulfilled_date', 'archived_at'),
+}
+
+def _canonical_timestamps(conn):
+    # Older rows hold date('now') dates and str(datetime) values with
+    # microseconds; rewrite them all as 'YYYY-MM-DD HH:MM:SS' (see timestamps.py).
+    # Rows already in that form (and unparseable ones) are left alone; the return trigger only
+    # fires on a NULL -> value change, so rewriting return_date is inert.
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        for column in columns:
+            canonical = f"strftime('%Y-%m-%d %H:%M:%S', {column})"
+            conn.execute(f"""
+                UPDATE {table} SET {column} = {canonical}
+                WHERE {canonical} IS NOT NULL AND {column} IS NOT {canonical}
+            """)
+
+def _recommendations(conn):
+    # Precomputed recommendation tables, maintained by recommendations.py.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS co_borrows (
+            book_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            members INTEGER NOT NULL,
+            PRIMARY KEY (book_id, other_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS book_readers (
+            book_id INTEGER PRIMARY KEY,
+            members INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS similar_books (
+            book_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (book_id, rank)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS member_recommendations (
+            user_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (user_id, rank)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS popular_books (
+            rank INTEGER PRIMARY KEY,
+            book_id INTEGER NOT NULL,
+            loans INTEGER NOT NULL
+        )
+    """)
+    # last_borrowing_id is the newest loan already folded in; 0 makes the
+    # first refresh work through the whole live table.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recommendation_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_borrowing_id INTEGER NOT NULL,
+            refreshed_at TEXT
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO recommendation_state (id, last_borrowing_id) VALUES (1, 0)")
+    # The rolling popularity window reads recent loans by borrow date.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_borrowings_borrow_date ON borrowings(borrow_date)")
+
+def _circulation_rollups(conn):
+    # Per (month, genre) counters for the librarian dashboard, bumped by the
+    # triggers below as loans and reservations change. See analytics.py.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS circulation_monthly (
+            month TEXT NOT NULL,   -- 'YYYY-MM'
+            genre TEXT NOT NULL,   -- '' for books without one
+            loans INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            loan_days REAL NOT NULL DEFAULT 0,
+            late_returns INTEGER NOT NULL DEFAULT 0,
+            reservations INTEGER NOT NULL DEFAULT 0,
+            fulfilled INTEGER NOT NULL DEFAULT 0,
+            expired INTEGER NOT NULL DEFAULT 0,
+            wait_days REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, genre)
+        ) WITHOUT ROWID
+    """)
+    genre = "COALESCE((SELECT genre FROM books WHERE id = new.book_id), '')"
+
+    def bump(name, table, event, when, month, counters):
+        columns = ', '.join(counters)
+        values = ', '.join(counters.values())
+        updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in counters)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+            WHEN {when} BEGIN
+                INSERT INTO circulation_monthly (month, genre, {columns})
+                VALUES (substr({month}, 1, 7), {genre}, {values})
+                ON CONFLICT (month, genre) DO UPDATE SET {updates};
+            END
+        """)
+
+    returned = {
+        'returns': '1',
+        'loan_days': 'COALESCE(julianday(new.return_date) - julianday(new.borrow_date), 0)',
+        'late_returns': 'new.due_date IS NOT NULL AND new.return_date > new.due_date',
+    }
+    bump('borrowings_rollup_lend', 'borrowings', 'INSERT', 'new.borrow_date IS NOT NULL',
+         'new.borrow_date', {'loans': '1'})
+    # History written already closed, e.g. by imports and datagen.py.
+    bump('borrowings_rollup_insert_returned', 'borrowings', 'INSERT', 'new.return_date IS NOT NULL',
+         'new.return_date', returned)
+    bump('borrowings_rollup_return', 'borrowings', 'UPDATE OF return_date',
+         'old.return_date IS NULL AND new.return_date IS NOT NULL', 'new.return_date', returned)
+    bump('reservations_rollup_place', 'reservations', 'INSERT', 'new.reservation_date IS NOT NULL',
+         'new.reservation_date', {'reservations': '1'})
+    bump('reservations_rollup_fulfil', 'reservations', 'UPDATE OF status',
+         "new.status = 'Fulfilled' AND old.status IS NOT 'Fulfilled' AND new.fulfilled_date IS NOT NULL",
+         'new.fulfilled_date',
+         {'fulfilled': '1',
+          'wait_days': 'COALESCE(julianday(new.fulfilled_date) - julianday(new.reservation_date), 0)'})
+    bump('reservations_rollup_expire', 'reservations', 'UPDATE OF status',
+         "new.status = 'Expired' AND old.status IS NOT 'Expired'"
+         " AND COALESCE(new.hold_expires, new.reservation_date) IS NOT NULL",
+         'COALESCE(new.hold_expires, new.reservation_date)', {'expired': '1'})
+
+    # Backfill from the live and archived history. This is a frozen copy of
+    # analytics.rebuild() as of this migration; later changes there must not
+    # change what this migration did.
+    events = """
+        SELECT substr(bo.borrow_date, 1, 7) AS month, bo.book_id,
+               1 AS loans, 0 AS returns, 0 AS loan_days, 0 AS late_returns,
+               0 AS reservations, 0 AS fulfilled, 0 AS expired, 0 AS wait_days
+        FROM {loans} bo WHERE bo.borrow_date IS NOT NULL
+        UNION ALL
+        SELECT substr(bo.return_date, 1, 7), bo.book_id,
+               0, 1, COALESCE(julianday(bo.return_date) - julianday(bo.borrow_date), 0),
+               bo.due_date IS NOT NULL AND bo.return_date > bo.due_date,
+               0, 0, 0, 0
+        FROM {loans} bo WHERE bo.return_date IS NOT NULL
+        UNION ALL
+        SELECT substr(r.reservation_date, 1, 7), r.book_id, 0, 0, 0, 0, 1, 0, 0, 0
+        FROM {reservations} r WHERE r.reservation_date IS NOT NULL
+        UNION ALL
+        SELECT substr(r.fulfilled_date, 1, 7), r.book_id, 0, 0, 0, 0,
+               0, 1, 0, COALESCE(julianday(r.fulfilled_date) - julianday(r.reservation_date), 0)
+        FROM {reservations} r WHERE r.status = 'Fulfilled' AND r.fulfilled_date IS NOT NULL
+        UNION ALL
+        SELECT substr(COALESCE(r.hold_expires, r.reservation_date), 1, 7), r.book_id, 0, 0, 0, 0, 0, 0, 1, 0
+        FROM {reservations} r
+        WHERE r.status = 'Expired' AND COALESCE(r.hold_expires, r.reservation_date) IS NOT NULL
+    """
+    history = ' UNION ALL '.join(events.format(loans=loans, reservations=reservations)
+                                 for loans, reservations in (('borrowings', 'reservations'),
+                                                             ('borrowings_archive', 'reservations_archive')))
+    conn.execute("DELETE FROM circulation_monthly")
+    conn.execute(f"""
+        INSERT INTO circulation_monthly (month, genre, loans, returns, loan_days, late_returns,
+                                         reservations, fulfilled, expired, wait_days)
+        SELECT e.month, COALESCE(b.genre, ''), SUM(e.loans), SUM(e.returns), SUM(e.loan_days),
+               SUM(e.late_returns), SUM(e.reservations), SUM(e.fulfilled), SUM(e.expired), SUM(e.wait_days)
+        FROM ({history}) e
+        JOIN books b ON b.id = e.book_id
+        GROUP BY e.month, COALESCE(b.genre, '')
+    """)
+
+def _job_queue(conn):
+    # Durable background jobs, see jobs.py. Only pending work and dead
+    # letters stay in the table; workers look for due work through the
+    # partial index, which also covers running jobs whose lease lapsed.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('queued', 'running', 'dead')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            last_error TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_after, id)
+        WHERE status IN ('queued', 'running')
+    """)
+    # Member inbox written by notifications.py. Older databases already have
+    # this table from before migrations were tracked.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            is_read BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id, id)")
+
+def _sessions(conn):
+    # Server-side sessions, see sessions.py. Looked up by id on every
+    # request, deleted by user on revocation and by deadline when swept.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            data TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)")
+
+def _local_catalog_version(conn):
+    # catalog_version.changed_at was stamped in UTC by the triggers of
+    # migration 11, while every other time column holds local time (see
+    # timestamps.py). Restamp the triggers in local time and convert the
+    # stored value.
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f"DROP TRIGGER IF EXISTS books_version_{event.lower()}")
+        conn.execute(f"""
+            CREATE TRIGGER books_version_{event.lower()} AFTER {event} ON books BEGIN
+                UPDATE catalog_version
+                SET version = version + 1, changed_at = strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')
+                WHERE id = 1;
+            END
+        """)
+    conn.execute("""
+        UPDATE catalog_version SET changed_at = strftime('%Y-%m-%d %H:%M:%S', changed_at, 'localtime')
+    """)
+
+def _notification_times(conn):
+    # notifications.created_at defaulted to CURRENT_TIMESTAMP, which is UTC;
+    # every other time column holds local time and notify() always binds it.
+    # Rebuild the table without the default and convert rows that relied on
+    # it, which can only predate migration 16 (the first to write here).
+    applied = conn.execute("SELECT applied_at FROM schema_version WHERE version = 16").fetchone()[0]
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'notifications'").fetchone()
+    conn.execute("""
+        CREATE TABLE notifications_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            is_read BOOLEAN NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    # Only rows older than both readings of that time are converted, so a
+    # local row is never shifted; west of UTC, default rows from the last
+    # few hours before the upgrade cannot be told apart and stay as they are.
+    # A value strftime cannot read (empty, or some other format) gets the
+    # upgrade time, as a missing one does, instead of failing NOT NULL.
+    conn.execute("""
+        INSERT INTO notifications_new (id, user_id, message, is_read, created_at)
+        SELECT id, user_id, message, COALESCE(is_read, 0), CASE
+            WHEN created_at IS NULL THEN :applied
+            WHEN created_at < min(:applied, strftime('%Y-%m-%d %H:%M:%S', :applied, 'utc'))
+                THEN COALESCE(strftime('%Y-%m-%d %H:%M:%S', created_at, 'localtime'), :applied)
+            ELSE COALESCE(strftime('%Y-%m-%d %H:%M:%S', created_at), :applied)
+        END
+        FROM notifications
+    """, {'applied': applied})
+    conn.execute("DROP TABLE notifications")
+    conn.execute("ALTER TABLE notifications_new RENAME TO notifications")
+    if seq is not None:
+        conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'notifications'", (seq[0],))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id, id)")
+
+# (version, name, function). Append new migrations; never edit applied ones.
+MIGRATIONS = [
+    (1, 'initial schema', _initial_schema),
+    (2, 'reservation queue position', _reservation_queue_position),
+    (3, 'secondary indexes', _secondary_indexes),
+    (4, 'books full-text index', _books_full_text_index),
+    (5, 'books sort indexes', _books_sort_indexes),
+    (6, 'maintained book availability', _book_availability),
+    (7, 'loan and queue constraints', _loan_and_queue_constraints),
+    (8, 'reservation holds', _reservation_holds),
+    (9, 'members listing index', _members_listing_index),
+    (10, 'history archive', _history_archive),
+    (11, 'catalog version', _catalog_version),
+    (12, 'loan due dates and fines', _loan_due_dates),
+    (13, 'canonical timestamps', _canonical_timestamps),
+    (14, 'recommendations', _recommendations),
+    (15, 'circulation rollups', _circulation_rollups),
+    (16, 'job queue and notifications', _job_queue),
+    (17, 'server-side sessions', _sessions),
+    (18, 'local catalog version times', _local_catalog_version),
+    (19, 'local notification times', _notification_times),
+]
+
+def _ensure_version_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for a new database)."""
+    _ensure_version_table(conn)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(conn, target=None):
+    """Apply every pending migration up to target (default: latest). Returns the new version."""
+    version = current_version(conn)
+    for number, name, func in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            func(conn)
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                         (number, name, datetime.now().isoformat(sep=' ', timespec='seconds')))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise MigrationError(f"Migration {number} ({name}) failed: {e}") from e
+        version = number
+    return version
+
+def hot_queries():
+    """{name: (sql, params, tables allowed a full scan)} for the statements on the request path.
+
+    The SQL is the modules' own, so the plan check and query_bench.py see
+    exactly what runs; the parameters are representative. Imported here
+    rather than at the top because database imports this module.
+    """
+    import analytics
+    import archive
+    import database
+    import jobs
+    import loans
+    import notifications
+    import recommendations
+    import reservations
+    import search
+    import sessions
+    from pagination import keyset_clause
+
+    def keyset_page(template, sort_expr, id_expr, cursor, backwards=False, **fields):
+        keyset, order, params = keyset_clause(sort_expr, id_expr, cursor, backwards=backwards)
+        return template.format(keyset=f'AND {keyset}', order=order, **fields), params
+
+    books_keyset, books_order, books_params = keyset_clause('b.title', 'b.id', ('m', 0))
+    books_list = database.BOOKS_PAGE_SQL.format(sort_key='b.title', where=f'WHERE {books_keyset}',
+                                                order=books_order)
+    books_search, books_search_params = keyset_page(database.BOOKS_SEARCH_SQL, search.RANK, 'b.id', (-1.0, 0),
+                                                    sort_key=search.RANK)
+    members_keyset, members_order, members_params = keyset_clause('u.username', 'u.id', ('m', 0))
+    history, history_params = keyset_page(database.MEMBER_HISTORY_SQL, 'bo.borrow_date', 'bo.id',
+                                          ('2030-01-01', 0), backwards=True)
+    overdue, overdue_params = keyset_page(database.OVERDUE_PAGE_SQL, 'bo.due_date', 'bo.id', ('', 0))
+    return {
+        'books.list': (books_list, (*books_params, 6), set()),
+        'books.search': (books_search, ('"a"*', *books_search_params, 6), set()),
+        'books.search_count': (search.COUNT_SQL, ('"a"*',), set()),
+        'members.list': (database.MEMBERS_PAGE_SQL.format(
+            conditions=f"u.role = 'Member' AND {members_keyset}", order=members_order),
+            (*members_params, 21), set()),
+        'members.history': (history, (1, *history_params, 21), set()),
+        'members.open_loan_count': (database.OPEN_LOAN_COUNT_SQL, (1,), set()),
+        'borrowings.open_by_user': (database.BORROWED_BOOKS_SQL, (1,), set()),
+        'borrowings.history_by_user': (database.BORROWING_HISTORY_SQL, (1,), set()),
+        'borrowings.open_for_book': (database.OPEN_LOAN_FOR_BOOK_SQL, (1,), set()),
+        'borrowings.open_loan': (database.OPEN_LOAN_SQL, (1, 1), set()),
+        'borrowings.return': (database.RETURN_SQL, ('2024-01-01', 1), set()),
+        'books.lend': (database.LEND_SQL, (1, 1, 1), set()),
+        'reservations.existing': (database.ACTIVE_RESERVATION_SQL, (1, 1), set()),
+        'reservations.queue_tail': (reservations.QUEUE_TAIL_SQL, (1,), set()),
+        'reservations.queue_head': (reservations.QUEUE_HEAD_SQL, (1,), set()),
+        'reservations.due_holds': (reservations.DUE_HOLDS_SQL, ('2024-01-01', 100), set()),
+        'reservations.by_book': (database.RESERVATIONS_BY_BOOK_SQL, (1,), set()),
+        'reservations.by_user': (database.RESERVATIONS_BY_USER_SQL, (1,), set()),
+        'archive.closed_borrowings': (archive.CLOSED_BORROWINGS_SQL, ('2024-01-01', 500), set()),
+        'archive.finished_reservations': (archive.FINISHED_RESERVATIONS_SQL, ('2024-01-01', 500), set()),
+        'loans.policy': (loans.POLICY_SQL, (1, 1), {'p'}),
+        'loans.overdue_scan': (loans.OVERDUE_SCAN_SQL, ('2024-01-01', '', 0, 500), set()),
+        'loans.overdue_report': (overdue, ('2024-01-01', *overdue_params, 51), set()),
+        'recommendations.similar': (recommendations.SIMILAR_SQL.format(marks='?,?,?'), (1, 2, 3, 3), set()),
+        'recommendations.member': (recommendations.MEMBER_SQL, (1, 10), set()),
+        'recommendations.popular': (recommendations.POPULAR_SQL, (10,), set()),
+        'recommendations.popular_window': (recommendations.POPULAR_WINDOW_SQL, ('2024-01-01', 10), set()),
+        'recommendations.co_borrows': (recommendations.CO_BORROWS_SQL, (1,), set()),
+        'analytics.by_month': (analytics.SUMMARY_SQL.format(group=analytics.GROUPINGS['month']),
+                               ('2024-01', '2024-12'), set()),
+        'analytics.by_month_genre': (analytics.SUMMARY_SQL.format(group=analytics.GROUPINGS['month_genre']),
+                                     ('2024-01', '2024-12'), set()),
+        'jobs.claim': (jobs.CLAIM_SQL, ('2024-01-01 00:05:00', '2024-01-01 00:00:00'), set()),
+        'notifications.inbox': (notifications.INBOX_SQL, (1, 50), set()),
+        'sessions.by_user': (sessions.REVOKE_USER_SQL, (1,), set()),
+        'sessions.sweep': (sessions.SWEEP_SQL, ('2024-01-01 00:00:00', 100), set()),
+    }
+
+def query_plan(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def unindexed_queries(conn, queries=None):
+    """Return {name: [plan lines]} for hot queries that fall back to a full table scan.
+
+    Scans of a subquery's rows, such as 'SCAN (subquery-2)', are not table scans.
+    """
+    problems = {}
+    for name, (sql, params, allowed_scans) in (queries or hot_queries()).items():
+        plan = query_plan(conn, sql, params)
+        scans = [line for line in plan
+                 if line.startswith('SCAN ') and ' USING ' not in line and 'VIRTUAL TABLE' not in line
+                 and not line.split()[1].startswith('(') and line.split()[1] not in allowed_scans]
+        if scans:
+            problems[name] = plan
+    return problems
+
+def main(argv=None):
+    import database
+
+    argv = sys.argv[1:] if argv is None else argv
+    database.DATABASE = os.environ.get('LIBRARY_DATABASE', database.DATABASE)
+    database.init_db()
+    conn = database.get_backend().connect()
+    print(f"{database.DATABASE}: schema version {current_version(conn)}")
+    if '--check' in argv:
+        for name, (sql, params, _) in hot_queries().items():
+            print(f"\n{name}")
+            for line in query_plan(conn, sql, params):
+                print(f"  {line}")
+        problems = unindexed_queries(conn)
+        conn.close()
+        if problems:
+            print(f"\nFull scans in: {', '.join(sorted(problems))}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
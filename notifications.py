@@ -0,0 +1,115 @@
+"""Member notifications: an in-app inbox, plus email and webhook delivery.
+
+Requests never notify anyone themselves. Handing a returned book to the
+next member in its queue (reservations.hand_off) and the first charge on
+an overdue loan (loans.assess_overdue) each queue a job in the same
+transaction. The job's handler writes the inbox row and, when SMTP_HOST or
+WEBHOOK_URL is configured, queues one delivery job per channel. If a mail
+server or webhook endpoint is down, the job queue retries that delivery
+without repeating the others.
+"""
+import json
+import smtplib
+import urllib.request
+from datetime import datetime
+from email.message import EmailMessage
+
+import jobs
+
+SMTP_HOST = None
+SMTP_PORT = 25
+MAIL_FROM = 'library@localhost'
+WEBHOOK_URL = None
+TIMEOUT = 10.0
+INBOX_SIZE = 50
+
+def configure(smtp_host=None, smtp_port=None, mail_from=None, webhook_url=None, timeout=None):
+    """Set where notifications are delivered. Leave a channel unset to keep only the inbox."""
+    global SMTP_HOST, SMTP_PORT, MAIL_FROM, WEBHOOK_URL, TIMEOUT
+    SMTP_HOST = smtp_host or SMTP_HOST
+    SMTP_PORT = smtp_port or SMTP_PORT
+    MAIL_FROM = mail_from or MAIL_FROM
+    WEBHOOK_URL = webhook_url or WEBHOOK_URL
+    TIMEOUT = timeout or TIMEOUT
+
+# Newest first, off idx_notifications_user.
+INBOX_SQL = """
+    SELECT id, message, is_read, created_at FROM notifications
+    WHERE user_id = ? ORDER BY id DESC LIMIT ?
+"""
+
+def notify(db, user_id, message, now=None):
+    """Put a message in a member's inbox and queue its delivery. Runs in the caller's transaction."""
+    now = now or datetime.now()
+    notification_id = db.execute("""
+        INSERT INTO notifications (user_id, message, created_at) VALUES (?, ?, ?)
+    """, (user_id, message, now)).lastrowid
+    if SMTP_HOST:
+        jobs.enqueue(db, 'send_email', {'notification_id': notification_id}, now=now)
+    if WEBHOOK_URL:
+        jobs.enqueue(db, 'post_webhook', {'notification_id': notification_id}, now=now)
+    return notification_id
+
+def inbox(db, user_id, limit=INBOX_SIZE):
+    """A member's latest notifications, newest first."""
+    return db.execute(INBOX_SQL, (user_id, limit)).fetchall()
+
+def mark_read(db, user_id):
+    """Mark all of a member's notifications as read."""
+    db.execute("UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0", (user_id,))
+
+@jobs.register('hold_ready', transactional=True)
+def hold_ready(db, payload):
+    hold = db.execute("""
+        SELECT r.user_id, r.hold_expires, b.title
+        FROM reservations r JOIN books b ON b.id = r.book_id
+        WHERE r.id = ? AND r.status = 'Ready'
+    """, (payload['reservation_id'],)).fetchone()
+    # Already borrowed or lapsed by the time the job ran: nothing to say.
+    if hold is not None:
+        notify(db, hold['user_id'],
+               f"'{hold['title']}' is waiting for you. Borrow it by {str(hold['hold_expires'])[:16]}.")
+
+@jobs.register('overdue_reminder', transactional=True)
+def overdue_reminder(db, payload):
+    loan = db.execute("""
+        SELECT bo.user_id, bo.due_date, b.title
+        FROM borrowings bo JOIN books b ON b.id = bo.book_id
+        WHERE bo.id = ? AND bo.return_date IS NULL
+    """, (payload['borrowing_id'],)).fetchone()
+    if loan is not None:
+        notify(db, loan['user_id'],
+               f"'{loan['title']}' was due on {str(loan['due_date'])[:10]}. Please return it.")
+
+def _recipient(db, notification_id):
+    return db.execute("""
+        SELECT n.id, n.message, n.created_at, u.id AS user_id, u.username, u.name, u.email
+        FROM notifications n JOIN users u ON u.id = n.user_id
+        WHERE n.id = ?
+    """, (notification_id,)).fetchone()
+
+@jobs.register('send_email')
+def send_email(db, payload):
+    row = _recipient(db, payload['notification_id'])
+    if row is None or not row['email'] or not SMTP_HOST:
+        return
+    message = EmailMessage()
+    message['From'] = MAIL_FROM
+    message['To'] = row['email']
+    message['Subject'] = 'Library notice'
+    message.set_content(f"Hello {row['name'] or row['username']},\n\n{row['message']}\n")
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=TIMEOUT) as smtp:
+        smtp.send_message(message)
+
+@jobs.register('post_webhook')
+def post_webhook(db, payload):
+    row = _recipient(db, payload['notification_id'])
+    if row is None or not WEBHOOK_URL:
+        return
+    body = json.dumps({'id': row['id'], 'user_id': row['user_id'], 'username': row['username'],
+                       'message': row['message'], 'created_at': str(row['created_at'])}).encode()
+    request = urllib.request.Request(WEBHOOK_URL, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    # urlopen raises on a 4xx or 5xx reply, which sends the job round for a retry.
+    with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+        response.read()
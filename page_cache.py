@@ -0,0 +1,109 @@
+"""Fragment and response caching for catalog pages.
+
+Both caches are keyed on the catalog version, a counter in the
+catalog_version table that triggers on books bump on every insert, update
+and delete (migration 11). A write never has to find and purge the entries
+it affects: the next request reads the new version, misses, and the stale
+entries age out of the LRU.
+
+Catalog pages also show the popular and also-borrowed lists, which
+the recommendation refresher rebuilds on its own timer without touching the
+catalog version, so their key and ETag come from books_version(): the
+catalog version plus the time of the last recommendation refresh.
+
+Fragments are the query results behind a page and are shared by every
+viewer. Pages are the rendered HTML, keyed additionally by whatever in the
+session changes the markup (role, and member id for members).
+"""
+import hashlib
+from datetime import timezone
+
+import database
+import recommendations
+from cache import LRUCache
+from pagination import CountCache
+
+PAGE_CACHE_MAX_ENTRIES = 2048
+PAGE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+FRAGMENT_CACHE_MAX_ENTRIES = 2048
+FRAGMENT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+CACHE_TTL = 300.0
+BOOK_COUNT_TTL = 30.0
+
+def catalog_version(db):
+    """Return (version, changed_at) for the catalog; changed_at is an aware UTC datetime."""
+    row = db.execute(
+        'SELECT version, changed_at AS "changed_at [timestamp]" FROM catalog_version WHERE id = 1').fetchone()
+    if row is None:
+        return 0, None
+    # Stored in local time, like every timestamp; HTTP dates want UTC.
+    return row['version'], row['changed_at'].astimezone(timezone.utc)
+
+def books_version(db):
+    """Return (version, changed_at) for catalog pages, which include the recommendations.
+
+    version is (catalog version, last refresh marker); changed_at is the
+    later of the two changes, as an aware UTC datetime.
+    """
+    version, changed_at = catalog_version(db)
+    row = db.execute(
+        'SELECT refreshed_at AS "refreshed_at [timestamp]" FROM recommendation_state WHERE id = 1').fetchone()
+    refreshed_at = row['refreshed_at'] if row is not None else None
+    if refreshed_at is None:
+        return (version, None), changed_at
+    refreshed_at = refreshed_at.astimezone(timezone.utc)
+    changed_at = max(changed_at, refreshed_at) if changed_at else refreshed_at
+    return (version, refreshed_at.isoformat()), changed_at
+
+def make_etag(*parts):
+    """A short stable hash of the parts that determine a response body."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+def fragment_size(fragment):
+    """Rough in-memory size of a cached fragment, for the byte limit."""
+    size = 256
+    for row in fragment.get('books', ()):
+        size += 64 + sum(len(str(value)) for value in row.values())
+    return size
+
+def page_size(page):
+    return len(page)
+
+page_cache = LRUCache(PAGE_CACHE_MAX_ENTRIES, CACHE_TTL, max_bytes=PAGE_CACHE_MAX_BYTES,
+                      sizeof=page_size)
+fragment_cache = LRUCache(FRAGMENT_CACHE_MAX_ENTRIES, CACHE_TTL,
+                          max_bytes=FRAGMENT_CACHE_MAX_BYTES, sizeof=fragment_size)
+# Totals shown under the catalog pages, keyed by search expression.
+book_counts = CountCache(ttl=BOOK_COUNT_TTL)
+
+def books_fragment(version, search, sort, per_page, after, before):
+    """The fragment behind one catalog page, shared by /books and the API.
+
+    version is the first part of books_version().
+
+    Holds the get_books_page() result plus the precomputed popular list (on
+    the unfiltered first page) and each book's also-borrowed list.
+    """
+    def load():
+        fragment = database.get_books_page(search, sort, per_page, after, before, counts=book_counts)
+        db = database.get_db()
+        fragment['popular'] = recommendations.popular(db, 5) if fragment['first_page'] and not search else []
+        fragment['also_borrowed'] = recommendations.similar(db, [book['id'] for book in fragment['books']])
+        return fragment
+    return fragment_cache.get_or_load((version, search, sort, per_page, after, before), load)
+
+def configure(max_page_bytes=None, max_fragment_bytes=None, ttl=None, count_ttl=None):
+    """Apply app config to the module caches. Setting a byte limit to 0 disables that cache."""
+    if count_ttl is not None:
+        book_counts.ttl = count_ttl
+    for cache, max_bytes in ((page_cache, max_page_bytes), (fragment_cache, max_fragment_bytes)):
+        if max_bytes is not None:
+            cache.max_bytes = max_bytes
+            if max_bytes <= 0:
+                cache.max_entries = 0
+            cache.clear()
+        if ttl is not None:
+            cache.ttl = ttl
+
+def stats():
+    return {'pages': page_cache.stats(), 'fragments': fragment_cache.stats()}
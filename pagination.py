@@ -0,0 +1,76 @@
+"""Keyset (cursor) pagination helpers and a cache for expensive row counts.
+
+A cursor is the (sort value, id) pair of the last row on a page, encoded as
+an opaque URL-safe token. The next page is ``WHERE (sort, id) > cursor``,
+which an index on the sort column answers directly however deep the page.
+"""
+import base64
+import binascii
+import json
+import threading
+import time
+
+def encode_cursor(values):
+    """Encode a row's sort key values as a URL-safe token."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, size=2):
+    """Decode a token from encode_cursor(). Returns None for anything malformed."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+def keyset_clause(sort_expr, id_expr, cursor, backwards=False):
+    """Build the WHERE fragment, ORDER BY fragment and parameters for one page.
+
+    Paging backwards flips the comparison and ordering; the caller reverses
+    the fetched rows to restore display order.
+    """
+    op, direction = ('<', 'DESC') if backwards else ('>', 'ASC')
+    order = f"{sort_expr} {direction}, {id_expr} {direction}"
+    if cursor is None:
+        return '', order, ()
+    return f"({sort_expr}, {id_expr}) {op} (?, ?)", order, tuple(cursor)
+
+class CountCache:
+    """Time-bounded cache of COUNT(*) results keyed by query.
+
+    Totals on a paginated page are informational, so a count a few seconds
+    stale is fine and saves a full scan on every page view.
+    """
+
+    def __init__(self, ttl=30.0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (value, now + self.ttl)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
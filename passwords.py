@@ -0,0 +1,121 @@
+"""Password hashing on a small bounded worker pool.
+
+generate_password_hash and check_password_hash are deliberately slow key
+derivation functions. Running them on the request thread lets a burst of
+logins occupy every worker, so they run here instead, on HASH_WORKERS
+threads (hashlib's KDFs release the GIL while they work). At most
+HASH_QUEUE_DEPTH requests may wait for a worker; beyond that HashPoolBusy
+is raised straight away and the caller answers 503 instead of queueing
+unbounded work.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHOD = 'scrypt'  # werkzeug method string, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'
+HASH_WORKERS = 2
+HASH_QUEUE_DEPTH = 16
+HASH_TIMEOUT = 10.0
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing queue is full or a hash did not finish in time."""
+
+class HashPool:
+    """A fixed set of hashing threads with a cap on how many jobs may wait for them."""
+
+    def __init__(self, workers=HASH_WORKERS, queue_depth=HASH_QUEUE_DEPTH, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashPoolBusy("Too many sign-in requests in progress, try again shortly.")
+        with self._lock:
+            self.pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._done()
+            raise
+        future.add_done_callback(lambda f: self._done())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise HashPoolBusy("Password check timed out, try again shortly.")
+
+    def _done(self):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'method': HASH_METHOD,
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure(method=None, workers=None, queue_depth=None, timeout=None):
+    """Set the hash cost and pool limits. Call before the first hash; an existing pool is replaced."""
+    global HASH_METHOD, HASH_WORKERS, HASH_QUEUE_DEPTH, HASH_TIMEOUT, _pool
+    HASH_METHOD = method or HASH_METHOD
+    HASH_WORKERS = workers or HASH_WORKERS
+    HASH_QUEUE_DEPTH = HASH_QUEUE_DEPTH if queue_depth is None else queue_depth
+    HASH_TIMEOUT = timeout or HASH_TIMEOUT
+    with _pool_lock:
+        old, _pool = _pool, None
+    if old is not None:
+        old.shutdown(wait=False)
+
+def shutdown():
+    """Finish queued hashes and stop the hashing threads."""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, None
+    if old is not None:
+        old.shutdown()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashPool(HASH_WORKERS, HASH_QUEUE_DEPTH, HASH_TIMEOUT)
+        return _pool
+
+def hash_password(password):
+    """Hash a password with HASH_METHOD on the hashing pool."""
+    return get_pool().run(generate_password_hash, password, HASH_METHOD)
+
+def check_password(stored_hash, password):
+    """Verify a password against a stored werkzeug hash on the hashing pool."""
+    if not stored_hash:
+        return False
+    return get_pool().run(check_password_hash, stored_hash, password)
+
+def pool_stats():
+    return get_pool().stats()
@@ -0,0 +1,91 @@
+"""In-process token-bucket rate limiting.
+
+Each key (an account name, a client address) gets a bucket of `capacity`
+tokens that refills at `rate` tokens per second. A request spends one
+token; when the bucket is empty the caller is told how long to wait.
+Buckets that have refilled completely carry no information and are
+dropped, so memory stays proportional to the keys active recently.
+"""
+import threading
+import time
+
+class TokenBucketLimiter:
+    """Per-key token buckets. capacity=0 disables the limiter."""
+
+    def __init__(self, capacity, rate, max_keys=100000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, key, now=None):
+        """Spend a token for key. Returns 0 if allowed, else seconds until a token is available."""
+        if self.capacity <= 0:
+            return 0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                self.allowed += 1
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            self.limited += 1
+            return (1 - tokens) / self.rate
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _prune(self, now):
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'rate': self.rate,
+                'keys': len(self._buckets),
+                'allowed': self.allowed,
+                'limited': self.limited,
+            }
+
+LOGIN_ACCOUNT_BURST = 5
+LOGIN_ACCOUNT_RATE = 1 / 30.0
+LOGIN_IP_BURST = 20
+LOGIN_IP_RATE = 1.0
+
+# Login attempts, limited per account name (password guessing) and per
+# client address (credential stuffing across many accounts).
+login_by_account = TokenBucketLimiter(LOGIN_ACCOUNT_BURST, LOGIN_ACCOUNT_RATE)
+login_by_ip = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_RATE)
+
+def configure_login(account_burst=None, account_rate=None, ip_burst=None, ip_rate=None):
+    if account_burst is not None:
+        login_by_account.capacity = account_burst
+    if account_rate is not None:
+        login_by_account.rate = account_rate
+    if ip_burst is not None:
+        login_by_ip.capacity = ip_burst
+    if ip_rate is not None:
+        login_by_ip.rate = ip_rate
+
+def check_login(username, address):
+    """Spend a login token for the address and the account. Returns 0, or seconds to wait."""
+    return login_by_ip.acquire(address) or login_by_account.acquire(username)
+
+def login_succeeded(username):
+    """Forget failed attempts against an account once its owner signs in."""
+    login_by_account.reset(username)
+
+def login_stats():
+    return {'by_account': login_by_account.stats(), 'by_ip': login_by_ip.stats()}
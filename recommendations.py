@@ -0,0 +1,259 @@
+"""Popularity and "members who borrowed this also borrowed" recommendations.
+
+Borrowing history is a sparse member x book matrix. Its co-occurrence
+matrix (how many members read both a and b) is kept in co_borrows, one row
+per non-zero cell, with book_readers holding each book's column total.
+Pages never compute anything: they read precomputed top-K lists by primary
+key from similar_books (per book), member_recommendations (per member) and
+popular_books (loans in the last POPULAR_DAYS).
+
+refresh() is incremental. It reads the loans added since the
+last_borrowing_id watermark, adds one to the co-borrow count of each newly
+read book with each of the member's MAX_HISTORY previous books, re-ranks
+the lists of the newly read books and their readers, and merges the new
+pair scores into the partner books' lists. rebuild() recomputes everything
+from the full history in SQL; it gives the same counts, and also re-ranks
+the entries whose scores drifted as readership grew. A book's similarity
+to another is cosine: both / sqrt(readers_a * readers_b), so bestsellers do
+not crowd every list.
+
+Lists are joined to books on read, so a deleted book drops out; rebuild()
+removes its rows.
+
+    python recommendations.py            # catch up on new loans
+    python recommendations.py --rebuild  # recompute from all history
+"""
+import math
+from collections import Counter
+from datetime import datetime, timedelta
+
+TOP_K = 10
+MAX_HISTORY = 100
+POPULAR_DAYS = 30
+REFRESH_INTERVAL = 300
+REFRESH_BATCH = 500
+
+# A member's distinct books in the order they first read them, newest first.
+PREVIOUS_READS_SQL = """
+    SELECT book_id FROM borrowing_history
+    WHERE user_id = ? AND id < ?
+    GROUP BY book_id
+    ORDER BY MIN(id) DESC
+    LIMIT ?
+"""
+
+# A book's co-borrowed partners with their readership, for the cosine score.
+CO_BORROWS_SQL = """
+    SELECT c.other_id, c.members, r.members AS readers
+    FROM co_borrows c JOIN book_readers r ON r.book_id = c.other_id
+    WHERE c.book_id = ?
+"""
+
+# The most borrowed books since a cutoff, ranked into popular_books.
+POPULAR_WINDOW_SQL = """
+    INSERT INTO popular_books (rank, book_id, loans)
+    SELECT ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC, book_id), book_id, COUNT(*)
+    FROM borrowings WHERE borrow_date >= ?
+    GROUP BY book_id
+    ORDER BY COUNT(*) DESC, book_id
+    LIMIT ?
+"""
+
+# Reads of the precomputed lists; SIMILAR_SQL takes one mark per book in {marks}.
+POPULAR_SQL = """
+    SELECT b.id, b.title, b.author, b.status, p.loans
+    FROM popular_books p JOIN books b ON b.id = p.book_id
+    WHERE p.rank <= ? ORDER BY p.rank
+"""
+SIMILAR_SQL = """
+    SELECT s.book_id AS for_book, b.id, b.title, b.author
+    FROM similar_books s JOIN books b ON b.id = s.other_id
+    WHERE s.book_id IN ({marks}) AND s.rank <= ?
+    ORDER BY s.book_id, s.rank
+"""
+MEMBER_SQL = """
+    SELECT b.id, b.title, b.author, b.status
+    FROM member_recommendations m JOIN books b ON b.id = m.book_id
+    WHERE m.user_id = ? AND m.rank <= ? ORDER BY m.rank
+"""
+
+def _previously_read(db, user_id, book_id, borrowing_id):
+    return db.execute("""
+        SELECT 1 FROM borrowing_history WHERE user_id = ? AND book_id = ? AND id < ? LIMIT 1
+    """, (user_id, book_id, borrowing_id)).fetchone() is not None
+
+def _scored_neighbours(db, book_id, readers, others=None):
+    """[(score, other_id)] from co_borrows for book_id, optionally only for the books in others."""
+    sql = CO_BORROWS_SQL
+    params = [book_id]
+    if others is not None:
+        sql += f" AND c.other_id IN ({','.join('?' * len(others))})"
+        params.extend(others)
+    return [(row['members'] / math.sqrt(readers * row['readers']), row['other_id'])
+            for row in db.execute(sql, params)]
+
+def _write_similar(db, book_id, scored):
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    db.execute("DELETE FROM similar_books WHERE book_id = ?", (book_id,))
+    db.executemany("INSERT INTO similar_books (book_id, rank, other_id, score) VALUES (?, ?, ?, ?)",
+                   ((book_id, rank, other_id, score) for rank, (score, other_id) in enumerate(scored[:TOP_K], 1)))
+
+def _readers(db, book_id):
+    row = db.execute("SELECT members FROM book_readers WHERE book_id = ?", (book_id,)).fetchone()
+    return row['members'] if row else 0
+
+def _rank_similar(db, book_ids):
+    """Re-rank the top-K similar_books list of each book in book_ids from all of its co_borrows."""
+    for book_id in book_ids:
+        readers = _readers(db, book_id)
+        _write_similar(db, book_id, _scored_neighbours(db, book_id, readers) if readers else [])
+
+def _merge_similar(db, book_id, changed):
+    """Fold fresh scores for the books in changed into book_id's current top-K list.
+
+    Cheaper than _rank_similar for a book whose own readership did not
+    change; the other entries keep their scores until the next re-rank.
+    """
+    current = db.execute("SELECT other_id, score FROM similar_books WHERE book_id = ?", (book_id,)).fetchall()
+    fresh = _scored_neighbours(db, book_id, _readers(db, book_id), list(changed))
+    if (len(current) == TOP_K and not any(row['other_id'] in changed for row in current)
+            and max(fresh, default=(0.0,))[0] <= min(row['score'] for row in current)):
+        return  # nothing new makes the list
+    _write_similar(db, book_id, [(row['score'], row['other_id']) for row in current
+                                 if row['other_id'] not in changed] + fresh)
+
+def _rank_member(db, user_id):
+    """Rewrite a member's recommendations: neighbours of their recent books they have not read."""
+    db.execute("DELETE FROM member_recommendations WHERE user_id = ?", (user_id,))
+    db.execute("""
+        INSERT INTO member_recommendations (user_id, rank, book_id, score)
+        SELECT ?, ROW_NUMBER() OVER (ORDER BY SUM(s.score) DESC, s.other_id), s.other_id, SUM(s.score)
+        FROM (SELECT book_id FROM borrowing_history WHERE user_id = ?
+              GROUP BY book_id ORDER BY MIN(id) DESC LIMIT ?) h
+        JOIN similar_books s ON s.book_id = h.book_id
+        WHERE s.other_id NOT IN (SELECT book_id FROM borrowing_history WHERE user_id = ?)
+        GROUP BY s.other_id
+        ORDER BY SUM(s.score) DESC, s.other_id
+        LIMIT ?
+    """, (user_id, user_id, MAX_HISTORY, user_id, TOP_K))
+
+def rank_popular(db, now=None):
+    """Replace popular_books with the most borrowed books of the last POPULAR_DAYS."""
+    since = (now or datetime.now()) - timedelta(days=POPULAR_DAYS)
+    db.execute("DELETE FROM popular_books")
+    db.execute(POPULAR_WINDOW_SQL, (since, TOP_K))
+
+def refresh(db, now=None, limit=REFRESH_BATCH):
+    """Fold up to limit new loans into the recommendations. Must run in the caller's transaction.
+
+    Returns the number of loans processed; 0 means the tables are up to date.
+    """
+    watermark = db.execute("SELECT last_borrowing_id FROM recommendation_state WHERE id = 1").fetchone()[0]
+    loans = db.execute("SELECT id, user_id, book_id FROM borrowings WHERE id > ? ORDER BY id LIMIT ?",
+                       (watermark, limit)).fetchall()
+    if not loans:
+        return 0
+    pairs = Counter()
+    readers = Counter()
+    members = set()
+    for loan in loans:
+        if _previously_read(db, loan['user_id'], loan['book_id'], loan['id']):
+            continue
+        readers[loan['book_id']] += 1
+        members.add(loan['user_id'])
+        for row in db.execute(PREVIOUS_READS_SQL, (loan['user_id'], loan['id'], MAX_HISTORY)):
+            pairs[loan['book_id'], row['book_id']] += 1
+            pairs[row['book_id'], loan['book_id']] += 1
+    db.executemany("""
+        INSERT INTO book_readers (book_id, members) VALUES (?, ?)
+        ON CONFLICT (book_id) DO UPDATE SET members = members + excluded.members
+    """, readers.items())
+    db.executemany("""
+        INSERT INTO co_borrows (book_id, other_id, members) VALUES (?, ?, ?)
+        ON CONFLICT (book_id, other_id) DO UPDATE SET members = members + excluded.members
+    """, ((a, b, n) for (a, b), n in pairs.items()))
+    # Books with new readers are re-ranked; their partners only gained one pair each.
+    _rank_similar(db, readers)
+    partners = {}
+    for a, b in pairs:
+        if a not in readers:
+            partners.setdefault(a, set()).add(b)
+    for book_id, changed in partners.items():
+        _merge_similar(db, book_id, changed)
+    for user_id in members:
+        _rank_member(db, user_id)
+    rank_popular(db, now)
+    db.execute("UPDATE recommendation_state SET last_borrowing_id = ?, refreshed_at = ? WHERE id = 1",
+               (loans[-1]['id'], now or datetime.now()))
+    return len(loans)
+
+def rebuild(db, now=None):
+    """Recompute every table from the whole borrowing history. Must run in the caller's transaction."""
+    for table in ('co_borrows', 'book_readers', 'similar_books', 'member_recommendations'):
+        db.execute(f"DELETE FROM {table}")
+    # seq numbers each member's distinct books in the order first read, so a
+    # book pairs with the MAX_HISTORY books read before it, as in refresh().
+    db.execute("DROP TABLE IF EXISTS temp.reads")
+    db.execute("""
+        CREATE TEMP TABLE reads AS
+        SELECT user_id, book_id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY MIN(id)) AS seq
+        FROM borrowing_history
+        WHERE book_id IN (SELECT id FROM books)
+        GROUP BY user_id, book_id
+    """)
+    db.execute("CREATE INDEX temp.reads_user_seq ON reads(user_id, seq)")
+    db.execute("INSERT INTO book_readers (book_id, members) SELECT book_id, COUNT(*) FROM reads GROUP BY book_id")
+    db.execute("""
+        INSERT INTO co_borrows (book_id, other_id, members)
+        SELECT book_id, other_id, COUNT(*) FROM (
+            SELECT a.book_id, b.book_id AS other_id FROM reads a
+            JOIN reads b ON b.user_id = a.user_id AND b.seq < a.seq AND b.seq >= a.seq - ?
+            UNION ALL
+            SELECT b.book_id, a.book_id FROM reads a
+            JOIN reads b ON b.user_id = a.user_id AND b.seq < a.seq AND b.seq >= a.seq - ?
+        )
+        GROUP BY book_id, other_id
+    """, (MAX_HISTORY, MAX_HISTORY))
+    _rank_similar(db, [row[0] for row in db.execute("SELECT book_id FROM book_readers")])
+    for row in db.execute("SELECT DISTINCT user_id FROM reads").fetchall():
+        _rank_member(db, row[0])
+    db.execute("DROP TABLE temp.reads")
+    rank_popular(db, now)
+    db.execute("""
+        UPDATE recommendation_state
+        SET last_borrowing_id = (SELECT COALESCE(MAX(id), 0) FROM borrowing_history), refreshed_at = ?
+        WHERE id = 1
+    """, (now or datetime.now(),))
+
+def popular(db, limit=TOP_K):
+    """The most borrowed books right now, as a list of dicts."""
+    return [dict(row) for row in db.execute(POPULAR_SQL, (limit,))]
+
+def similar(db, book_ids, limit=3):
+    """{book_id: [books other readers of it also borrowed]} for each of book_ids."""
+    book_ids = list(book_ids)
+    result = {book_id: [] for book_id in book_ids}
+    if not book_ids:
+        return result
+    sql = SIMILAR_SQL.format(marks=','.join('?' * len(book_ids)))
+    for row in db.execute(sql, (*book_ids, limit)):
+        result[row['for_book']].append({'id': row['id'], 'title': row['title'], 'author': row['author']})
+    return result
+
+def for_member(db, user_id, limit=TOP_K):
+    """Books recommended to a member; members without history get the popular list."""
+    books = [dict(row) for row in db.execute(MEMBER_SQL, (user_id, limit))]
+    return books or popular(db, limit)
+
+if __name__ == '__main__':
+    import sys
+
+    import database
+
+    database.init_db()
+    if '--rebuild' in sys.argv[1:]:
+        database.run_transaction(rebuild)
+        print("recommendations rebuilt")
+    else:
+        print(f"{database.refresh_recommendations()} new loans processed")
+    database.close_db()
@@ -0,0 +1,103 @@
+"""Reservation queue engine.
+
+Each book has a FIFO queue of 'Pending' reservations. queue_position is a
+per-book sequence number: it is assigned once on enqueue and never
+rewritten, so taking the head or appending a member is a single lookup on
+the (book_id, queue_position) partial index. The position shown to a member
+is their rank among pending reservations, counted over the same index,
+which gives a compacted queue without renumbering rows.
+
+When a loan is returned, the head of the queue becomes a 'Ready' hold. The
+book goes 'On Hold' for that member until they borrow it ('Fulfilled') or
+the hold lapses ('Expired'), at which point the next member is handed the
+book in the same transaction.
+"""
+from datetime import datetime, timedelta
+
+import jobs
+
+HOLD_DAYS = 3
+SWEEP_INTERVAL = 60
+SWEEP_BATCH = 100
+
+ACTIVE_STATUSES = ('Pending', 'Ready')
+
+# Rank of a pending reservation within its book's queue.
+POSITION_SQL = """
+    (SELECT COUNT(*) FROM reservations q
+     WHERE q.book_id = r.book_id AND q.status = 'Pending' AND q.queue_position <= r.queue_position)
+"""
+
+# The ends of a book's queue, both read off the (book_id, queue_position) partial index.
+QUEUE_TAIL_SQL = """
+    SELECT MAX(queue_position) FROM reservations
+    WHERE book_id = ? AND status = 'Pending'
+"""
+QUEUE_HEAD_SQL = """
+    SELECT id, user_id, queue_position FROM reservations
+    WHERE book_id = ? AND status = 'Pending'
+    ORDER BY queue_position LIMIT 1
+"""
+
+DUE_HOLDS_SQL = """
+    SELECT id, book_id FROM reservations
+    WHERE status = 'Ready' AND hold_expires < ?
+    ORDER BY hold_expires LIMIT ?
+"""
+
+def next_queue_position(db, book_id):
+    """Sequence number for a new reservation at the tail of book_id's queue."""
+    last = db.execute(QUEUE_TAIL_SQL, (book_id,)).fetchone()[0]
+    return (last or 0) + 1
+
+def queue_rank(db, book_id, queue_position):
+    """1-based place in the queue of the pending reservation with this sequence number."""
+    return db.execute("""
+        SELECT COUNT(*) FROM reservations
+        WHERE book_id = ? AND status = 'Pending' AND queue_position <= ?
+    """, (book_id, queue_position)).fetchone()[0]
+
+def hand_off(db, book_id, now=None):
+    """Give a newly free book to the head of its queue, or make it available.
+
+    Must run inside the caller's transaction, which also queues a notice to
+    the member. Returns the reservation row that became a hold, or None.
+    """
+    now = now or datetime.now()
+    head = db.execute(QUEUE_HEAD_SQL, (book_id,)).fetchone()
+    if head is None:
+        db.execute("""
+            UPDATE books SET status = 'Available', held_for = NULL
+            WHERE id = ? AND status != 'Borrowed'
+        """, (book_id,))
+        return None
+    db.execute("""
+        UPDATE reservations SET status = 'Ready', hold_expires = ?
+        WHERE id = ?
+    """, (now + timedelta(days=HOLD_DAYS), head['id']))
+    db.execute("""
+        UPDATE books SET status = 'On Hold', held_for = ?
+        WHERE id = ?
+    """, (head['user_id'], book_id))
+    jobs.enqueue(db, 'hold_ready', {'reservation_id': head['id']}, now=now)
+    return head
+
+def fulfil_hold(db, book_id, user_id, now=None):
+    """Mark user_id's hold on book_id as fulfilled. Returns True if there was one."""
+    return db.execute("""
+        UPDATE reservations SET status = 'Fulfilled', fulfilled_date = ?
+        WHERE book_id = ? AND user_id = ? AND status = 'Ready'
+    """, (now or datetime.now(), book_id, user_id)).rowcount > 0
+
+def expire_due_holds(db, now=None, limit=SWEEP_BATCH):
+    """Expire up to limit lapsed holds and pass each book on. Returns the number expired.
+
+    Only the 'Ready' rows past their deadline are read, through the
+    idx_reservations_hold_expiry partial index.
+    """
+    now = now or datetime.now()
+    due = db.execute(DUE_HOLDS_SQL, (now, limit)).fetchall()
+    for hold in due:
+        db.execute("UPDATE reservations SET status = 'Expired' WHERE id = ?", (hold['id'],))
+        hand_off(db, hold['book_id'], now)
+    return len(due)
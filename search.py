@@ -0,0 +1,81 @@
+"""Full-text search over the book catalog, backed by the books_fts FTS5 table.
+
+The index itself is created by migration 4 and kept in sync with ``books`` by
+triggers. This module turns what a user types into an FTS5 query and rebuilds
+the index when needed.
+
+    python search.py --rebuild
+"""
+import re
+import sys
+
+SEARCH_FIELDS = ('title', 'author', 'genre')
+
+# bm25() weights for title, author and genre: a title hit ranks highest.
+RANK = "bm25(books_fts, 10.0, 5.0, 1.0)"
+
+_TERM = re.compile(r'(\w+):("[^"]*"|\S+)|("[^"]*"|\S+)')
+_WORD = re.compile(r'\w+')
+
+def _prefix_terms(text):
+    return [f'"{word}"*' for word in _WORD.findall(text)]
+
+def match_expression(text):
+    """Translate a search box entry into an FTS5 MATCH expression.
+
+    Every word is prefix-matched and all words must match. ``field:value``
+    restricts a word to title, author or genre. Returns None when the text
+    contains nothing searchable.
+    """
+    clauses = []
+    for field, value, plain in _TERM.findall(text or ''):
+        if field and field.lower() in SEARCH_FIELDS:
+            clauses.extend(f"{field.lower()} : {term}" for term in _prefix_terms(value))
+        else:
+            clauses.extend(_prefix_terms(plain or f"{field} {value}"))
+    return ' AND '.join(clauses) or None
+
+def search_books(db, text, limit=20, offset=0):
+    """Return books matching text, best match first."""
+    match = match_expression(text)
+    if match is None:
+        return []
+    return db.execute(f"""
+        SELECT b.*
+        FROM books_fts f
+        JOIN books b ON b.id = f.rowid
+        WHERE books_fts MATCH ?
+        ORDER BY {RANK}
+        LIMIT ? OFFSET ?
+    """, (match, limit, offset)).fetchall()
+
+# The total shown above a page of search results.
+COUNT_SQL = "SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH ?"
+
+def count_matches(db, match):
+    """Count the rows matching an expression from match_expression()."""
+    return db.execute(COUNT_SQL, (match,)).fetchone()[0]
+
+def rebuild_index(db):
+    """Rebuild books_fts from the books table and optimize its b-trees."""
+    db.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+    db.execute("INSERT INTO books_fts(books_fts) VALUES ('optimize')")
+    db.commit()
+
+def main(argv=None):
+    import database
+
+    argv = sys.argv[1:] if argv is None else argv
+    if '--rebuild' not in argv:
+        print("usage: python search.py --rebuild")
+        return 2
+    database.init_db()
+    db = database.get_db()
+    rebuild_index(db)
+    total = db.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+    database.close_db()
+    print(f"Rebuilt search index for {total} books.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Production server: a pre-forked set of threaded WSGI worker processes.
+
+The parent applies migrations once, binds the listening socket and forks
+--workers processes that share it. Each worker builds the app with
+create_app() after the fork, so connection pools, caches and threads are
+never shared between processes, and serves requests on --threads threads.
+Only the first worker runs the background jobs (WAL checkpointer, hold
+sweeper, overdue scanner, job queue workers); jobs queued by the others
+wait for its next poll. A worker that dies is replaced.
+
+SIGTERM or SIGINT shuts down gracefully: workers stop accepting, finish
+the requests in flight, stop their background jobs and close their pooled
+connections; the parent waits up to --grace seconds before killing them.
+
+Configuration comes from LIBRARY_* environment variables (see
+app.load_config). Sessions live in the database (sessions.py), so users
+stay signed in across workers and restarts; LIBRARY_SESSION_STORE=memory
+is only for a single worker.
+
+    LIBRARY_SECRET_KEY=change-me python serve.py --workers 4 --port 8000
+
+Platforms without os.fork() run a single worker process.
+"""
+import argparse
+import os
+import secrets
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+KEEPALIVE_TIMEOUT = 15
+
+class RequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections give their thread back after this many seconds.
+    timeout = KEEPALIVE_TIMEOUT
+
+class QuietRequestHandler(RequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def _cpu_count():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+class ThreadCappedServer(ThreadedWSGIServer):
+    """ThreadedWSGIServer with a bounded number of request threads that are joined on close."""
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, *args, threads=8, **kwargs):
+        self._slots = threading.BoundedSemaphore(threads)
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+def run_worker(sock, index, threads, quiet):
+    """Serve on sock until SIGTERM/SIGINT, then shut down cleanly. Runs in the child."""
+    import app as app_module
+
+    app = app_module.create_app({'MIGRATE_ON_START': False, 'BACKGROUND_JOBS': index == 0})
+    host, port = sock.getsockname()[:2]
+    handler = QuietRequestHandler if quiet else RequestHandler
+    server = ThreadCappedServer(host, port, app, handler, fd=sock.fileno(), threads=threads)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        app_module.shutdown_app()
+
+def _signal_all(pids, signum):
+    for pid in list(pids):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+def _spawn(sock, index, args):
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        status = 0
+        try:
+            run_worker(sock, index, args.threads, args.quiet)
+        except BaseException as e:
+            print(f"worker {index} failed: {e!r}", file=sys.stderr)
+            status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=os.environ.get('LIBRARY_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('LIBRARY_PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('LIBRARY_WORKERS', _cpu_count())))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('LIBRARY_THREADS', 8)),
+                        help="Concurrent requests per worker.")
+    parser.add_argument('--backlog', type=int, default=128)
+    parser.add_argument('--grace', type=float, default=30.0,
+                        help="Seconds to let workers finish in-flight requests on shutdown.")
+    parser.add_argument('--quiet', action='store_true', help="Do not log each request.")
+    args = parser.parse_args(argv)
+
+    if not os.environ.get('LIBRARY_SECRET_KEY'):
+        # One key for all workers, so anything Flask signs is valid on each of them.
+        os.environ['LIBRARY_SECRET_KEY'] = secrets.token_hex(32)
+
+    import app as app_module
+    import database
+    app_module.load_config()
+    database.init_db()
+
+    family = socket.AF_INET6 if ':' in args.host else socket.AF_INET
+    sock = socket.create_server((args.host, args.port), family=family, backlog=args.backlog)
+    sock.set_inheritable(True)
+    print(f"serving on http://{args.host}:{sock.getsockname()[1]} "
+          f"with {args.workers} worker(s) x {args.threads} thread(s)")
+
+    if not hasattr(os, 'fork') or args.workers <= 1:
+        run_worker(sock, 0, args.threads, args.quiet)
+        return 0
+
+    workers = {}
+    deadline = None
+
+    def stop(signum, frame):
+        nonlocal deadline
+        if deadline is None:
+            deadline = time.monotonic() + args.grace
+            _signal_all(workers, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        workers[_spawn(sock, index, args)] = index
+    # Poll rather than block in waitpid, which resumes after a signal handler runs.
+    while workers:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if not pid:
+            if deadline is not None and time.monotonic() > deadline:
+                _signal_all(workers, signal.SIGKILL)
+                deadline = float('inf')
+            time.sleep(0.1)
+            continue
+        index = workers.pop(pid, None)
+        if index is not None and deadline is None:
+            print(f"worker {index} (pid {pid}) exited with status {status}; restarting", file=sys.stderr)
+            time.sleep(1)
+            workers[_spawn(sock, index, args)] = index
+    sock.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""Server-side sessions that can be revoked.
+
+The session cookie holds only a random 256-bit id. The session data lives
+in a SessionStore, keyed by that id, together with the id of the user it
+belongs to and an idle deadline of app.permanent_session_lifetime. A
+lookup is one dictionary or primary key read. Each store also indexes
+sessions by user, so revoke_user() signs a member out everywhere at once,
+for example when their account is deleted, and their next request finds
+no session at all.
+
+Expiry is lazy. An expired session is dropped when it is looked up, and
+after every SWEEP_EVERY new sessions the store deletes up to SWEEP_BATCH
+expired ones. The idle deadline is only pushed back once half of it has gone,
+so most requests that do not change the session write nothing. Logging
+in or out issues a fresh id, so an id planted before login is useless
+afterwards.
+
+Two stores are included:
+- SQLiteSessionStore keeps sessions in the sessions table, shared by every
+  worker process. It is the default.
+- MemorySessionStore is an LRU dictionary for single-process servers and
+  checks; revoking there only reaches the current process.
+"""
+import secrets
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from database import ConnectionPool
+
+MAX_ENTRIES = 100000
+POOL_SIZE = 4
+SWEEP_EVERY = 100
+SWEEP_BATCH = 100
+
+# Statements on the sessions table that touch more than one row.
+REVOKE_USER_SQL = "DELETE FROM sessions WHERE user_id = ?"
+SWEEP_SQL = """
+    DELETE FROM sessions WHERE id IN (
+        SELECT id FROM sessions WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)
+"""
+
+class SessionStore:
+    """Where session records live. Subclasses implement every method."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._saves = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.revoked = 0
+        self.swept = 0
+
+    def load(self, sid, now):
+        """(data, expires) for a live session, or None. An expired session is deleted."""
+        raise NotImplementedError
+
+    def create(self, sid, user_id, data, expires):
+        raise NotImplementedError
+
+    def update(self, sid, data, expires):
+        """Replace an existing session's data. Returns False if it was revoked or expired meanwhile."""
+        raise NotImplementedError
+
+    def touch(self, sid, expires):
+        """Push back an unchanged session's deadline."""
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def revoke_user(self, user_id):
+        """Delete every session of user_id. Returns how many."""
+        raise NotImplementedError
+
+    def sweep(self, now, limit=SWEEP_BATCH):
+        """Delete up to limit expired sessions. Returns how many."""
+        raise NotImplementedError
+
+    def size(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def _saved(self, now):
+        """Called after each create; sweeps every SWEEP_EVERY of them."""
+        with self._lock:
+            self._saves += 1
+            due = self._saves % SWEEP_EVERY == 0
+        if due:
+            self._count('swept', self.sweep(now))
+
+    def stats(self):
+        size = self.size()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'store': type(self).__name__,
+                'sessions': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'expired': self.expired,
+                'revoked': self.revoked,
+                'swept': self.swept,
+            }
+
+class MemorySessionStore(SessionStore):
+    """Sessions in an LRU dictionary plus a per-user index of ids, for one process.
+
+    Holding more than max_entries sessions evicts the least recently used,
+    which signs that member out. A lookup moves the session to the end, so
+    the oldest sessions, which are the ones most likely to have expired,
+    are at the front where sweep() looks for them.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._sessions = OrderedDict()  # sid -> [user_id, data, expires]
+        self._by_user = {}
+
+    def _drop(self, sid):
+        user_id = self._sessions.pop(sid)[0]
+        sids = self._by_user.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._by_user[user_id]
+
+    def load(self, sid, now):
+        with self._lock:
+            record = self._sessions.get(sid)
+            if record is None:
+                self.misses += 1
+                return None
+            if record[2] <= now:
+                self._drop(sid)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(sid)
+            self.hits += 1
+            return record[1], record[2]
+
+    def create(self, sid, user_id, data, expires):
+        with self._lock:
+            self._sessions[sid] = [user_id, data, expires]
+            self._by_user.setdefault(user_id, set()).add(sid)
+            while len(self._sessions) > self.max_entries:
+                self._drop(next(iter(self._sessions)))
+                self.evictions += 1
+        self._saved(datetime.now())
+
+    def update(self, sid, data, expires):
+        with self._lock:
+            record = self._sessions.get(sid)
+            if record is None:
+                return False
+            record[1], record[2] = data, expires
+            return True
+
+    def touch(self, sid, expires):
+        with self._lock:
+            record = self._sessions.get(sid)
+            if record is not None:
+                record[2] = expires
+
+    def delete(self, sid):
+        with self._lock:
+            if sid in self._sessions:
+                self._drop(sid)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            sids = self._by_user.pop(user_id, set())
+            for sid in sids:
+                del self._sessions[sid]
+            self.revoked += len(sids)
+            return len(sids)
+
+    def sweep(self, now, limit=SWEEP_BATCH):
+        removed = 0
+        with self._lock:
+            while self._sessions and removed < limit:
+                sid, record = next(iter(self._sessions.items()))
+                if record[2] > now:
+                    break
+                self._drop(sid)
+                removed += 1
+        return removed
+
+    def size(self):
+        return len(self._sessions)
+
+    def stats(self):
+        return dict(super().stats(), max_entries=self.max_entries, evictions=self.evictions)
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in the sessions table, shared by every process using the database.
+
+    The store checks connections out of its own small pool for each
+    operation, so a session read or write never waits for the request's
+    pooled connection or joins its transaction, and the number of open
+    connections stays bounded however many threads the server starts.
+    """
+
+    def __init__(self, backend, pool_size=POOL_SIZE):
+        super().__init__()
+        self.pool = ConnectionPool(backend, pool_size)
+
+    @contextmanager
+    def _db(self):
+        conn = self.pool.checkout()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    def _write(self, sql, params):
+        with self._db() as db:
+            count = db.execute(sql, params).rowcount
+            db.commit()
+        return count
+
+    def load(self, sid, now):
+        with self._db() as db:
+            row = db.execute('SELECT data, expires_at AS "expires_at [timestamp]" FROM sessions WHERE id = ?',
+                             (sid,)).fetchone()
+            if row is not None and row[1] <= now:
+                db.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+                db.commit()
+                self._count('expired')
+                row = None
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return row[0], row[1]
+
+    def create(self, sid, user_id, data, expires):
+        self._write("INSERT INTO sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)",
+                    (sid, user_id, data, expires))
+        self._saved(datetime.now())
+
+    def update(self, sid, data, expires):
+        return self._write("UPDATE sessions SET data = ?, expires_at = ? WHERE id = ?", (data, expires, sid)) > 0
+
+    def touch(self, sid, expires):
+        self._write("UPDATE sessions SET expires_at = ? WHERE id = ?", (expires, sid))
+
+    def delete(self, sid):
+        self._write("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def revoke_user(self, user_id):
+        count = self._write(REVOKE_USER_SQL, (user_id,))
+        self._count('revoked', count)
+        return count
+
+    def sweep(self, now, limit=SWEEP_BATCH):
+        return self._write(SWEEP_SQL, (now, limit))
+
+    def size(self):
+        with self._db() as db:
+            return db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self):
+        return dict(super().stats(), pool=self.pool.stats())
+
+    def close(self):
+        self.pool.close()
+
+class ServerSession(SecureCookieSession):
+    """A session loaded from a store. user_id is its owner as loaded, to notice a login or logout."""
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires = expires
+        self.user_id = (initial or {}).get('user_id')
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface over a SessionStore."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            record = self.store.load(sid, datetime.now())
+            if record is not None:
+                data, expires = record
+                return ServerSession(self.serializer.loads(data), sid, expires)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        now = datetime.now()
+        lifetime = app.permanent_session_lifetime
+        if session.modified or session.sid is None:
+            data = self.serializer.dumps(dict(session))
+            user_id = session.get('user_id')
+            if session.sid is not None and user_id == session.user_id:
+                if not self.store.update(session.sid, data, now + lifetime):
+                    # Revoked while this request ran; don't bring it back.
+                    response.delete_cookie(name, domain=domain, path=path)
+                return
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            sid = secrets.token_urlsafe(32)
+            self.store.create(sid, user_id, data, now + lifetime)
+            response.set_cookie(name, sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        elif session.expires - now < lifetime / 2:
+            self.store.touch(session.sid, now + lifetime)
+
+STORES = {
+    'sqlite': lambda config, backend: SQLiteSessionStore(backend, config.get('SESSION_POOL_SIZE', POOL_SIZE)),
+    'memory': lambda config, backend: MemorySessionStore(config.get('SESSION_MAX_ENTRIES', MAX_ENTRIES)),
+}
+
+def init_app(app, backend):
+    """Install the store named by SESSION_STORE, keeping SQLite sessions in backend's database."""
+    kind = app.config.get('SESSION_STORE', 'sqlite')
+    if kind not in STORES:
+        raise ValueError(f"Unknown session store: {kind}")
+    app.session_interface = ServerSessionInterface(STORES[kind](app.config, backend))
+    return app.session_interface.store
+
+def revoke_user(user_id):
+    """Sign user_id out of every session in the current app's store. Returns how many."""
+    return current_app.session_interface.store.revoke_user(user_id)
+
+def stats():
+    return current_app.session_interface.store.stats()
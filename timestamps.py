@@ -0,0 +1,42 @@
+"""Canonical timestamp storage.
+
+Every date column holds text in one shape, ``YYYY-MM-DD HH:MM:SS`` in
+local time with whole seconds, so values compare and sort correctly as
+strings and range conditions can use an index on the column. Importing
+this module registers an sqlite3 adapter that writes datetime parameters
+in that shape, and a ``timestamp`` converter; a query gets datetimes back
+by naming the type on the column, e.g.
+``SELECT r.reservation_date AS "reservation_date [timestamp]"``, on a
+connection opened with ``detect_types=DETECT_TYPES``.
+
+That is the only conversion on read. Elsewhere the text itself is the
+value: templates show its first ten characters as the date, cursors and
+the JSON API carry it unchanged, and comparing it with a bound datetime
+is a string comparison that agrees with time order. Code that needs date
+arithmetic asks for a datetime, or calls parse_timestamp().
+benchmarks/migration_check.py checks that every time column holds this
+form after the migrations and after the application writes to it.
+"""
+import sqlite3
+from datetime import date, datetime
+
+FORMAT = '%Y-%m-%d %H:%M:%S'
+DETECT_TYPES = sqlite3.PARSE_COLNAMES
+
+def format_timestamp(value):
+    """The stored form of a datetime."""
+    return value.strftime(FORMAT)
+
+def parse_timestamp(value):
+    """A datetime from a stored value; also accepts legacy dates and microseconds."""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.decode() if isinstance(value, bytes) else value)
+
+def now():
+    """The current local time, truncated to what is stored."""
+    return datetime.now().replace(microsecond=0)
+
+sqlite3.register_adapter(datetime, format_timestamp)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter('timestamp', parse_timestamp)
@@ -0,0 +1,11 @@
+"""WSGI entry point for any WSGI server, e.g. ``gunicorn -w 4 wsgi:app``.
+
+Run ``python migrations.py`` once before starting the workers and set
+LIBRARY_MIGRATE_ON_START=false so they do not all migrate at import.
+Give every worker the same LIBRARY_SECRET_KEY, and keep the default
+LIBRARY_SESSION_STORE=sqlite so they all see the same sessions. serve.py
+does all of this without extra dependencies.
+"""
+from app import create_app
+
+app = create_app()